@@ -2,7 +2,14 @@
 
 usage() {
 echo "Usage: "
-echo "  `basename $0` <IMAGENAME> [<BUCKETNAME>]"  
+echo "  `basename $0` <IMAGENAME> [<BUCKETNAME>] [<PWB_VERSION>]"  
+echo ""
+echo "  <PWB_VERSION> bakes the Workbench payloads of that version into the image,"
+echo "  PWB_SHA256SUMS in the environment can point to a SHA256SUMS file to verify them"
+echo "  (local file, https:// or s3:// URL, a local file is uploaded to the bucket)."
+echo ""
+echo "  R_META_CACHE_S3 in the environment keeps the R repository metadata cache in S3"
+echo "  between builds, R_META_OFFLINE=true builds from that cache without downloading metadata."
 }
 
 if [ -z $1 ]; then 
@@ -22,11 +29,23 @@ if [ -z $2 ]; then
    fi
 fi
 
+pwb_version=$3
+
+# install-pwb.sh runs on the ImageBuilder instance, hand a local checksum file over via S3
+if [ -n "$PWB_SHA256SUMS" ] && [ -f "$PWB_SHA256SUMS" ]; then
+   aws s3 cp $PWB_SHA256SUMS s3://$bucketname/image/SHA256SUMS-$pwb_version
+   PWB_SHA256SUMS=s3://$bucketname/image/SHA256SUMS-$pwb_version
+fi
+
 tmpdir=`mktemp -d`
  
 for i in install*.sh *.R
 do
-sed "s/BUCKETNAME/$bucketname/" $i > $tmpdir/$i
+sed "s/BUCKETNAME/$bucketname/" $i | \
+    sed "s#^PWB_VERSION=\"\"#PWB_VERSION=\"$pwb_version\"#" | \
+    sed "s#^PWB_SHA256SUMS=\"\"#PWB_SHA256SUMS=\"$PWB_SHA256SUMS\"#" | \
+    sed "s#^R_META_CACHE_S3=\"\"#R_META_CACHE_S3=\"$R_META_CACHE_S3\"#" | \
+    sed "s#^R_META_OFFLINE=\"\"#R_META_OFFLINE=\"$R_META_OFFLINE\"#" > $tmpdir/$i
 aws s3 cp $tmpdir/$i s3://$bucketname/image/$i
 done
 
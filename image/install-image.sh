@@ -12,6 +12,11 @@ APPTAINER_VERSION="1.4.3"
 
 QUARTO_VERSION="1.9.3"
 
+# Workbench payloads baked into the image (optional, set by build-image.sh),
+#  PWB_SHA256SUMS can point to a SHA256SUMS file to verify them against
+PWB_VERSION=""
+PWB_SHA256SUMS=""
+
 function setup_something() {
 # $1 - script to be run
 # $2 - parameters
@@ -49,7 +54,28 @@ setup_something install-apptainer.sh $APPTAINER_VERSION
 # Install NVIDIA Driver
 setup_something install-nvidia.sh 
 
-# Cronjob to ensure login nodes are set up 
-#  and service restarts can be automated via state fles
-(crontab -l ; echo "0-59/1 * * * * /opt/rstudio/scripts/rc.pwb")| crontab -
+# Install Posit Workbench payloads
+if [ -n "$PWB_VERSION" ]; then
+    setup_something install-pwb.sh $PWB_VERSION $PWB_SHA256SUMS
+fi
+
+# Agent to ensure login nodes are set up 
+#  and service restarts can be automated via state files.
+#  pwb_agent.py is published to the shared /opt/rstudio by the head node,
+#  until then the service keeps restarting.
+cat << EOF > /etc/systemd/system/pwb-agent.service
+[Unit]
+Description=Posit Workbench login node readiness agent
+After=remote-fs.target
+StartLimitIntervalSec=0
+
+[Service]
+ExecStart=/usr/bin/python3 /opt/rstudio/scripts/pwb_agent.py run
+Restart=always
+RestartSec=5
+
+[Install]
+WantedBy=multi-user.target
+EOF
+systemctl enable pwb-agent
 
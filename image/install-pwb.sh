@@ -0,0 +1,61 @@
+#!/bin/bash
+
+# Bake the Workbench server and session payloads of a given version into the image.
+#
+# $1 - PWB_VERSION, e.g. 2025.12.0-daily-286.pro1
+# $2 - optional SHA256SUMS file (https:// or s3:// URL) the payloads are verified against,
+#      build-image.sh uploads a local file to s3://<BUCKETNAME>/image first
+#
+# The payloads are kept in /opt/pwb-payloads/<PWB_VERSION> together with their
+# checksums, Workbench is installed but not enabled. Once everything is in
+# place, /opt/pwb-payloads/baked-version is written, config-compute.sh and
+# config-login.sh skip download and installation when it matches the
+# PWB_VERSION of the cluster.
+
+set -e
+
+PWB_VERSION=$1
+PWB_SHA256SUMS=$2
+
+PAYLOAD_DIR=/opt/pwb-payloads/$PWB_VERSION
+
+SESSION_PAYLOAD=rsp-session-jammy-${PWB_VERSION}-amd64.tar.gz
+SERVER_PAYLOAD=rstudio-workbench-${PWB_VERSION}-amd64.deb
+
+# OS dependencies of the session components (cf. config-compute.sh) and gdebi for the server
+apt-get install -y curl gdebi-core libcurl4-gnutls-dev libssl-dev libpq5 rrdtool
+
+mkdir -p $PAYLOAD_DIR
+pushd $PAYLOAD_DIR
+curl -fsSL -O https://s3.amazonaws.com/rstudio-ide-build/session/jammy/amd64/$SESSION_PAYLOAD
+curl -fsSL -O https://s3.amazonaws.com/rstudio-ide-build/server/jammy/amd64/$SERVER_PAYLOAD
+
+if [ -n "$PWB_SHA256SUMS" ]; then
+    case $PWB_SHA256SUMS in
+        s3://*) aws s3 cp $PWB_SHA256SUMS expected.sha256 ;;
+        http*) curl -fsSL -o expected.sha256 $PWB_SHA256SUMS ;;
+        *) echo "$PWB_SHA256SUMS is neither an s3:// nor an https:// URL"; exit 1 ;;
+    esac
+    grep -E "  ($SESSION_PAYLOAD|$SERVER_PAYLOAD)\$" expected.sha256 > SHA256SUMS
+    if [ `wc -l < SHA256SUMS` -ne 2 ]; then
+        echo "$PWB_SHA256SUMS does not list both payloads of $PWB_VERSION"
+        exit 1
+    fi
+    sha256sum -c SHA256SUMS
+    rm -f expected.sha256
+else
+    sha256sum $SESSION_PAYLOAD $SERVER_PAYLOAD > SHA256SUMS
+fi
+
+# Same uid/gid as config-login.sh, the home directories are on shared storage
+getent group rstudio-server >& /dev/null || groupadd --system --gid 900 rstudio-server
+getent passwd rstudio-server >& /dev/null || \
+    useradd -s /bin/bash -m --system --gid rstudio-server --uid 900 rstudio-server
+
+# Full server install, it includes the session components. The services are
+# started by config-login.sh on login nodes only.
+gdebi -n $SERVER_PAYLOAD
+systemctl disable --now rstudio-server rstudio-launcher
+popd
+
+echo $PWB_VERSION > /opt/pwb-payloads/baked-version
@@ -10,6 +10,12 @@ exec 2>&1
 R_VERSION_LIST=${@: 2:$#}
 R_VERSION_DEFAULT=${@: 1:1}
 
+# Repository metadata cache of run.R (optional, set by build-image.sh)
+#  R_META_CACHE_S3 - s3:// URL the cache is restored from and saved to
+#  R_META_OFFLINE  - true to only replay the cache, no metadata is downloaded
+R_META_CACHE_S3=""
+R_META_OFFLINE=""
+
 
 echo "R_VERSION_LIST": $R_VERSION_LIST
 echo "R_VERSION_DEFAULT": $R_VERSION_DEFAULT
@@ -27,10 +33,15 @@ apt-get update
 apt-get install -y default-jdk
 fi
 
+# Download all R versions in parallel and install them in one apt transaction
+for R_VERSION in $R_VERSION_LIST
+do
+  curl -sS -O https://cdn.rstudio.com/r/ubuntu-2404/pkgs/r-${R_VERSION}_1_amd64.deb &
+done
+wait
+apt install -y `for R_VERSION in $R_VERSION_LIST; do echo ./r-${R_VERSION}_1_amd64.deb; done`
 for R_VERSION in $R_VERSION_LIST
 do
-  curl -O https://cdn.rstudio.com/r/ubuntu-2404/pkgs/r-${R_VERSION}_1_amd64.deb
-  apt install -y ./r-${R_VERSION}_1_amd64.deb
   rm -f r-${R_VERSION}_1_amd64.deb
 done
 
@@ -40,18 +51,79 @@ done
 #  - setting user agent HTTP headers for getting binary packages
 #  - preinstalling packages needed for the RStudio IDE integration
 # Note: Install will run in parallel to speed up things
+#  - one job per R version, at most R_BUILD_JOBS at a time (default: one job
+#    per 2 cores and 4 GB of available memory)
+#  - all jobs share the pak package cache in R_PKG_CACHE_DIR and the 
+#    repository metadata and helper package cache in R_META_CACHE_DIR
+#  - each job logs to /opt/r-install-<version>.log, a summary is printed at the end
 
 aws s3 cp s3://BUCKETNAME/image/run.R /tmp
 
-PATH_NOW=$PATH
+export R_PKG_CACHE_DIR=${R_PKG_CACHE_DIR:-/var/cache/r-pkg}
+mkdir -p $R_PKG_CACHE_DIR
+
+export R_META_CACHE_DIR=${R_META_CACHE_DIR:-/var/cache/r-meta}
+export R_META_OFFLINE=${R_META_OFFLINE:-false}
+mkdir -p $R_META_CACHE_DIR
+if [ -n "$R_META_CACHE_S3" ]; then
+  aws s3 sync --quiet $R_META_CACHE_S3 $R_META_CACHE_DIR
+fi
+
+if [ -z "$R_BUILD_JOBS" ]; then
+  cores=`nproc`
+  mem_gb=$(( `awk '/^MemAvailable/ {print $2}' /proc/meminfo` / 1024 / 1024 ))
+  R_BUILD_JOBS=$(( cores / 2 < mem_gb / 4 ? cores / 2 : mem_gb / 4 ))
+  [ $R_BUILD_JOBS -lt 1 ] && R_BUILD_JOBS=1
+fi
+echo "R_BUILD_JOBS": $R_BUILD_JOBS
+
+statusdir=`mktemp -d`
+
+function setup_r_version() {
+# $1 - R version, runs run.R and javareconf, writes status to $statusdir/$1
+  local start=`date +%s`
+  PATH=/opt/R/$1/bin:$PATH /opt/R/$1/bin/Rscript /tmp/run.R && \
+	JAVA_HOME=/usr/lib/jvm/java-21-openjdk-amd64/ \
+	  /opt/R/$1/bin/R CMD javareconf 
+  local rc=$?
+  echo "$rc $(( `date +%s` - start ))" > $statusdir/$1
+}
+
+for R_VERSION in $R_VERSION_LIST
+do
+  setup_r_version $R_VERSION > /opt/r-install-${R_VERSION}.log 2>&1 &
+  if [[ $(jobs -r -p | wc -l) -ge $R_BUILD_JOBS ]]; then
+    wait -n
+  fi
+done
+wait
 
+# Assemble r-versions from the entries of all versions in the order given,
+# concurrent runs of run.R may have missed each other's entries
+rsconfigdir=/opt/rstudio/etc/rstudio
 for R_VERSION in $R_VERSION_LIST
 do
-  export PATH=/opt/R/${R_VERSION}/bin:$PATH
-  /opt/R/${R_VERSION}/bin/Rscript /tmp/run.R && \
-	JAVA_HOME=/usr/lib/jvm/java-21-openjdk-amd64/ \
-	  /opt/R/${R_VERSION}/bin/R CMD javareconf 
+  cat $rsconfigdir/r-versions.d/$R_VERSION 2>/dev/null
+done > $rsconfigdir/r-versions.tmp && mv $rsconfigdir/r-versions.tmp $rsconfigdir/r-versions
+
+# Keep the metadata for the next build, an offline build has nothing new
+if [ -n "$R_META_CACHE_S3" ] && [ "$R_META_OFFLINE" != "true" ]; then
+  aws s3 sync --quiet --delete $R_META_CACHE_DIR $R_META_CACHE_S3
+fi
+
+echo "R version setup summary (cache: $R_PKG_CACHE_DIR, `du -sh $R_PKG_CACHE_DIR | cut -f1`," \
+  "metadata cache: $R_META_CACHE_DIR, `du -sh $R_META_CACHE_DIR | cut -f1`, offline: $R_META_OFFLINE)"
+printf "%-10s %-8s %8s %9s %14s  %s\n" version status seconds packages "metadata hits" log
+for R_VERSION in $R_VERSION_LIST
+do
+  read rc secs < $statusdir/$R_VERSION
+  [ "$rc" == "0" ] && status=ok || status="failed"
+  packages=`ls /opt/R/$R_VERSION/lib/R/site-library 2>/dev/null | grep -cv pkg.lock`
+  # run.R ends with "metadata cache: <hits> hits, <downloads> downloads, <stale> stale"
+  hits=`awk '/metadata cache:/ {sub(/.*metadata cache: /, ""); print $1 "/" $1 + $3}' /opt/r-install-${R_VERSION}.log`
+  printf "%-10s %-8s %8s %9s %14s  %s\n" $R_VERSION $status $secs $packages "${hits:--}" /opt/r-install-${R_VERSION}.log
 done
+rm -rf $statusdir
 
 # Defining system default version
 if [ ! -z $R_VERSION_DEFAULT ]; then
@@ -0,0 +1 @@
+"""Benchmarks for the helpers in `pwbtools`, run e.g. via `python3 -m benchmarks.render`."""
@@ -0,0 +1,111 @@
+"""Login node replacement handled by `pwb_alb.Reconciler` against moto.
+
+Starts a login node pool, lets the reconciler register it, then terminates
+some nodes and launches replacements the way ParallelCluster does. Reports
+the number of passes and API calls until target groups, nodes file and hosts
+file converged again, and the convergence time at the given poll interval
+(passes run back to back on a simulated clock). Then checks that a single
+empty DescribeInstances result keeps all targets and nodes, and how long the
+replacement of the whole pool takes with `--confirm-passes`.
+
+Needs `moto` in addition to the repository dependencies (`pip install moto`).
+
+    python3 -m benchmarks.alb_reconcile --nodes 6 --replace 2 --interval 10
+"""
+
+import argparse
+import os
+import tempfile
+from pathlib import Path
+
+import boto3
+
+from benchmarks.alb_registration import CLUSTER, count_calls, setup
+
+import pwb_alb  # noqa: E402  (on sys.path via benchmarks.alb_registration)
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def launch(ec2, subnet: str, count: int):
+    tags = [{"Key": pwb_alb.CLUSTER_TAG, "Value": CLUSTER}, {"Key": pwb_alb.NODE_TYPE_TAG, "Value": pwb_alb.LOGIN_NODE}]
+    instances = ec2.run_instances(ImageId="ami-12c6146b", MinCount=count, MaxCount=count, SubnetId=subnet,
+                                  TagSpecifications=[{"ResourceType": "instance", "Tags": tags}])["Instances"]
+    return [i["InstanceId"] for i in instances]
+
+
+def converge(reconciler, clock, interval, max_passes=10):
+    for n in range(1, max_passes + 1):
+        record = reconciler.step()
+        if record is not None:
+            return n, record
+        clock.now += interval
+    raise RuntimeError(f"no convergence after {max_passes} passes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=6)
+    parser.add_argument("--replace", type=int, default=2)
+    parser.add_argument("--interval", type=float, default=10.0)
+    parser.add_argument("--confirm-passes", type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+    from moto import mock_aws
+    with mock_aws(), tempfile.TemporaryDirectory() as tmp:
+        ec2, elbv2 = boto3.client("ec2"), boto3.client("elbv2")
+        setup(ec2, elbv2, 0)
+        subnet = ec2.describe_subnets()["Subnets"][-1]["SubnetId"]
+        nodes, hosts = Path(tmp) / "nodes", Path(tmp) / "hosts"
+        hosts.write_text("127.0.0.1 localhost\n")
+
+        clock = SimulatedClock()
+        reconciler = pwb_alb.Reconciler(CLUSTER, "example.com", str(nodes), str(hosts), None, ec2, elbv2, clock,
+                                        confirm_passes=args.confirm_passes)
+        calls = count_calls(ec2, elbv2)
+
+        instance_ids = launch(ec2, subnet, args.nodes)
+        for name, event in (("initial pool", None), ("replacement", args.replace)):
+            if event:
+                ec2.terminate_instances(InstanceIds=instance_ids[:event])
+                instance_ids = instance_ids[event:] + launch(ec2, subnet, event)
+            calls.clear()
+            passes, record = converge(reconciler, clock, args.interval)
+            print(f"{name}: +{len(record['added'])} -{len(record['removed'])} nodes, {passes} passes, "
+                  f"{sum(calls.values())} API calls, converged after {record['converged_seconds']:.0f} s "
+                  f"at {args.interval:.0f} s interval")
+
+        # one pass seeing no login nodes, e.g. a transient DescribeInstances result
+        login_nodes = reconciler.login_nodes
+        reconciler.login_nodes = dict
+        reconciler.step()
+        reconciler.login_nodes = login_nodes
+        targets = [len(reconciler.target_states(arn)) for arn in reconciler.groups.values()]
+        print(f"empty result for one pass: {len(pwb_alb.parse_nodes(nodes.read_text()))} nodes in nodes file, "
+              f"{'/'.join(map(str, targets))} targets kept")
+        reconciler.step()
+
+        ec2.terminate_instances(InstanceIds=instance_ids)
+        instance_ids = launch(ec2, subnet, args.nodes)
+        passes, record = converge(reconciler, clock, args.interval)
+        print(f"whole pool replaced: +{len(record['added'])} -{len(record['removed'])} nodes, {passes} passes, "
+              f"converged after {record['converged_seconds']:.0f} s")
+
+        calls.clear()
+        reconciler.step()
+        print(f"steady state: {sum(calls.values())} API calls per pass")
+        print(nodes.read_text(), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""API calls and wall time of login node registration as the pool grows.
+
+Runs the former per-instance approach of install-pwb-config.sh (one
+describe-instances per instance for the nodes file and for each of the two
+target groups, one register-targets per IP and target group) and the batched
+`pwb_alb.TargetRegistrar` against an in-process moto stand-in.
+
+Needs `moto` in addition to the repository dependencies (`pip install moto`).
+
+    python3 -m benchmarks.alb_registration --nodes 2 6 12 24
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+import boto3
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+import pwb_alb  # noqa: E402
+
+CLUSTER = "benchmark"
+
+
+def count_calls(*clients) -> Counter:
+    calls = Counter()
+    for client in clients:
+        client.meta.events.register("before-call.*.*", lambda model, **_: calls.update([model.name]))
+    return calls
+
+
+def setup(ec2, elbv2, nodes: int):
+    vpc = ec2.create_vpc(CidrBlock="10.0.0.0/16")["Vpc"]["VpcId"]
+    subnet = ec2.create_subnet(VpcId=vpc, CidrBlock="10.0.0.0/24")["Subnet"]["SubnetId"]
+    for prefix in pwb_alb.TARGET_GROUP_PREFIXES:
+        elbv2.create_target_group(Name=f"{prefix}-{CLUSTER}", Protocol="HTTP", Port=8787,
+                                  VpcId=vpc, TargetType="ip")
+    instances = ec2.run_instances(ImageId="ami-12c6146b", MinCount=nodes, MaxCount=nodes,
+                                  SubnetId=subnet)["Instances"]
+    return [i["InstanceId"] for i in instances]
+
+
+def legacy(ec2, elbv2, instance_ids):
+    for _ in instance_ids:  # nodes file
+        ec2.describe_instances(Filters=[{"Name": "instance-id", "Values": [_]}])
+    for prefix in pwb_alb.TARGET_GROUP_PREFIXES:
+        groups = elbv2.describe_target_groups()["TargetGroups"]
+        arn = next(g["TargetGroupArn"] for g in groups if g["TargetGroupName"].startswith(prefix))
+        for instance_id in instance_ids:
+            reservations = ec2.describe_instances(
+                Filters=[{"Name": "instance-id", "Values": [instance_id]}])["Reservations"]
+            ip = reservations[0]["Instances"][0]["PrivateIpAddress"]
+            elbv2.register_targets(TargetGroupArn=arn, Targets=[{"Id": ip, "Port": 8787}])
+
+
+def batched(ec2, elbv2, instance_ids):
+    registrar = pwb_alb.TargetRegistrar(CLUSTER, ec2, elbv2)
+    ips = registrar.resolve_ips(instance_ids)
+    pwb_alb.nodes_file(instance_ids, ips, "example.com")
+    for arn in registrar.target_groups().values():
+        registrar.register(arn, list(ips.values()))
+
+
+def run(approach, nodes: int):
+    from moto import mock_aws
+    with mock_aws():
+        ec2, elbv2 = boto3.client("ec2"), boto3.client("elbv2")
+        instance_ids = setup(ec2, elbv2, nodes)
+        calls = count_calls(ec2, elbv2)
+        start = time.perf_counter()
+        approach(ec2, elbv2, instance_ids)
+        return sum(calls.values()), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[2, 6, 12, 24])
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+    print(f"{'nodes':>6} {'legacy calls':>13} {'legacy ms':>10} {'batched calls':>14} {'batched ms':>11}")
+    for nodes in args.nodes:
+        legacy_calls, legacy_time = run(legacy, nodes)
+        batched_calls, batched_time = run(batched, nodes)
+        print(f"{nodes:>6} {legacy_calls:>13} {legacy_time * 1000:>10.1f} "
+              f"{batched_calls:>14} {batched_time * 1000:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Boot-time savings of Workbench payloads baked into the AMI.
+
+`config-compute.sh` and `config-login.sh` record their phases in
+`/opt/rstudio/timeline/<host>.jsonl` on the shared storage (cf.
+`pwbtools/timeline.py`). The `payload` phase notes whether the payloads came
+from the image (`baked`) or were installed from the files downloaded by the
+head node (`download`). This compares the payload phase and the run time of
+the whole script for both paths.
+
+Copy the files from the head node and point this at them, e.g.
+
+    scp -r <HEADNODE>:/opt/rstudio/timeline .
+    python3 -m benchmarks.boot_payloads timeline/
+"""
+
+import argparse
+import statistics
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from pwbtools import timeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", type=Path, nargs="+", help="timeline folders or .jsonl files")
+    args = parser.parse_args()
+
+    events, _ = timeline.read_events(args.paths)
+    spans = [s for s in timeline.pair(events) if s.complete]
+    scripts = {(s.host, s.script, s.start): s for s in spans if s.phase == timeline.SCRIPT_PHASE}
+
+    groups: Dict[Tuple[str, str], List[Tuple[float, float]]] = defaultdict(list)
+    for s in spans:
+        if s.phase != "payload":
+            continue
+        run = next((r for (host, script, _), r in scripts.items()
+                    if host == s.host and script == s.script and r.start <= s.start <= r.end), None)
+        if run is not None:
+            groups[(s.script, s.detail)].append((s.duration, run.duration))
+    if not groups:
+        print("no payload phases found", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"{'script':<18} {'path':<9} {'runs':>5} {'payload p50 s':>14} {'payload p95 s':>14} "
+          f"{'total p50 s':>12} {'total p95 s':>12}")
+    medians = {}
+    for (script, path), runs in sorted(groups.items()):
+        payload = [p for p, _ in runs]
+        total = [t for _, t in runs]
+        medians[(script, path)] = statistics.median(total)
+        print(f"{script:<18} {path:<9} {len(runs):>5} {statistics.median(payload):>14.1f} "
+              f"{timeline.percentile(payload, 95):>14.1f} {statistics.median(total):>12.1f} "
+              f"{timeline.percentile(total, 95):>12.1f}")
+
+    for script in sorted({s for s, _ in groups}):
+        if (script, "baked") in medians and (script, "download") in medians:
+            saved = medians[(script, "download")] - medians[(script, "baked")]
+            print(f"{script}: baked payloads save {saved:.1f} s per node boot (median)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Throughput, memory and completeness of `pwb_logship` on a local directory.
+
+Two phases per `--batch-kb` value, both shipping into a local directory store:
+
+* backlog: `--backlog-mb` of Workbench-like log lines spread over `--files`
+  files are shipped from scratch, reporting MB/s, lines/s, the compression
+  ratio and the largest batch held in memory.
+* live: one writer per file appends `--rate` lines/s for `--seconds` while the
+  files are rotated every `--rotate-every` seconds (`copytruncate` as in the
+  logrotate config of config-login.sh, or `rename`). Afterwards all stored
+  objects are read back and lines missing or shipped twice are counted.
+
+    python3 -m benchmarks.log_shipping --backlog-mb 200 --batch-kb 256 4096
+"""
+
+import argparse
+import gzip
+import json
+import os
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+import pwb_logship  # noqa: E402
+
+LINE = re.compile(rb"file=(\d+) seq=(\d+)")
+
+
+def log_line(file: int, seq: int, size: int) -> bytes:
+    head = (f"2024-05-01T13:00:00.{seq % 1000000:06d}Z [rserver-http] INFO Request handled "
+            f"file={file} seq={seq} ").encode()
+    return head + b"x" * max(0, size - len(head) - 1) + b"\n"
+
+
+def paths(root: Path, files: int) -> List[Path]:
+    result = []
+    for n in range(files):
+        folder = root / ("rstudio-server" if n % 2 == 0 else "launcher")
+        folder.mkdir(parents=True, exist_ok=True)
+        result.append(folder / f"file-{n}.log")
+    return result
+
+
+def shipped(store: Path) -> Counter:
+    lines = Counter()
+    for obj in store.rglob("*.jsonl.gz"):
+        for record in gzip.decompress(obj.read_bytes()).splitlines():
+            match = LINE.search(json.loads(record)["line"].encode())
+            if match:
+                lines[(int(match.group(1)), int(match.group(2)))] += 1
+    return lines
+
+
+def backlog(tmp: Path, args, batch_bytes: int) -> dict:
+    logs = paths(tmp / "log", args.files)
+    lines_per_file = args.backlog_mb * (1 << 20) // args.line_bytes // args.files
+    for n, path in enumerate(logs):
+        with open(path, "wb") as f:
+            f.writelines(log_line(n, i, args.line_bytes) for i in range(lines_per_file))
+    raw = sum(p.stat().st_size for p in logs)
+
+    shipper = pwb_logship.Shipper(pwb_logship.DirectoryStore(tmp / "store"), [str(tmp / "log" / "**" / "*.log")],
+                                  str(tmp / "offsets.json"), "bench", max_batch_bytes=batch_bytes)
+    started = time.perf_counter()
+    while shipper.step():
+        pass
+    shipper.flush()
+    seconds = time.perf_counter() - started
+    return {"seconds": seconds, "mb_s": raw / seconds / (1 << 20), "lines_s": shipper.stats["lines"] / seconds,
+            "ratio": shipper.stats["stored_bytes"] / raw, "objects": shipper.stats["objects"],
+            "peak_kb": shipper.stats["peak_batch_bytes"] / 1024}
+
+
+def live(tmp: Path, args, batch_bytes: int) -> dict:
+    logs = paths(tmp / "log", args.files)
+    locks = [threading.Lock() for _ in logs]
+    written = [0] * len(logs)
+    stop = threading.Event()
+
+    def write(n: int):
+        f = open(logs[n], "ab", buffering=0)
+        interval = 1.0 / args.rate * 100
+        while not stop.is_set():
+            with locks[n]:
+                if os.fstat(f.fileno()).st_ino != logs[n].stat().st_ino:
+                    # renamed by rotate(), like a logger reopening its file
+                    f.close()
+                    f = open(logs[n], "ab", buffering=0)
+                f.write(b"".join(log_line(n, written[n] + i, args.line_bytes) for i in range(100)))
+                written[n] += 100
+            time.sleep(interval)
+        f.close()
+
+    def rotate():
+        generation = 0
+        while not stop.wait(args.rotate_every):
+            generation += 1
+            for n, path in enumerate(logs):
+                rotated = path.with_name(f"{path.name}.{generation}")
+                if args.rotate == "copytruncate":
+                    shutil.copyfile(path, rotated)
+                    os.truncate(path, 0)
+                else:
+                    with locks[n]:
+                        os.rename(path, rotated)
+                        path.touch()
+
+    shipper = pwb_logship.Shipper(pwb_logship.DirectoryStore(tmp / "store"), [str(tmp / "log" / "**" / "*.log")],
+                                  str(tmp / "offsets.json"), "bench", max_batch_bytes=batch_bytes,
+                                  max_batch_age=1.0)
+    shipper_stop = threading.Event()
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(len(logs))]
+    threads.append(threading.Thread(target=rotate))
+    shipping = threading.Thread(target=shipper.run, args=(0.1, shipper_stop))
+    shipping.start()
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    shipper_stop.set()
+    shipping.join()
+    while shipper.step():
+        pass
+    shipper.flush()
+
+    lines = shipped(tmp / "store")
+    expected = {(n, i) for n, count in enumerate(written) for i in range(count)}
+    return {"written": len(expected), "missing": len(expected - lines.keys()),
+            "duplicates": sum(c - 1 for c in lines.values() if c > 1),
+            "truncations": shipper.stats["truncations"], "rotations": shipper.stats["rotations"],
+            "peak_kb": shipper.stats["peak_batch_bytes"] / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--line-bytes", type=int, default=200)
+    parser.add_argument("--backlog-mb", type=int, default=100)
+    parser.add_argument("--batch-kb", type=int, nargs="+", default=[256, 4096])
+    parser.add_argument("--rate", type=float, default=2000, help="lines per second and file in the live phase")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--rotate-every", type=float, default=1.5)
+    parser.add_argument("--rotate", choices=["copytruncate", "rename"], default="copytruncate")
+    args = parser.parse_args()
+
+    print(f"backlog: {args.backlog_mb} MB in {args.files} files, lines of {args.line_bytes} bytes")
+    print(f"{'batch KB':>9} {'seconds':>8} {'MB/s':>7} {'lines/s':>9} {'ratio':>6} {'objects':>8} {'peak KB':>8}")
+    for batch_kb in args.batch_kb:
+        with tempfile.TemporaryDirectory() as tmp:
+            r = backlog(Path(tmp), args, batch_kb << 10)
+        print(f"{batch_kb:>9} {r['seconds']:>8.2f} {r['mb_s']:>7.1f} {r['lines_s']:>9.0f} {r['ratio']:>6.3f} "
+              f"{r['objects']:>8} {r['peak_kb']:>8.0f}")
+
+    print(f"\nlive: {args.files} writers at {args.rate:.0f} lines/s for {args.seconds:.0f} s, "
+          f"{args.rotate} every {args.rotate_every} s")
+    print(f"{'batch KB':>9} {'written':>8} {'missing':>8} {'duplicates':>11} {'truncations':>12} {'rotations':>10} "
+          f"{'peak KB':>8}")
+    for batch_kb in args.batch_kb:
+        with tempfile.TemporaryDirectory() as tmp:
+            r = live(Path(tmp), args, batch_kb << 10)
+        print(f"{batch_kb:>9} {r['written']:>8} {r['missing']:>8} {r['duplicates']:>11} {r['truncations']:>12} "
+              f"{r['rotations']:>10} {r['peak_kb']:>8.0f}")
+    print(f"\nmax RSS of this process: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Reaction time and idle cost of `pwb_agent` on a local directory.
+
+Lays out a fake /opt/rstudio tree, runs the agent in dry-run mode and
+measures how long it takes to start the login node setup once config-login.sh
+is published, and to restart Workbench once the state file is removed. The
+former rc.pwb cron job reacted after 30 s on average (60 s worst case). The
+CPU time the idle agent uses is reported as well, the former busy-wait loop
+in config-login.sh used a full core.
+
+    python3 -m benchmarks.readiness --repeat 5
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+import pwb_agent  # noqa: E402
+
+
+class Recorder:
+    """Stand-in for the command runner that notes when a command was issued."""
+
+    def __init__(self):
+        self.commands = []
+        self.event = threading.Event()
+
+    def __call__(self, command):
+        self.commands.append((time.monotonic(), command))
+        self.event.set()
+
+
+def layout(tmp: Path) -> pwb_agent.Layout:
+    result = pwb_agent.Layout(tmp / "opt-rstudio", tmp / "etc", "login-1")
+    for d in (result.scripts, result.config_dir, result.etc):
+        d.mkdir(parents=True, exist_ok=True)
+    result.version_file.write_text("2024.12.0\n")
+    (result.scripts / "rstudio-workbench-2024.12.0-amd64.deb").touch()
+    return result
+
+
+def react(recorder: Recorder, trigger) -> float:
+    recorder.event.clear()
+    started = time.monotonic()
+    trigger()
+    if not recorder.event.wait(10):
+        raise RuntimeError("agent did not react")
+    return recorder.commands[-1][0] - started
+
+
+def publish(paths: pwb_agent.Layout):
+    paths.config_login.write_text("#!/bin/bash\n")
+    paths.config_login.chmod(0o755)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--poll", type=float, default=1.0)
+    args = parser.parse_args()
+
+    setup, restart = [], []
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = layout(Path(tmp))
+            recorder = Recorder()
+            agent = pwb_agent.Agent(paths, lambda: True, recorder)
+            stop = threading.Event()
+            thread = threading.Thread(target=agent.run, args=(args.poll, stop))
+            thread.start()
+            time.sleep(0.1)
+
+            setup.append(react(recorder, lambda: publish(paths)))
+            paths.rserver_conf.touch()
+            paths.state.touch()
+            time.sleep(0.1)
+
+            idle_start = time.process_time()
+            time.sleep(1)
+            idle_cpu = time.process_time() - idle_start
+
+            restart.append(react(recorder, paths.state.unlink))
+            stop.set()
+            thread.join()
+
+    print(f"notifier: {type(agent.notifier).__name__}, poll interval {args.poll} s")
+    for name, t in (("setup", setup), ("restart", restart)):
+        print(f"{name:>8}: mean {statistics.mean(t) * 1000:8.2f} ms  max {max(t) * 1000:8.2f} ms  "
+              f"(rc.pwb cron: mean 30000 ms, max 60000 ms)")
+    print(f"idle CPU: {idle_cpu * 1000:.2f} ms per second")
+
+
+if __name__ == "__main__":
+    main()
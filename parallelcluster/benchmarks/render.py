@@ -0,0 +1,103 @@
+"""Compare `pwbtools.render` with the sed pipelines formerly used in deploy.sh.
+
+The templates are converted back into their bare placeholder form and piped
+through the same chain of `sed` commands deploy.sh used to run, one process
+per variable. Both approaches are run on the existing templates with dummy
+values and their wall time is reported.
+
+    python3 -m benchmarks.render --config benchmark --repeat 20
+"""
+
+import argparse
+import re
+import shlex
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from pwbtools.render import BASE_DIR, Renderer, artifacts
+
+# Order of the sed stages per template as used by deploy.sh
+SED_CHAINS = {
+    "scripts/install-pwb-config.sh": [
+        "AD_DNS", "RSW_DB_HOST", "RSW_DB_PORT", "RSW_DB_USER", "RSW_DB_PASS", "RSW_AUDIT_DB_HOST",
+        "RSW_AUDIT_DB_PORT", "RSW_AUDIT_DB_USER", "RSW_AUDIT_DB_PASS", "SECURE_COOKIE_KEY",
+        "SINGULARITY_SUPPORT",
+        "BENCHMARK_SUPPORT", "EASYBUILD_SUPPORT", "LOCAL", "SSL", "S3_BUCKETNAME", "CLUSTER_CONFIG"],
+    "scripts/config-login.sh": [
+        "AD_DNS", "BENCHMARK_SUPPORT", "SINGULARITY_SUPPORT", "HPC_DOMAIN", "S3_BUCKETNAME",
+        "EASYBUILD_SUPPORT"],
+    "scripts/config-compute.sh": [
+        "AD_DNS", "SINGULARITY_SUPPORT", "BENCHMARK_SUPPORT", "EASYBUILD_SUPPORT"],
+    "config": [
+        "PWB_VERSION", "S3_BUCKETNAME", "HPC_DOMAIN", "HPC_HOST", "SECURITYGROUP_RSW", "SUBNETID",
+        "REGION", "AMI", "SLURM_DB_HOST", "SLURM_DB_NAME", "SLURM_DB_USER", "SLURM_DB_PASS_ARN",
+        "DOMAINPWSecret", "KEY", "EMAIL", "BILLING_CODE", "SECURITYGROUP_SSH", "ELB_ACCESS",
+        "ALLOWEDIPS", "S3_ACCESS", "EC2_RUNINSTANCES"],
+}
+
+BOOLEANS = {"SSL", "LOCAL", "SINGULARITY_SUPPORT", "BENCHMARK_SUPPORT", "EASYBUILD_SUPPORT"}
+
+
+def dummy_values() -> Dict[str, str]:
+    names = {v for chain in SED_CHAINS.values() for v in chain}
+    return {n: "true" if n in BOOLEANS else f"value-of-{n.lower()}" for n in names}
+
+
+def run_sed(legacy_dir: Path, config: str, values: Dict[str, str], output_dir: Path):
+    for artifact in artifacts(config):
+        chain = SED_CHAINS.get(artifact.template, SED_CHAINS["config"])
+        stages = " | ".join(f"sed {shlex.quote(f's#{v}#{values[v]}#g')}" for v in chain)
+        subprocess.run(f"cat {legacy_dir / artifact.template} | {stages} > {output_dir / artifact.output}",
+                       shell=True, check=True)
+
+
+def run_jinja(config: str, values: Dict[str, str], output_dir: Path):
+    Renderer().render_all(artifacts(config), values, output_dir)
+
+
+def timings(fn, repeat: int) -> List[float]:
+    result = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        result.append(time.perf_counter() - start)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default="benchmark")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    values = dummy_values()
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        legacy_dir, sed_out, jinja_out = tmp / "legacy", tmp / "sed", tmp / "jinja"
+        for d in (sed_out, jinja_out):
+            d.mkdir()
+        for artifact in artifacts(args.config):
+            target = legacy_dir / artifact.template
+            target.parent.mkdir(parents=True, exist_ok=True)
+            source = (BASE_DIR / artifact.template).read_text()
+            target.write_text(re.sub(r"\{\{ (\w+) \}\}", r"\1", source))
+
+        results = {
+            "sed": timings(lambda: run_sed(legacy_dir, args.config, values, sed_out), args.repeat),
+            "jinja2": timings(lambda: run_jinja(args.config, values, jinja_out), args.repeat),
+        }
+
+    stages = sum(len(SED_CHAINS.get(a.template, SED_CHAINS["config"])) for a in artifacts(args.config))
+    print(f"{len(artifacts(args.config))} templates, {stages} sed stages, {args.repeat} repetitions")
+    for name, t in results.items():
+        print(f"{name:>8}: mean {statistics.mean(t) * 1000:8.2f} ms  "
+              f"min {min(t) * 1000:8.2f} ms  max {max(t) * 1000:8.2f} ms")
+    print(f" speedup: {statistics.mean(results['sed']) / statistics.mean(results['jinja2']):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Time, hit rate and space of `pwb_renvcache` warming a renv cache from a fake image.
+
+Builds `/opt/R/<version>/lib/R/site-library` trees with a `pkg.lock` each for
+`--versions` R versions below a temporary directory, `--packages` packages per
+version (file layout as in `pwb_fsbench.PACKAGE_FILES`). A share of
+`--shared` packages is the very same build in all versions, the others are
+rebuilt per version, i.e. only their lazy-load databases and shared objects
+differ. `--not-installed` packages per version are listed in `pkg.lock` but not
+installed. Some packages carry the Remote* fields of pak installs from GitHub
+and Bioconductor; with `--rscript` of an R with renv, their hashes are checked
+against `renv:::renv_hash_description()`.
+
+The warmer runs twice (cold and incremental) with each number of `--jobs`,
+compared to copying every package of every version into the cache one after
+the other (`copytree`).
+
+    python3 -m benchmarks.renv_cache --versions 6 --packages 150 --jobs 1 8
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+import pwb_fsbench  # noqa: E402
+import pwb_renvcache  # noqa: E402
+
+# Files that differ between builds of the same package for different R versions
+REBUILT = ("R/{pkg}.rdb", "help/{pkg}.rdb", "libs/{pkg}.so")
+
+# Remote* fields of pak installs, in the order pak writes them (not sorted)
+REMOTES = [
+    "RemoteType: github\nRemoteHost: api.github.com\nRemoteRepo: {pkg}\nRemoteUsername: rstudio\n"
+    "RemotePkgRef: rstudio/{pkg}\nRemoteRef: HEAD\nRemoteSha: 3f1c9a0e6b7d2c5f8a4e1b0d9c7a6f5e4d3c2b1a\n",
+    "RemoteType: bioc\nRemotePkgRef: bioc::{pkg}\nRemoteRef: {pkg}\nRemoteRepos: https://bioconductor.org\n"
+    "RemoteSha: 1.0.0\n",
+    "RemoteType: standard\nRemotePkgRef: {pkg}\nRemoteRef: {pkg}\nRemoteRepos: https://p3m.dev/cran\n"
+    "RemotePkgPlatform: x86_64-pc-linux-gnu-ubuntu-24.04\nRemoteSha: 1.0.0\n",
+]
+
+
+def make_image(root: Path, versions: List[str], packages: int, shared: float, not_installed: int) -> Path:
+    rng = random.Random(1)
+    names = [f"pkg{n:04d}" for n in range(packages)]
+    common = set(rng.sample(names, int(shared * packages)))
+    sizes = {pkg: {name.format(pkg=pkg): int(size * rng.uniform(0.5, 1.5))
+                   for name, size in pwb_fsbench.PACKAGE_FILES.items()} for pkg in names}
+    for version in versions:
+        library = root / "opt" / "R" / version / "lib" / "R" / "site-library"
+        missing = set(rng.sample(names, not_installed))
+        for pkg in names:
+            if pkg in missing:
+                continue
+            for name, size in sizes[pkg].items():
+                path = library / pkg / name
+                path.parent.mkdir(parents=True, exist_ok=True)
+                rebuilt = pkg not in common and name in {r.format(pkg=pkg) for r in REBUILT}
+                seed = f"{pkg}/{name}/{version if rebuilt else ''}".encode()
+                path.write_bytes((seed * (size // len(seed) + 1))[:size])
+            description = (f"Package: {pkg}\nVersion: 1.0.{packages % 7}\nTitle: Fake Package {pkg}\n"
+                           f"Description: Stands in for an installed package\n    of the image.\n"
+                           f"Built: R {version}; ; 2024-05-01 12:00:00 UTC; unix\n")
+            if names.index(pkg) % 10 < len(REMOTES):
+                description += REMOTES[names.index(pkg) % 10].format(pkg=pkg)
+            (library / pkg / "DESCRIPTION").write_text(description)
+        lock = {"lockfile_version": 1, "r_version": version,
+                "packages": [{"ref": pkg, "package": pkg, "version": f"1.0.{packages % 7}", "type": "standard"}
+                             for pkg in names]}
+        (library / "pkg.lock").write_text(json.dumps(lock))
+    return root / "opt" / "R"
+
+
+def disk_usage(path: Path) -> int:
+    """Allocated bytes below path, hardlinked files counted once."""
+    seen, total = set(), 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            st = os.lstat(os.path.join(root, name))
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_size
+    return total
+
+
+def check_hashes(image: Path, rscript: Path):
+    descriptions = sorted(image.glob("*/lib/R/site-library/*/DESCRIPTION"))
+    expected = pwb_renvcache.renv_hashes(rscript, descriptions)
+    if not expected:
+        print(f"hashes not checked, no renv for {rscript}")
+        return
+    mismatches = [path for path in descriptions if str(path) in expected
+                  and expected[str(path)] != pwb_renvcache.renv_hash(pwb_renvcache.read_dcf(path))]
+    print(f"hashes as renv's for {len(expected) - len(mismatches)} of {len(expected)} packages")
+    for path in mismatches:
+        print(f"  {path.parent.name}: {pwb_renvcache.renv_hash(pwb_renvcache.read_dcf(path))}, "
+              f"renv {expected[str(path)]}")
+
+
+def copy_all(locks: List[Path], cache: Path):
+    warmer = pwb_renvcache.Warmer(cache, prefix="linux-ubuntu-noble")
+    for lock in locks:
+        for job in warmer.jobs(lock):
+            if job.source.is_dir():
+                shutil.copytree(job.source, warmer.platform_dir(job.stats.r_version) / job.package, symlinks=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--versions", type=int, default=6)
+    parser.add_argument("--packages", type=int, default=120)
+    parser.add_argument("--shared", type=float, default=0.5, help="share of packages identical in all versions")
+    parser.add_argument("--not-installed", type=int, default=2, help="packages per version missing")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--rscript", type=Path, help="Rscript of an R version with renv to check the hashes")
+    args = parser.parse_args()
+
+    versions = [f"4.{5 - n}.{n % 4}" for n in range(args.versions)]
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        image = make_image(tmp, versions, args.packages, args.shared, args.not_installed)
+        locks = sorted(image.glob("*/lib/R/site-library/pkg.lock"))
+        installed = disk_usage(image)
+        print(f"{args.versions} R versions, {args.packages} packages each, {args.shared:.0%} identical builds, "
+              f"{installed / 1e6:.1f} MB installed")
+        if args.rscript:
+            check_hashes(image, args.rscript)
+        print(f"{'approach':<24} {'seconds':>8} {'hit rate':>9} {'warmed':>7} {'missing':>8} {'cache MB':>9} "
+              f"{'savings':>8}")
+
+        started = time.perf_counter()
+        copy_all(locks, tmp / "copy")
+        seconds = time.perf_counter() - started
+        print(f"{'copytree, serial':<24} {seconds:>8.2f} {'-':>9} {'-':>7} {'-':>8} "
+              f"{disk_usage(tmp / 'copy') / 1e6:>9.1f} {'-':>8}")
+
+        for jobs in args.jobs:
+            cache = tmp / f"renv-{jobs}"
+            for run in ("cold", "incremental"):
+                started = time.perf_counter()
+                versions_stats = pwb_renvcache.Warmer(cache, prefix="linux-ubuntu-noble").run(locks, jobs)
+                seconds = time.perf_counter() - started
+                result = pwb_renvcache.report(versions_stats, seconds)
+                print(f"{f'warm {run}, {jobs} jobs':<24} {seconds:>8.2f} {result['hit_rate']:>9.1%} "
+                      f"{result['warmed']:>7} {result['missing']:>8} {disk_usage(cache) / 1e6:>9.1f} "
+                      f"{result['savings']:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
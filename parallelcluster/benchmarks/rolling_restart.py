@@ -0,0 +1,262 @@
+"""Capacity and failed requests while Workbench is restarted on all login nodes.
+
+Starts `--nodes` login nodes in moto, registered with both ALB target groups.
+Each node is faked by a `pwb_agent.Agent` on a local directory tree, whose
+restart commands take `--restart-time` seconds in total, and an HTTP server
+that answers `302` once Workbench is up again plus `--warmup` seconds.
+Deregistered targets stay `draining` for `--drain` seconds (moto drops them
+at once) and `pwb_alb.Reconciler` runs alongside as on the head node.
+
+The former approach removes the state files of all nodes at once, the rolling
+restart of `pwb_restart.Orchestrator` runs once per `--max-unavailable`
+value. While they run, the nodes registered with the internal target group
+are sampled every 50 ms: the lowest number of them that could serve a request
+(capacity) and the share of requests that would have gone to a node that is
+down (failed).
+
+Needs `moto` in addition to the repository dependencies (`pip install moto`).
+
+    python3 -m benchmarks.rolling_restart --nodes 6 --max-unavailable 1 2
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import boto3
+
+from benchmarks.alb_registration import CLUSTER
+
+import pwb_agent  # noqa: E402  (on sys.path via benchmarks.alb_registration)
+import pwb_alb  # noqa: E402
+import pwb_restart  # noqa: E402
+
+
+class FakeNode:
+    """pwb_agent on a local tree and an HTTP server answering like Workbench behind the ALB."""
+
+    def __init__(self, root: Path, etc: Path, hostname: str, restart_time: float, warmup: float):
+        self.layout = pwb_agent.Layout(root, etc, hostname)
+        self.restart_time = restart_time
+        self.warmup = warmup
+        self.up = True
+        self.ready_at = 0.0
+        for d in (self.layout.config_dir, self.layout.etc):
+            d.mkdir(parents=True, exist_ok=True)
+        for path in (self.layout.setup_marker, self.layout.rserver_conf, self.layout.state):
+            path.touch()
+
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(302 if node.serving() else 503)
+                self.send_header("Location", "/auth-sign-in")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.stop = threading.Event()
+        self.agent = pwb_agent.Agent(self.layout, lambda: True, self.run_command, pwb_agent.Poller())
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def serving(self) -> bool:
+        return self.up and time.monotonic() >= self.ready_at
+
+    def run_command(self, command: List[str]):
+        if command == ["systemctl", "stop", "rstudio-server"]:
+            self.up = False
+        time.sleep(self.restart_time / len(self.agent.restart_commands()))
+        if command == ["systemctl", "start", "rstudio-server"]:
+            self.ready_at = time.monotonic() + self.warmup
+            self.up = True
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.agent.run, args=(0.05, self.stop), daemon=True).start()
+
+    def shutdown(self):
+        self.stop.set()
+        self.server.shutdown()
+
+
+class DrainingELB:
+    """elbv2 client whose deregistered targets stay `draining` and whose health follows the nodes."""
+
+    def __init__(self, client, delay: float, serving: Callable[[str], bool]):
+        self.client = client
+        self.delay = delay
+        self.serving = serving
+        self.deregistered: Dict[tuple, float] = {}
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def deregister_targets(self, TargetGroupArn: str, Targets: List[dict]):
+        for t in Targets:
+            self.deregistered[(TargetGroupArn, t["Id"])] = time.monotonic()
+        return self.client.deregister_targets(TargetGroupArn=TargetGroupArn, Targets=Targets)
+
+    def register_targets(self, TargetGroupArn: str, Targets: List[dict]):
+        for t in Targets:
+            self.deregistered.pop((TargetGroupArn, t["Id"]), None)
+        return self.client.register_targets(TargetGroupArn=TargetGroupArn, Targets=Targets)
+
+    def _state(self, arn: str, ip: str, registered: bool) -> str:
+        since = self.deregistered.get((arn, ip))
+        if since is not None and time.monotonic() - since < self.delay:
+            return "draining"
+        if not registered:
+            return "unused"
+        return "healthy" if self.serving(ip) else "unhealthy"
+
+    def describe_target_health(self, TargetGroupArn: str, Targets: List[dict] = None):
+        registered = {d["Target"]["Id"] for d in self.client.describe_target_health(
+            TargetGroupArn=TargetGroupArn)["TargetHealthDescriptions"]}
+        draining = {ip for (arn, ip) in self.deregistered if arn == TargetGroupArn}
+        ips = [t["Id"] for t in Targets] if Targets else sorted(registered | draining)
+        descriptions = [{"Target": {"Id": ip, "Port": pwb_alb.WORKBENCH_PORT},
+                         "TargetHealth": {"State": self._state(TargetGroupArn, ip, ip in registered)}}
+                        for ip in ips]
+        return {"TargetHealthDescriptions": [d for d in descriptions
+                                             if Targets or d["TargetHealth"]["State"] != "unused"]}
+
+    def describe_target_group_attributes(self, TargetGroupArn: str):
+        return {"Attributes": [{"Key": "deregistration_delay.timeout_seconds", "Value": str(self.delay)}]}
+
+
+def setup(ec2, elbv2, nodes: int) -> Dict[str, dict]:
+    vpc = ec2.create_vpc(CidrBlock="10.0.0.0/16")["Vpc"]["VpcId"]
+    subnet = ec2.create_subnet(VpcId=vpc, CidrBlock="10.0.0.0/24")["Subnet"]["SubnetId"]
+    tags = [{"Key": pwb_alb.CLUSTER_TAG, "Value": CLUSTER}, {"Key": pwb_alb.NODE_TYPE_TAG, "Value": pwb_alb.LOGIN_NODE}]
+    instances = ec2.run_instances(ImageId="ami-12c6146b", MinCount=nodes, MaxCount=nodes, SubnetId=subnet,
+                                  TagSpecifications=[{"ResourceType": "instance", "Tags": tags}])["Instances"]
+    for prefix in pwb_alb.TARGET_GROUP_PREFIXES:
+        arn = elbv2.create_target_group(Name=f"{prefix}-{CLUSTER}", Protocol="HTTP", Port=pwb_alb.WORKBENCH_PORT,
+                                        VpcId=vpc, TargetType="ip")["TargetGroups"][0]["TargetGroupArn"]
+        elbv2.register_targets(TargetGroupArn=arn, Targets=[{"Id": i["PrivateIpAddress"],
+                                                             "Port": pwb_alb.WORKBENCH_PORT} for i in instances])
+    return {i["PrivateIpAddress"]: i for i in instances}
+
+
+class Sampler:
+    """Serving capacity and failing share of requests through the internal target group."""
+
+    def __init__(self, elbv2, arn: str, nodes: Dict[str, FakeNode]):
+        self.elbv2 = elbv2
+        self.arn = arn
+        self.nodes = nodes
+        self.capacity: List[int] = []
+        self.failed: List[float] = []
+        self.stop = threading.Event()
+
+    def run(self):
+        while not self.stop.is_set():
+            routed = [d["Target"]["Id"] for d in self.elbv2.describe_target_health(
+                TargetGroupArn=self.arn)["TargetHealthDescriptions"]]
+            serving = sum(self.nodes[ip].serving() for ip in routed)
+            self.capacity.append(serving)
+            self.failed.append(1 - serving / len(routed) if routed else 1.0)
+            self.stop.wait(0.05)
+
+
+def all_at_once(nodes: Dict[str, FakeNode]):
+    for node in nodes.values():
+        node.layout.state.unlink()
+    time.sleep(0.5)
+    while not all(n.serving() and n.layout.state.exists() for n in nodes.values()):
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--max-unavailable", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--restart-time", type=float, default=1.0, help="seconds of the restart commands")
+    parser.add_argument("--warmup", type=float, default=1.0, help="seconds until Workbench answers after start")
+    parser.add_argument("--drain", type=float, default=1.0, help="seconds deregistered targets stay draining")
+    parser.add_argument("--no-hold", action="store_true", help="do not keep the reconciler away from restarting nodes")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    from moto import mock_aws
+
+    runs = [("all at once", None)] + [(f"rolling, max {n}", n) for n in args.max_unavailable]
+    print(f"{'approach':<16} {'seconds':>8} {'waves':>6} {'min capacity':>13} {'failed requests':>16}")
+    details = []
+    for name, max_unavailable in runs:
+        with mock_aws(), tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            ec2, raw = boto3.client("ec2"), boto3.client("elbv2")
+            instances = setup(ec2, raw, args.nodes)
+            nodes = {ip: FakeNode(tmp / "opt-rstudio", tmp / f"etc-{i['PrivateDnsName'].split('.')[0]}",
+                                  i["PrivateDnsName"].split(".")[0], args.restart_time, args.warmup)
+                     for ip, i in instances.items()}
+            elbv2 = DrainingELB(raw, args.drain, lambda ip: nodes[ip].serving())
+            hold = None if args.no_hold else str(tmp / "hold")
+            reconciler = pwb_alb.Reconciler(CLUSTER, "example.com", str(tmp / "nodes"), None, None, ec2, elbv2,
+                                            hold_path=hold)
+            stop = threading.Event()
+
+            def reconcile():
+                while not stop.is_set():
+                    reconciler.step()
+                    stop.wait(0.2)
+
+            threads = [threading.Thread(target=reconcile, daemon=True)]
+            for node in nodes.values():
+                node.start()
+            sampler = Sampler(raw, pwb_alb.TargetRegistrar(CLUSTER, ec2, raw).target_groups()["pwb-alb-tg-int"],
+                              nodes)
+            threads.append(threading.Thread(target=sampler.run, daemon=True))
+            for t in threads:
+                t.start()
+
+            started = time.monotonic()
+            if max_unavailable is None:
+                all_at_once(nodes)
+                waves = 1
+            else:
+                orchestrator = pwb_restart.Orchestrator(
+                    CLUSTER, tmp / "opt-rstudio", hold, ec2, elbv2,
+                    probe=lambda ip: pwb_restart.http_probe(f"http://127.0.0.1:{nodes[ip].port}/"),
+                    poll=0.05, timeout=60)
+                result = pwb_restart.report(orchestrator.run(max_unavailable))
+                waves = len(result["waves"])
+                details.append((name, result))
+            seconds = time.monotonic() - started
+
+            stop.set()
+            sampler.stop.set()
+            for t in threads:
+                t.join()
+            for node in nodes.values():
+                node.shutdown()
+
+        print(f"{name:<16} {seconds:>8.1f} {waves:>6} {min(sampler.capacity):>10} of {args.nodes} "
+              f"{statistics.mean(sampler.failed):>15.1%}")
+
+    for name, result in details:
+        print(f"\n{name}: {'wave':>4} {'nodes':>6} {'seconds':>8} {'drain':>6} {'restart':>8} {'health':>7} "
+              f"{'register':>9}")
+        for wave in result["waves"]:
+            print(f"{'':<{len(name) + 1}} {wave['number']:>4} {len(wave['nodes']):>6} {wave['seconds']:>8.1f} "
+                  f"{wave['max_drain']:>6.1f} {wave['max_restart']:>8.1f} {wave['max_health']:>7.1f} "
+                  f"{wave['max_register']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,33 +19,39 @@ SSL=true
 LOCAL=false
 
 echo "Extracting values from pulumi setup"
-KEY=`cd ../pulumi && pulumi stack output "key_pair id"  -s $STACKNAME`
-DOMAINPWSecret=` cd ../pulumi && pulumi stack output "ad_password_arn" -s $STACKNAME `
-EMAIL=`cd ../pulumi && pulumi config get email -s $STACKNAME`
-AD_DNS=`cd ../pulumi && pulumi stack output ad_dns_1 -s $STACKNAME`
-RSW_DB_HOST=`cd ../pulumi && pulumi stack output rsw_db_address -s $STACKNAME`
-RSW_DB_USER=`cd ../pulumi && pulumi stack output rsw_db_user -s $STACKNAME`
-RSW_DB_PASS=`cd ../pulumi && pulumi stack output rsw_db_pass -s $STACKNAME --show-secrets`
-RSW_AUDIT_DB_HOST=`cd ../pulumi && pulumi stack output rsw_audit_db_address -s $STACKNAME`
-RSW_AUDIT_DB_USER=`cd ../pulumi && pulumi stack output rsw_audit_db_user -s $STACKNAME`
-RSW_AUDIT_DB_PASS=`cd ../pulumi && pulumi stack output rsw_audit_db_pass -s $STACKNAME --show-secrets`
-if ($SSL); then 
-  SECURITYGROUP_RSW=`cd ../pulumi && pulumi stack output rsw_security_group_https -s $STACKNAME`
+if ($SSL); then
+  SECURITYGROUP_RSW_OUTPUT=rsw_security_group_https
 else
-  SECURITYGROUP_RSW=`cd ../pulumi && pulumi stack output rsw_security_group_nohttps -s $STACKNAME`
+  SECURITYGROUP_RSW_OUTPUT=rsw_security_group_nohttps
 fi
-SLURM_DB_HOST=`cd ../pulumi && pulumi stack output slurm_db_endpoint -s $STACKNAME`
-SLURM_DB_NAME=`cd ../pulumi && pulumi stack output slurm_db_name -s $STACKNAME`
-SLURM_DB_USER=`cd ../pulumi && pulumi stack output slurm_db_user -s $STACKNAME`
-SLURM_DB_PASS_ARN=`cd ../pulumi && pulumi stack output slurm_db_pass_arn -s $STACKNAME`
-SECURE_COOKIE_KEY=`cd ../pulumi && pulumi stack output secure_cookie_key -s $STACKNAME --show-secrets`
-BILLING_CODE=`cd ../pulumi && pulumi stack output billing_code -s $STACKNAME`
-ELB_ACCESS=`cd ../pulumi && pulumi stack output iam_elb_access -s $STACKNAME`
-S3_ACCESS=`cd ../pulumi && pulumi stack output iam_s3_access -s $STACKNAME`
-S3_BUCKETNAME=`cd ../pulumi && pulumi stack output s3_bucket_id -s $STACKNAME`
-EC2_RUNINSTANCES=`cd ../pulumi && pulumi stack output iam_ec2_runinstances -s $STACKNAME`
-SUBNETID=`cd ../pulumi && pulumi stack output vpc_private_subnet -s $STACKNAME`
-SECURITYGROUP_SSH=`cd ../pulumi && pulumi stack output ssh_security_group -s $STACKNAME`
+# All outputs are fetched in one go and cached per stack version (cf. pwbtools/stack_outputs.py)
+STACK_VARS=`python3 -m pwbtools.stack_outputs -s $STACKNAME shell --export \
+        KEY="key_pair id" \
+        DOMAINPWSecret=ad_password_arn \
+        EMAIL=config:email \
+        AD_DNS=ad_dns_1 \
+        RSW_DB_HOST=rsw_db_pool_address \
+        RSW_DB_PORT=rsw_db_pool_port \
+        RSW_DB_USER=rsw_db_user \
+        RSW_DB_PASS=rsw_db_pool_pass \
+        RSW_AUDIT_DB_HOST=rsw_audit_db_pool_address \
+        RSW_AUDIT_DB_PORT=rsw_audit_db_pool_port \
+        RSW_AUDIT_DB_USER=rsw_audit_db_user \
+        RSW_AUDIT_DB_PASS=rsw_audit_db_pool_pass \
+        SECURITYGROUP_RSW=$SECURITYGROUP_RSW_OUTPUT \
+        SLURM_DB_HOST=slurm_db_endpoint \
+        SLURM_DB_NAME=slurm_db_name \
+        SLURM_DB_USER=slurm_db_user \
+        SLURM_DB_PASS_ARN=slurm_db_pass_arn \
+        SECURE_COOKIE_KEY=secure_cookie_key \
+        BILLING_CODE=billing_code \
+        ELB_ACCESS=iam_elb_access \
+        S3_ACCESS=iam_s3_access \
+        S3_BUCKETNAME=s3_bucket_id \
+        EC2_RUNINSTANCES=iam_ec2_runinstances \
+        SUBNETID=vpc_private_subnet \
+        SECURITYGROUP_SSH=ssh_security_group` || exit 1
+eval "$STACK_VARS"
 
 
 if ($SSL); then
@@ -78,63 +84,14 @@ mkdir -p tmp
 cp -Rf scripts/* tmp
 if ($SSL); then cp -Rf certs/$HPC_DOMAIN.{key,crt} tmp; fi
 
-cat scripts/install-pwb-config.sh | \
-        sed "s#AD_DNS#${AD_DNS}#g" | \
-        sed "s#RSW_DB_HOST#${RSW_DB_HOST}#g" | \
-        sed "s#RSW_DB_USER#${RSW_DB_USER}#g" | \
-       	sed "s#RSW_DB_PASS#${RSW_DB_PASS}#g" | \
-        sed "s#RSW_AUDIT_DB_HOST#${RSW_AUDIT_DB_HOST}#g" | \
-        sed "s#RSW_AUDIT_DB_USER#${RSW_AUDIT_DB_USER}#g" | \
-	sed "s#RSW_AUDIT_DB_PASS#${RSW_AUDIT_DB_PASS}#g" | \
-        sed "s#SECURE_COOKIE_KEY#${SECURE_COOKIE_KEY}#g" | \
-        sed "s#SINGULARITY_SUPPORT#${SINGULARITY_SUPPORT}#g" | \
-	sed "s#BENCHMARK_SUPPORT#${BENCHMARK_SUPPORT}#g" | \
-        sed "s#EASYBUILD_SUPPORT#${EASYBUILD_SUPPORT}#g" | \
-        sed "s#LOCAL#${LOCAL}#g" | \
-        sed "s#SSL#${SSL}#g" | \
-        sed "s#S3_BUCKETNAME#${S3_BUCKETNAME}#g" | \
-	sed "s#CLUSTER_CONFIG#${CONFIG}#g" \
-	> tmp/install-pwb-config.sh 
-
-cat scripts/config-login.sh | \
-        sed "s#AD_DNS#${AD_DNS}#g" | \
-        sed "s#BENCHMARK_SUPPORT#${BENCHMARK_SUPPORT}#g" | \
-        sed "s#SINGULARITY_SUPPORT#${SINGULARITY_SUPPORT}#g" | \
-	sed "s#HPC_DOMAIN#${HPC_DOMAIN}#g" | \
-        sed "s#S3_BUCKETNAME#${S3_BUCKETNAME}#g" | \
-        sed "s#EASYBUILD_SUPPORT#${EASYBUILD_SUPPORT}#g" \
-        > tmp/config-login.sh 
-
-cat scripts/config-compute.sh | \
-        sed "s#AD_DNS#${AD_DNS}#g" | \
-	sed "s#SINGULARITY_SUPPORT#${SINGULARITY_SUPPORT}#g" | \
-	sed "s#BENCHMARK_SUPPORT#${BENCHMARK_SUPPORT}#g" | \
-        sed "s#EASYBUILD_SUPPORT#${EASYBUILD_SUPPORT}#g"\
-	> tmp/config-compute.sh 
+# Render scripts and cluster config in one pass (cf. pwbtools/render.py)
+export PWB_VERSION AMI REGION SINGULARITY_SUPPORT BENCHMARK_SUPPORT EASYBUILD_SUPPORT \
+        HPC_DOMAIN HPC_HOST ALLOWEDIPS SSL LOCAL
+python3 -m pwbtools.render --config $CONFIG --output tmp || exit 1
 
-cat config/cluster-config-wb.${CONFIG}.tmpl | \
-        sed "s#PWB_VERSION#${PWB_VERSION}#g" | \
-	sed "s#S3_BUCKETNAME#${S3_BUCKETNAME}#g" | \
-        sed "s#HPC_DOMAIN#${HPC_DOMAIN}#g" | \
-        sed "s#HPC_HOST#${HPC_HOST}#g" | \
-        sed "s#SECURITYGROUP_RSW#${SECURITYGROUP_RSW}#g" | \
-        sed "s#SUBNETID#${SUBNETID}#g" | \
-        sed "s#REGION#${REGION}#g" | \
-        sed "s#AMI#${AMI}#g" | \
-        sed "s#SLURM_DB_HOST#${SLURM_DB_HOST}#g" | \
-        sed "s#SLURM_DB_NAME#${SLURM_DB_NAME}#g" | \
-        sed "s#SLURM_DB_USER#${SLURM_DB_USER}#g" | \
-       	sed "s#SLURM_DB_PASS_ARN#${SLURM_DB_PASS_ARN}#g" | \
-	sed "s#DOMAINPWSecret#${DOMAINPWSecret}#g" | \
-        sed "s#KEY#${KEY}#g" | \
-	sed "s#EMAIL#${EMAIL}#g" | \
-	sed "s#BILLING_CODE#${BILLING_CODE}#g" | \
-        sed "s#SECURITYGROUP_SSH#${SECURITYGROUP_SSH}#g" | \
-        sed "s#ELB_ACCESS#${ELB_ACCESS}#g" | \
-        sed "s#ALLOWEDIPS#${ALLOWEDIPS}#g" | \
-	sed "s#S3_ACCESS#${S3_ACCESS}#g" | \
-        sed "s#EC2_RUNINSTANCES#${EC2_RUNINSTANCES}#g" \
-	> tmp/cluster-config-wb.yaml
+# Launcher resource profiles sized for the instance types of the queues (cf. pwbtools/profiles.py)
+if ($BENCHMARK_SUPPORT); then PROFILE_SIZES="small=1"; else PROFILE_SIZES="small=1,medium=2,large=4"; fi
+python3 -m pwbtools.profiles generate --cluster-config tmp/cluster-config-wb.yaml --sizes $PROFILE_SIZES --output tmp || exit 1
 
 aws s3 cp tmp/ s3://${S3_BUCKETNAME} --recursive 
 
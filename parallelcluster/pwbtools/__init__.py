@@ -0,0 +1,7 @@
+"""Operator-side helpers for deploying Posit Workbench on AWS ParallelCluster.
+
+The modules in this package are meant to be run from the `parallelcluster`
+folder inside the uv managed virtual environment of this repository, e.g.
+
+    python3 -m pwbtools.stack_outputs -s <STACKNAME> get jump_host_dns
+"""
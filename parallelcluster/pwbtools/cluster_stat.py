@@ -0,0 +1,261 @@
+"""Status of a Workbench cluster: nodes, target health, stack outputs and Workbench on every login node.
+
+The former `cluster-stat.sh` ran its AWS and pulumi calls one after the
+other and sent `rstudio-server version` to the first login node only, reading
+the result right away (mostly before the command had run). Here the running
+instances, the health of the ALB target groups and the stack outputs are
+fetched concurrently. One SSM command is sent to all login nodes at once
+(`rstudio-server version` and the number of active sessions), its invocations
+are polled with exponential backoff until every node has answered or
+`--timeout` is reached.
+
+    python3 -m pwbtools.cluster_stat <CLUSTER>
+    python3 -m pwbtools.cluster_stat <CLUSTER> --json
+
+The stack outputs come from `pwbtools.stack_outputs` (stack name = cluster
+name unless `--stack` is given, `--backend file:<path>` works offline). Set
+`--endpoint-url` (or `AWS_ENDPOINT_URL`) to run against a local stand-in
+such as `moto_server`, `python3 -m benchmarks.cluster_stat` runs against moto
+and a fake SSM.
+"""
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from tabulate import tabulate
+
+from pwbtools.stack_outputs import StackOutputs, make_backend
+
+# Same tags and target groups as scripts/pwb_alb.py
+CLUSTER_TAG = "parallelcluster:cluster-name"
+NODE_TYPE_TAG = "parallelcluster:node-type"
+LOGIN_NODE = "LoginNode"
+TARGET_GROUP_PREFIXES = ("pwb-alb-tg-int", "pwb-alb-tg-ext")
+
+STACK_OUTPUTS = ["posit_user_pass", "jump_host_dns", "private_key_ssh"]
+
+# SendCommand accepts at most 50 instance ids per call
+SSM_BATCH_SIZE = 50
+
+# Invocation states after which a node will not answer anymore
+SSM_DONE = {"Success", "Failed", "Cancelled", "TimedOut", "Undeliverable", "Terminated"}
+
+STATUS_COMMANDS = [
+    "echo version=$(rstudio-server version)",
+    "echo sessions=$(rstudio-server active-sessions 2>/dev/null | tail -n +2 | grep -c .)",
+]
+
+
+@dataclass
+class Node:
+    instance_id: str
+    role: str
+    private_ip: str
+    private_dns: str
+    public_dns: str
+
+
+@dataclass
+class Workbench:
+    """Answer of a login node to STATUS_COMMANDS."""
+    instance_id: str
+    status: str
+    version: Optional[str] = None
+    sessions: Optional[int] = None
+    error: str = ""
+
+
+@dataclass
+class ClusterStat:
+    cluster: str
+    urls: Dict[str, str]
+    nodes: List[Node] = field(default_factory=list)
+    # target group name -> private IP -> health state
+    targets: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    outputs: Dict[str, Any] = field(default_factory=dict)
+    workbench: List[Workbench] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+
+def describe_nodes(ec2, cluster: str) -> List[Node]:
+    """Running instances of the cluster with one (paginated) DescribeInstances call."""
+    nodes = []
+    filters = [{"Name": f"tag:{CLUSTER_TAG}", "Values": [cluster]},
+               {"Name": "instance-state-name", "Values": ["running"]}]
+    for page in ec2.get_paginator("describe_instances").paginate(Filters=filters):
+        for reservation in page["Reservations"]:
+            for instance in reservation["Instances"]:
+                tags = {t["Key"]: t["Value"] for t in instance.get("Tags", [])}
+                nodes.append(Node(instance["InstanceId"], tags.get(NODE_TYPE_TAG, ""),
+                                  instance.get("PrivateIpAddress", ""), instance.get("PrivateDnsName", ""),
+                                  instance.get("PublicDnsName", "")))
+    return sorted(nodes, key=lambda n: (n.role, n.private_ip))
+
+
+def target_health(elbv2, cluster: str) -> Dict[str, Dict[str, str]]:
+    """Health of the targets in the internal and external ALB target groups of the cluster."""
+    result = {}
+    for page in elbv2.get_paginator("describe_target_groups").paginate():
+        for group in page["TargetGroups"]:
+            name = group["TargetGroupName"]
+            if name.startswith(TARGET_GROUP_PREFIXES) and cluster in name:
+                health = elbv2.describe_target_health(TargetGroupArn=group["TargetGroupArn"])
+                result[name] = {t["Target"]["Id"]: t["TargetHealth"]["State"]
+                                for t in health["TargetHealthDescriptions"]}
+    return result
+
+
+def stack_values(stack: str, backend, names: List[str]) -> Dict[str, Any]:
+    outputs = StackOutputs(stack, backend)
+    return {name: outputs.snapshot().outputs.get(name) for name in names}
+
+
+def delays(base: float = 0.5, cap: float = 5.0) -> Iterator[float]:
+    n = 0
+    while True:
+        yield min(cap, base * 2 ** n)
+        n += 1
+
+
+def parse_status(instance_id: str, invocation: Optional[dict]) -> Workbench:
+    if invocation is None:
+        return Workbench(instance_id, "NoAnswer", error="no answer before timeout")
+    plugins = invocation.get("CommandPlugins") or [{}]
+    output = plugins[0].get("Output", "")
+    if invocation["Status"] != "Success":
+        return Workbench(instance_id, invocation["Status"], error=output.strip()[-200:])
+    values = dict(line.split("=", 1) for line in output.splitlines() if "=" in line)
+    sessions = values.get("sessions", "").strip()
+    return Workbench(instance_id, "Success", values.get("version", "").strip() or None,
+                     int(sessions) if sessions.isdigit() else None)
+
+
+def run_command(ssm, instance_ids: List[str], commands: List[str], timeout: float = 60.0,
+                sleep: Callable[[float], None] = time.sleep,
+                clock: Callable[[], float] = time.monotonic) -> Dict[str, Optional[dict]]:
+    """Run `commands` on all instances and return their invocations (None if they did not finish)."""
+    command_ids = []
+    for i in range(0, len(instance_ids), SSM_BATCH_SIZE):
+        response = ssm.send_command(InstanceIds=instance_ids[i:i + SSM_BATCH_SIZE],
+                                    DocumentName="AWS-RunShellScript",
+                                    Parameters={"commands": commands},
+                                    TimeoutSeconds=max(30, int(timeout)))
+        command_ids.append(response["Command"]["CommandId"])
+
+    done: Dict[str, dict] = {}
+    deadline = clock() + timeout
+    for delay in delays():
+        # invocations show up a moment after SendCommand, do not read them right away
+        sleep(min(delay, max(0.0, deadline - clock())))
+        for command_id in command_ids:
+            kwargs = {"CommandId": command_id, "Details": True}
+            while True:
+                page = ssm.list_command_invocations(**kwargs)
+                for invocation in page["CommandInvocations"]:
+                    if invocation["Status"] in SSM_DONE:
+                        done[invocation["InstanceId"]] = invocation
+                if not page.get("NextToken"):
+                    break
+                kwargs["NextToken"] = page["NextToken"]
+        if len(done) == len(instance_ids) or clock() >= deadline:
+            break
+    return {i: done.get(i) for i in instance_ids}
+
+
+def workbench_status(ssm, instance_ids: List[str], timeout: float) -> List[Workbench]:
+    if not instance_ids:
+        return []
+    invocations = run_command(ssm, instance_ids, STATUS_COMMANDS, timeout)
+    return [parse_status(i, invocations[i]) for i in instance_ids]
+
+
+def collect(cluster: str, ec2, elbv2, ssm, stack: Optional[str] = None, backend=None,
+            domain: str = "pcluster.soleng.posit.it", timeout: float = 60.0) -> ClusterStat:
+    """Fetch everything concurrently, failures of a single source end up in `errors`."""
+    start = time.perf_counter()
+    stat = ClusterStat(cluster, {"int": f"https://{cluster}.{domain}", "ext": f"https://{cluster}-ext.{domain}"})
+
+    def result(future, name, default):
+        try:
+            return future.result()
+        except Exception as e:
+            stat.errors.append(f"{name}: {e}")
+            return default
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        nodes = pool.submit(describe_nodes, ec2, cluster)
+        targets = pool.submit(target_health, elbv2, cluster)
+        outputs = pool.submit(stack_values, stack or cluster, backend, STACK_OUTPUTS)
+        stat.nodes = result(nodes, "instances", [])
+        login = [n.instance_id for n in stat.nodes if n.role == LOGIN_NODE]
+        workbench = pool.submit(workbench_status, ssm, login, timeout)
+        stat.targets = result(targets, "target groups", {})
+        stat.outputs = result(outputs, "stack outputs", {})
+        stat.workbench = result(workbench, "ssm", [])
+    stat.seconds = time.perf_counter() - start
+    return stat
+
+
+def format_stat(stat: ClusterStat) -> str:
+    workbench = {w.instance_id: w for w in stat.workbench}
+    groups = sorted(stat.targets)
+    rows = []
+    for n in stat.nodes:
+        w = workbench.get(n.instance_id)
+        rows.append([n.instance_id, n.role, n.private_dns, n.public_dns]
+                    + [stat.targets[g].get(n.private_ip, "") for g in groups]
+                    + ([w.version.split()[0] if w.version else w.status,
+                        "" if w.sessions is None else w.sessions] if w else ["", ""]))
+    headers = ["instance", "role", "private dns", "public dns"] + [
+        g.rsplit(f"-{stat.cluster}", 1)[0] for g in groups] + ["workbench", "sessions"]
+
+    versions = sorted({w.version for w in stat.workbench if w.version})
+    lines = [f"Information for cluster {stat.cluster}", "-" * 42, "",
+             f"Posit Workbench Version: {', '.join(versions) or 'unknown'}"
+             f" ({sum(w.version is not None for w in stat.workbench)} of {len(stat.workbench)} login nodes)",
+             f"Active sessions: {sum(w.sessions or 0 for w in stat.workbench)}", "",
+             f"ALB int URL: {stat.urls['int']}",
+             f"ALB ext URL: {stat.urls['ext']}", "",
+             f"Posit User Password: {stat.outputs.get('posit_user_pass', '')}",
+             f"Jump Host: {stat.outputs.get('jump_host_dns', '')}", "",
+             tabulate(rows, headers=headers), ""]
+    for w in stat.workbench:
+        if w.error:
+            lines.append(f"{w.instance_id}: {w.status} {w.error}")
+    for error in stat.errors:
+        lines.append(f"error: {error}")
+    if stat.outputs.get("private_key_ssh"):
+        lines += ["", "private ssh key for ubuntu user:", stat.outputs["private_key_ssh"]]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="cluster_stat", description=__doc__.splitlines()[0])
+    parser.add_argument("cluster")
+    parser.add_argument("--stack", help="pulumi stack name (default: cluster name)")
+    parser.add_argument("--backend", help="stack outputs backend, cf. pwbtools.stack_outputs")
+    parser.add_argument("--domain", default="pcluster.soleng.posit.it", help="domain of the ALB URLs")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for the login nodes")
+    parser.add_argument("--endpoint-url", help="AWS endpoint, e.g. of moto_server")
+    parser.add_argument("--json", action="store_true", help="print the status as JSON")
+    args = parser.parse_args(argv)
+
+    import boto3
+    ec2, elbv2, ssm = (boto3.client(s, endpoint_url=args.endpoint_url) for s in ("ec2", "elbv2", "ssm"))
+    stat = collect(args.cluster, ec2, elbv2, ssm, args.stack, make_backend(args.backend), args.domain,
+                   args.timeout)
+    if args.json:
+        print(json.dumps(asdict(stat), indent=2))
+    else:
+        print(format_stat(stat))
+    return 1 if stat.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""Local stand-in for Workbench to exercise `pwbtools.session_load` offline.
+
+Implements the sign-in flow of Workbench (RSA encrypted credentials, CSRF
+token cookie) and the session endpoints used by the load generator. Session
+start-up times are drawn from a log-normal distribution, a configurable share
+of launches fails, and sessions are spread over a number of fake login nodes,
+always picking the node with the fewest sessions.
+
+    python3 -m pwbtools.mock_workbench --port 8787 --nodes 6 --launch-time 3 --failure-rate 0.02
+"""
+
+import argparse
+import base64
+import json
+import math
+import random
+import secrets
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+# ------------------------------------------------------------------------------
+# RSA, just enough to decrypt what the sign-in page encrypts
+# ------------------------------------------------------------------------------
+
+
+def _probable_prime(n: int, rounds: int = 32) -> bool:
+    if n < 4:
+        return n in (2, 3)
+    if n % 2 == 0:
+        return False
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d, r = d // 2, r + 1
+    for _ in range(rounds):
+        x = pow(random.randrange(2, n - 1), d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _prime(bits: int) -> int:
+    while True:
+        candidate = random.getrandbits(bits) | (1 << (bits - 1)) | 1
+        if _probable_prime(candidate):
+            return candidate
+
+
+@dataclass
+class RsaKey:
+    exponent: int
+    modulus: int
+    private: int
+
+    @classmethod
+    def generate(cls, bits: int = 1024) -> "RsaKey":
+        e = 65537
+        while True:
+            p, q = _prime(bits // 2), _prime(bits // 2)
+            phi = (p - 1) * (q - 1)
+            if p != q and math.gcd(e, phi) == 1:
+                return cls(e, p * q, pow(e, -1, phi))
+
+    @property
+    def public(self) -> str:
+        """Public key as served by /auth-public-key."""
+        return f"{self.exponent:x}:{self.modulus:x}"
+
+    def decrypt(self, data: bytes) -> bytes:
+        k = (self.modulus.bit_length() + 7) // 8
+        block = pow(int.from_bytes(data, "big"), self.private, self.modulus).to_bytes(k, "big")
+        if block[:2] != b"\x00\x02":
+            raise ValueError("invalid padding")
+        return block[block.index(b"\x00", 2) + 1:]
+
+
+# ------------------------------------------------------------------------------
+# Server
+# ------------------------------------------------------------------------------
+
+@dataclass
+class MockSession:
+    id: str
+    user: str
+    node: str
+    ready_at: float
+    fails: bool
+
+
+@dataclass
+class MockWorkbench:
+    password: str
+    nodes: int = 6
+    launch_time: float = 3.0
+    launch_sigma: float = 0.5
+    failure_rate: float = 0.0
+    key: RsaKey = field(default_factory=RsaKey.generate)
+    sessions: Dict[str, MockSession] = field(default_factory=dict)
+    signed_in: Dict[str, str] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def node_names(self) -> List[str]:
+        return [f"node{n}" for n in range(1, self.nodes + 1)]
+
+    def sign_in(self, encrypted: str) -> Optional[str]:
+        try:
+            user, password = self.key.decrypt(base64.b64decode(encrypted)).decode().split("\n", 1)
+        except ValueError:
+            return None
+        if password != self.password:
+            return None
+        token = secrets.token_hex(16)
+        with self.lock:
+            self.signed_in[token] = user
+        return token
+
+    def launch(self, user: str) -> MockSession:
+        # median start-up time is `launch_time`
+        delay = random.lognormvariate(math.log(self.launch_time), self.launch_sigma)
+        with self.lock:
+            load = {n: 0 for n in self.node_names()}
+            for s in self.sessions.values():
+                load[s.node] += 1
+            node = min(load, key=load.get)
+            session = MockSession(uuid.uuid4().hex, user, node, time.monotonic() + delay,
+                                  random.random() < self.failure_rate)
+            self.sessions[session.id] = session
+        return session
+
+    def status(self, session_id: str) -> Optional[dict]:
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        if time.monotonic() < session.ready_at:
+            state = "Pending"
+        else:
+            state = "Failed" if session.fails else "Running"
+        return {"id": session.id, "state": state, "host": session.node}
+
+
+def make_handler(workbench: MockWorkbench):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _cookies(self) -> Dict[str, str]:
+            return {k: v.value for k, v in SimpleCookie(self.headers.get("Cookie", "")).items()}
+
+        def _user(self) -> Optional[str]:
+            cookies = self._cookies()
+            if self.headers.get("X-RS-CSRF-Token") != cookies.get("rs-csrf-token"):
+                return None
+            return workbench.signed_in.get(cookies.get("user-id", ""))
+
+        def _send(self, status: int, body: str = "", content_type: str = "application/json",
+                  headers: Tuple[Tuple[str, str], ...] = ()):
+            data = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/auth-public-key":
+                self._send(200, workbench.key.public, "text/plain")
+            elif self.path.startswith("/auth-sign-in"):
+                self._send(200, "<html>sign in</html>", "text/html",
+                           (("Set-Cookie", f"rs-csrf-token={secrets.token_hex(16)}; Path=/"),))
+            elif self.path.startswith("/api/sessions/"):
+                if self._user() is None:
+                    return self._send(401, '{"error": "unauthorized"}')
+                status = workbench.status(self.path.rsplit("/", 1)[-1])
+                self._send(200 if status else 404, json.dumps(status or {"error": "not found"}))
+            else:
+                self._send(404, '{"error": "not found"}')
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+            if self.path == "/auth-do-sign-in":
+                form = {k: v[0] for k, v in parse_qs(body).items()}
+                if form.get("rs-csrf-token") != self._cookies().get("rs-csrf-token"):
+                    return self._send(403, "csrf mismatch", "text/plain")
+                token = workbench.sign_in(form.get("v", ""))
+                if token is None:
+                    return self._send(302, "", "text/plain", (("Location", "/auth-sign-in?error=2"),))
+                self._send(302, "", "text/plain", (("Location", "/"), ("Set-Cookie", f"user-id={token}; Path=/")))
+            elif self.path == "/api/sessions":
+                user = self._user()
+                if user is None:
+                    return self._send(401, '{"error": "unauthorized"}')
+                session = workbench.launch(user)
+                self._send(201, json.dumps({"id": session.id}))
+            else:
+                self._send(404, '{"error": "not found"}')
+
+    return Handler
+
+
+def serve(workbench: MockWorkbench, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Start the mock in a background thread, `port=0` picks a free port."""
+    server = ThreadingHTTPServer((host, port), make_handler(workbench))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--password", default="Testme1234", help="password accepted for every user")
+    parser.add_argument("--nodes", type=int, default=6, help="number of fake login nodes")
+    parser.add_argument("--launch-time", type=float, default=3.0, help="median session start-up time in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of launches that fail")
+    args = parser.parse_args(argv)
+
+    workbench = MockWorkbench(args.password, args.nodes, args.launch_time, failure_rate=args.failure_rate)
+    server = serve(workbench, args.host, args.port)
+    print(f"mock Workbench listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
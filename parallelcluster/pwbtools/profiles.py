@@ -0,0 +1,349 @@
+"""Launcher resource profiles sized for the compute nodes of the cluster.
+
+The resource profiles of the Slurm launcher used to be hardcoded in
+`install-pwb-config.sh`, computed once by hand for a t3.xlarge. They no longer
+matched once the queues moved to other instance types, and profiles that do
+not divide a node evenly leave memory or CPUs stranded that no further
+session can use.
+
+This module reads the queues and instance types from the rendered cluster
+config and looks them up in an offline instance catalog (`instance_catalog.json`,
+vCPUs and memory as advertised by EC2). ParallelCluster sets the Slurm
+`RealMemory` of a node to 95% of that memory unless `SchedulableMemory` is
+given, and `OverSubscribe: FORCE:<n>` lets `n` jobs share a CPU. A profile of
+`c` cpus then gets `c / (vcpus * n)` of `RealMemory`. Memory and CPU slots of a
+node run out at the same time, whatever the mix of profiles, so every node can
+be filled completely.
+
+    python3 -m pwbtools.profiles generate --cluster-config tmp/cluster-config-wb.yaml --output tmp
+    python3 -m pwbtools.profiles generate --cluster-config tmp/cluster-config-wb.yaml --sizes small=1 --dry-run
+    python3 -m pwbtools.profiles catalog --region eu-west-1 c5.24xlarge r5.2xlarge
+
+The packing-density report lists for each profile and node type how many
+sessions fit on a node and how much of its CPU and memory they use.
+"""
+
+import argparse
+import json
+import math
+import re
+import sys
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+from tabulate import tabulate
+
+CATALOG_PATH = Path(__file__).resolve().parent / "instance_catalog.json"
+
+# Slurm uses 4 jobs per CPU for a plain `FORCE`
+DEFAULT_FORCE_OVERSUBSCRIBE = 4
+
+# Launcher cluster -> queue whose nodes the profiles are sized for
+DEFAULT_QUEUES = {"slurminteractive": "interactive", "slurmbatch": "all"}
+
+DEFAULT_SIZES = "small=1,medium=2,large=4"
+
+
+# ------------------------------------------------------------------------------
+# Instance catalog and cluster config
+# ------------------------------------------------------------------------------
+
+@dataclass
+class InstanceType:
+    name: str
+    vcpus: int
+    memory_mib: int
+    gpus: int = 0
+    gpu_type: Optional[str] = None
+
+
+class UnknownInstanceTypeError(Exception):
+    """Raised for instance types that are not in the catalog."""
+
+    def __init__(self, names: List[str]):
+        self.names = names
+        super().__init__(f"instance types not in the catalog: {', '.join(names)} "
+                         f"(add them with `python3 -m pwbtools.profiles catalog {' '.join(names)}`)")
+
+
+@dataclass
+class Catalog:
+    instance_types: Dict[str, InstanceType]
+    real_memory_fraction: float = 0.95
+
+    @classmethod
+    def load(cls, path: Path = CATALOG_PATH) -> "Catalog":
+        data = json.loads(Path(path).read_text())
+        types = {name: InstanceType(name, **spec) for name, spec in data["instance_types"].items()}
+        return cls(types, data.get("real_memory_fraction", 0.95))
+
+    def save(self, path: Path = CATALOG_PATH):
+        types = {}
+        for name, it in sorted(self.instance_types.items()):
+            spec = {k: v for k, v in asdict(it).items() if k != "name" and v is not None}
+            types[name] = spec
+        data = {"real_memory_fraction": self.real_memory_fraction, "instance_types": types}
+        Path(path).write_text(json.dumps(data, indent=2) + "\n")
+
+    def get(self, name: str) -> InstanceType:
+        if name not in self.instance_types:
+            raise UnknownInstanceTypeError([name])
+        return self.instance_types[name]
+
+    def check(self, names: List[str]):
+        missing = sorted(set(n for n in names if n not in self.instance_types))
+        if missing:
+            raise UnknownInstanceTypeError(missing)
+
+
+@dataclass
+class NodeType:
+    """A compute resource of a queue, i.e. what Slurm can schedule on one node."""
+    queue: str
+    compute_resource: str
+    instance_type: InstanceType
+    real_memory: int
+    oversubscribe: int = 1
+
+    @property
+    def cpu_slots(self) -> int:
+        return self.instance_type.vcpus * self.oversubscribe
+
+    @property
+    def memory_per_slot(self) -> float:
+        return self.real_memory / self.cpu_slots
+
+
+def oversubscribe_factor(setting: Optional[str]) -> int:
+    """Jobs per CPU for a Slurm `OverSubscribe` partition setting.
+
+    Only `FORCE` shares CPUs between sessions, `YES` requires every job to ask
+    for it, which the launcher does not do.
+    """
+    if not setting:
+        return 1
+    m = re.fullmatch(r"\s*FORCE(?::(\d+))?\s*", str(setting), re.IGNORECASE)
+    if not m:
+        return 1
+    return int(m.group(1)) if m.group(1) else DEFAULT_FORCE_OVERSUBSCRIBE
+
+
+def node_types(config: dict, catalog: Catalog) -> Dict[str, List[NodeType]]:
+    """Node types per queue of a ParallelCluster config."""
+    queues = config.get("Scheduling", {}).get("SlurmQueues", [])
+    catalog.check([cr["InstanceType"].strip() for q in queues for cr in q.get("ComputeResources", [])
+                   if "InstanceType" in cr])
+    result: Dict[str, List[NodeType]] = {}
+    for queue in queues:
+        factor = oversubscribe_factor((queue.get("CustomSlurmSettings") or {}).get("OverSubscribe"))
+        nodes = []
+        for cr in queue.get("ComputeResources", []):
+            if "InstanceType" not in cr:
+                continue
+            it = catalog.get(cr["InstanceType"].strip())
+            real_memory = cr.get("SchedulableMemory") or math.floor(it.memory_mib * catalog.real_memory_fraction)
+            nodes.append(NodeType(queue["Name"].strip(), cr["Name"].strip(), it, int(real_memory), factor))
+        result[queue["Name"].strip()] = nodes
+    return result
+
+
+def head_node_type(config: dict, catalog: Catalog, fraction: float) -> NodeType:
+    """The head node as seen by the local launcher, which runs without Slurm."""
+    it = catalog.get(config["HeadNode"]["InstanceType"].strip())
+    return NodeType("local", "HeadNode", it, math.floor(it.memory_mib * fraction))
+
+
+# ------------------------------------------------------------------------------
+# Profiles and packing
+# ------------------------------------------------------------------------------
+
+@dataclass
+class Profile:
+    key: str
+    cpus: int
+    mem_mb: int
+
+    @property
+    def name(self) -> str:
+        return f"{self.key.capitalize()} ({self.cpus} cpu, {self.mem_mb / 1024:.1f} GB mem)"
+
+
+def parse_sizes(spec: str) -> List[Tuple[str, int]]:
+    sizes = []
+    for item in spec.split(","):
+        key, _, cpus = item.partition("=")
+        sizes.append((key.strip(), int(cpus)))
+    return sizes
+
+
+def size_profiles(nodes: List[NodeType], sizes: List[Tuple[str, int]], step: int = 1) -> List[Profile]:
+    """Profiles with the same memory per CPU slot as the tightest node type.
+
+    Sizing for the node type with the least memory per slot lets every profile
+    run on all nodes of the queue. Sizes with more cpus than the smallest node
+    has are left out.
+    """
+    per_slot = min(n.memory_per_slot for n in nodes)
+    max_cpus = min(n.instance_type.vcpus for n in nodes)
+    profiles = []
+    for key, cpus in sizes:
+        if cpus > max_cpus:
+            continue
+        mem = math.floor(per_slot * cpus / step) * step
+        profiles.append(Profile(key, cpus, mem))
+    return profiles
+
+
+@dataclass
+class Packing:
+    launcher: str
+    profile: str
+    node: str
+    instance_type: str
+    sessions: int
+    cpu_used: float
+    mem_used: float
+    mem_stranded_mb: int
+
+
+def pack(launcher: str, profile: Profile, node: NodeType) -> Packing:
+    sessions = min(node.cpu_slots // profile.cpus, node.real_memory // profile.mem_mb)
+    return Packing(
+        launcher=launcher,
+        profile=profile.key,
+        node=f"{node.queue}/{node.compute_resource}",
+        instance_type=node.instance_type.name,
+        sessions=sessions,
+        cpu_used=sessions * profile.cpus / node.cpu_slots,
+        mem_used=sessions * profile.mem_mb / node.real_memory,
+        mem_stranded_mb=node.real_memory - sessions * profile.mem_mb,
+    )
+
+
+def render_resources(profiles: List[Profile], nodes: List[NodeType]) -> str:
+    lines = ["# generated by pwbtools.profiles for "
+             + ", ".join(f"{n.queue}/{n.compute_resource} ({n.instance_type.name}, RealMemory={n.real_memory}, "
+                         f"{n.cpu_slots} cpu slots)" for n in nodes)]
+    for p in profiles:
+        lines += [f"[{p.key}]", f'name = "{p.name}"', f"cpus={p.cpus}", f"mem-mb={p.mem_mb}"]
+    return "\n".join(lines) + "\n\n"
+
+
+@dataclass
+class Plan:
+    launcher: str
+    nodes: List[NodeType]
+    profiles: List[Profile]
+
+    @property
+    def filename(self) -> str:
+        return f"launcher.{self.launcher}.resources.conf"
+
+    def packing(self) -> List[Packing]:
+        return [pack(self.launcher, p, n) for p in self.profiles for n in self.nodes]
+
+
+def plan(config: dict, catalog: Catalog, queues: Dict[str, str], sizes: List[Tuple[str, int]],
+         local_fraction: float = 0.9, step: int = 1) -> List[Plan]:
+    by_queue = node_types(config, catalog)
+    plans = []
+    for launcher, queue in queues.items():
+        if queue not in by_queue:
+            raise ValueError(f"queue {queue} of launcher cluster {launcher} is not in the cluster config")
+        plans.append(Plan(launcher, by_queue[queue], size_profiles(by_queue[queue], sizes, step)))
+    if "HeadNode" in config:
+        head = [head_node_type(config, catalog, local_fraction)]
+        plans.append(Plan("local", head, size_profiles(head, sizes, step)))
+    return plans
+
+
+def report(plans: List[Plan]) -> str:
+    rows = [(p.launcher, p.profile, p.node, p.instance_type, p.sessions, f"{p.cpu_used:.0%}",
+             f"{p.mem_used:.1%}", p.mem_stranded_mb)
+            for pl in plans for p in pl.packing()]
+    return tabulate(rows, headers=["launcher", "profile", "node", "instance", "sessions/node", "cpu used",
+                                   "mem used", "stranded MB"])
+
+
+# ------------------------------------------------------------------------------
+# Catalog refresh
+# ------------------------------------------------------------------------------
+
+def describe_instance_types(names: List[str], region: Optional[str] = None) -> List[InstanceType]:
+    import boto3
+
+    ec2 = boto3.client("ec2", region_name=region)
+    result = []
+    for page in ec2.get_paginator("describe_instance_types").paginate(InstanceTypes=names):
+        for t in page["InstanceTypes"]:
+            gpus = t.get("GpuInfo", {}).get("Gpus", [])
+            result.append(InstanceType(
+                name=t["InstanceType"],
+                vcpus=t["VCpuInfo"]["DefaultVCpus"],
+                memory_mib=t["MemoryInfo"]["SizeInMiB"],
+                gpus=sum(g["Count"] for g in gpus),
+                gpu_type=gpus[0]["Name"].lower() if gpus else None,
+            ))
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="profiles", description=__doc__.splitlines()[0])
+    parser.add_argument("--catalog", type=Path, default=CATALOG_PATH, help="instance catalog (JSON)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    generate = sub.add_parser("generate", help="write the launcher resource profiles")
+    generate.add_argument("--cluster-config", type=Path, default=Path("tmp/cluster-config-wb.yaml"),
+                          help="rendered cluster config")
+    generate.add_argument("--output", type=Path, default=Path("tmp"), help="output directory")
+    generate.add_argument("--sizes", default=DEFAULT_SIZES, metavar="NAME=CPUS,...",
+                          help=f"profiles and their cpus (default: {DEFAULT_SIZES})")
+    generate.add_argument("--queue", action="append", default=[], metavar="LAUNCHER=QUEUE",
+                          help="queue to size a launcher cluster for "
+                               f"(default: {', '.join(f'{k}={v}' for k, v in DEFAULT_QUEUES.items())})")
+    generate.add_argument("--local-fraction", type=float, default=0.9,
+                          help="share of the head node memory for local sessions")
+    generate.add_argument("--step", type=int, default=1, help="round mem-mb down to a multiple of this")
+    generate.add_argument("--json", action="store_true", help="print the packing report as JSON")
+    generate.add_argument("--dry-run", action="store_true", help="only print the report")
+
+    catalog = sub.add_parser("catalog", help="add or update instance types from the EC2 API")
+    catalog.add_argument("--region")
+    catalog.add_argument("instance_types", nargs="+")
+    args = parser.parse_args(argv)
+
+    cat = Catalog.load(args.catalog)
+
+    if args.command == "catalog":
+        for it in describe_instance_types(args.instance_types, args.region):
+            cat.instance_types[it.name] = it
+            print(f"{it.name}: {it.vcpus} vCPUs, {it.memory_mib} MiB, {it.gpus} GPUs")
+        cat.save(args.catalog)
+        return 0
+
+    queues = dict(DEFAULT_QUEUES)
+    queues.update(q.split("=", 1) for q in args.queue)
+    config = yaml.safe_load(args.cluster_config.read_text())
+    try:
+        plans = plan(config, cat, queues, parse_sizes(args.sizes), args.local_fraction, args.step)
+    except (UnknownInstanceTypeError, ValueError) as e:
+        print(f"profiles: {e}", file=sys.stderr)
+        return 1
+
+    if not args.dry_run:
+        args.output.mkdir(parents=True, exist_ok=True)
+        for pl in plans:
+            path = args.output / pl.filename
+            path.write_text(render_resources(pl.profiles, pl.nodes))
+            print(f"generated {path}")
+    if args.json:
+        print(json.dumps([asdict(p) for pl in plans for p in pl.packing()], indent=2))
+    else:
+        print(report(plans))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,428 @@
+"""Trace-driven simulation of Slurm queue scaling for MinCount/MaxCount tuning.
+
+The compute queues scale from `MinCount` to `MaxCount`. Every node that is
+powered up for a session pays the EC2 boot time plus `config-compute.sh`
+before the session can start, and is powered down again once it has been
+idle for `ScaledownIdletime` minutes. This module replays a trace of session
+arrivals against the queues of a cluster config in a discrete-event
+simulation and reports queue-wait percentiles and node-hours for a grid of
+`MinCount`, `MaxCount` and `ScaledownIdletime` values.
+
+Queues, instance types and scaling settings are read from the cluster
+template (or a rendered config); node capacity (CPU slots, Slurm
+`RealMemory`) comes from `pwbtools.profiles`. Sessions are placed first-fit
+on running nodes, then on nodes that are already powering up, and only then
+is another node powered up, which is how Slurm's power saving behaves for
+pending jobs.
+
+    python3 -m pwbtools.queue_sim trace --days 5 --peak-rate 40 --output trace.csv
+    python3 -m pwbtools.queue_sim run --config benchmark --trace trace.csv --min-count 0,1,2 --idletime 10,30,60
+
+A trace is a CSV (with header) or JSON-lines file with the columns `arrival`
+(seconds or ISO 8601 timestamp), `duration` (seconds) and optionally `queue`,
+`cpus` and `mem_mb`.
+"""
+
+import argparse
+import csv
+import heapq
+import itertools
+import json
+import math
+import random
+import sys
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import jinja2
+import yaml
+from tabulate import tabulate
+
+from pwbtools import profiles
+from pwbtools.render import BASE_DIR
+
+# ParallelCluster default for SlurmSettings/ScaledownIdletime, in minutes
+DEFAULT_IDLETIME = 10
+
+
+# ------------------------------------------------------------------------------
+# Cluster config and trace
+# ------------------------------------------------------------------------------
+
+def load_cluster_config(config: Optional[str] = None, path: Optional[Path] = None) -> dict:
+    """A rendered cluster config, or a template with all variables left empty."""
+    if path is None:
+        path = BASE_DIR / "config" / f"cluster-config-wb.{config}.tmpl"
+    text = Path(path).read_text()
+    if path.suffix == ".tmpl":
+        text = jinja2.Template(text).render()
+    return yaml.safe_load(text)
+
+
+@dataclass
+class QueueSpec:
+    """A compute resource of a queue with its scaling settings."""
+    node_type: profiles.NodeType
+    min_count: int
+    max_count: int
+    idletime: float
+
+    @property
+    def name(self) -> str:
+        return self.node_type.queue
+
+
+def queue_specs(config: dict, catalog: profiles.Catalog) -> Dict[str, QueueSpec]:
+    """The first compute resource of every queue, which is what the sessions land on."""
+    idletime = config.get("Scheduling", {}).get("SlurmSettings", {}).get("ScaledownIdletime", DEFAULT_IDLETIME)
+    specs = {}
+    for queue in config.get("Scheduling", {}).get("SlurmQueues", []):
+        name = queue["Name"].strip()
+        nodes = profiles.node_types({"Scheduling": {"SlurmQueues": [queue]}}, catalog)[name]
+        if not nodes:
+            continue
+        cr = queue["ComputeResources"][0]
+        specs[name] = QueueSpec(nodes[0], int(cr.get("MinCount", 0)), int(cr.get("MaxCount", 10)), float(idletime))
+    return specs
+
+
+@dataclass
+class Session:
+    arrival: float
+    duration: float
+    queue: str
+    cpus: int = 1
+    mem_mb: Optional[int] = None
+
+
+def _seconds(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def read_trace(path: Path, default_queue: str) -> List[Session]:
+    """Sessions of a CSV or JSON-lines trace, arrivals relative to the first one."""
+    with open(path) as f:
+        if path.suffix in (".jsonl", ".json"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    sessions = [Session(_seconds(str(r["arrival"])), float(r["duration"]), r.get("queue") or default_queue,
+                        int(r.get("cpus") or 1), int(r["mem_mb"]) if r.get("mem_mb") else None)
+                for r in rows]
+    if not sessions:
+        return sessions
+    start = min(s.arrival for s in sessions)
+    for s in sessions:
+        s.arrival -= start
+    return sorted(sessions, key=lambda s: s.arrival)
+
+
+def synthetic_trace(days: float, peak_rate: float, off_peak: float = 0.05, workday: Tuple[int, int] = (8, 18),
+                    duration: float = 3600, sigma: float = 0.8, queue: str = "interactive",
+                    seed: int = 0) -> List[Session]:
+    """Poisson arrivals with `peak_rate` sessions/hour during working hours (Mon-Fri).
+
+    Outside of working hours and at weekends the rate drops to `off_peak` times
+    the peak rate. Session durations are log-normal with median `duration`.
+    """
+    rng = random.Random(seed)
+    rate = peak_rate / 3600
+    sessions, t = [], 0.0
+    while True:
+        # thinning of a non-homogeneous Poisson process
+        t += rng.expovariate(rate)
+        if t >= days * 86400:
+            return sessions
+        day, hour = int(t // 86400), (t % 86400) / 3600
+        busy = day % 7 < 5 and workday[0] <= hour < workday[1]
+        if busy or rng.random() < off_peak:
+            sessions.append(Session(t, rng.lognormvariate(math.log(duration), sigma), queue))
+
+
+def write_trace(sessions: List[Session], path: Path):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["arrival", "duration", "queue", "cpus"])
+        for s in sessions:
+            writer.writerow([f"{s.arrival:.1f}", f"{s.duration:.1f}", s.queue, s.cpus])
+
+
+# ------------------------------------------------------------------------------
+# Simulation
+# ------------------------------------------------------------------------------
+
+@dataclass
+class Timing:
+    """Median EC2 boot and `config-compute.sh` durations with log-normal jitter."""
+    boot: float = 90.0
+    bootstrap: float = 240.0
+    jitter: float = 0.2
+
+    def sample(self, rng: random.Random) -> float:
+        if self.jitter <= 0:
+            return self.boot + self.bootstrap
+        return (rng.lognormvariate(math.log(self.boot), self.jitter)
+                + rng.lognormvariate(math.log(self.bootstrap), self.jitter))
+
+
+@dataclass
+class Node:
+    id: int
+    static: bool
+    launched_at: float
+    ready_at: float
+    free_cpus: int
+    free_mem: int
+    sessions: int = 0
+    idle_since: Optional[float] = None
+    stopped_at: Optional[float] = None
+    reserved: List[int] = field(default_factory=list)
+
+
+@dataclass
+class Result:
+    queue: str
+    min_count: int
+    max_count: int
+    idletime: float
+    sessions: int
+    waited: int
+    wait_p50: float
+    wait_p95: float
+    wait_p99: float
+    wait_max: float
+    node_hours: float
+    peak_nodes: int
+    boots: int
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(p / 100 * len(ordered))) - 1)]
+
+
+class Simulation:
+    """Replays sessions of one queue against a scaling configuration."""
+
+    ARRIVAL, READY, END, IDLE = range(4)
+
+    def __init__(self, spec: QueueSpec, sessions: List[Session], timing: Timing, seed: int = 0):
+        self.spec = spec
+        self.sessions = sessions
+        self.timing = timing
+        self.rng = random.Random(seed)
+        self.events: List[Tuple[float, int, int, int]] = []
+        self.seq = itertools.count()
+        self.nodes: List[Node] = []
+        self.pending: List[int] = []
+        self.start: Dict[int, float] = {}
+        self.placed: Dict[int, int] = {}
+        self.now = 0.0
+        per_slot = spec.node_type.memory_per_slot
+        self.mem = [s.mem_mb or math.floor(per_slot * s.cpus) for s in sessions]
+
+    def push(self, time: float, kind: int, ref: int):
+        heapq.heappush(self.events, (time, next(self.seq), kind, ref))
+
+    def add_node(self, static: bool) -> Node:
+        nt = self.spec.node_type
+        ready = self.now if static else self.now + self.timing.sample(self.rng)
+        node = Node(len(self.nodes), static, self.now, ready, nt.cpu_slots, nt.real_memory)
+        self.nodes.append(node)
+        if not static:
+            self.push(ready, self.READY, node.id)
+        return node
+
+    def fits(self, node: Node, i: int) -> bool:
+        return node.free_cpus >= self.sessions[i].cpus and node.free_mem >= self.mem[i]
+
+    def allocate(self, node: Node, i: int):
+        node.free_cpus -= self.sessions[i].cpus
+        node.free_mem -= self.mem[i]
+        node.sessions += 1
+        node.idle_since = None
+        self.placed[i] = node.id
+        if node.ready_at <= self.now:
+            self.begin(i)
+        else:
+            node.reserved.append(i)
+
+    def begin(self, i: int):
+        self.start[i] = self.now
+        self.push(self.now + self.sessions[i].duration, self.END, i)
+
+    def schedule(self):
+        """Place pending sessions in order, smaller ones may start ahead (backfill)."""
+        still = []
+        for i in self.pending:
+            live = [n for n in self.nodes if n.stopped_at is None]
+            node = next((n for n in live if n.ready_at <= self.now and self.fits(n, i)), None)
+            node = node or next((n for n in live if n.ready_at > self.now and self.fits(n, i)), None)
+            if node is None and sum(1 for n in live if not n.static) < self.spec.max_count - self.spec.min_count:
+                node = self.add_node(static=False)
+            if node is None or not self.fits(node, i):
+                still.append(i)
+            else:
+                self.allocate(node, i)
+        self.pending = still
+
+    def run(self) -> Result:
+        for _ in range(self.spec.min_count):
+            self.add_node(static=True)
+        for i, s in enumerate(self.sessions):
+            self.push(s.arrival, self.ARRIVAL, i)
+        idle = self.spec.idletime * 60
+        peak = len(self.nodes)
+
+        while self.events:
+            self.now, _, kind, ref = heapq.heappop(self.events)
+            if kind == self.ARRIVAL:
+                self.pending.append(ref)
+                self.schedule()
+            elif kind == self.READY:
+                node = self.nodes[ref]
+                for i in node.reserved:
+                    self.begin(i)
+                node.reserved = []
+                if node.sessions == 0:
+                    node.idle_since = self.now
+                    self.push(self.now + idle, self.IDLE, node.id)
+            elif kind == self.END:
+                node = self.nodes[self.placed[ref]]
+                node.free_cpus += self.sessions[ref].cpus
+                node.free_mem += self.mem[ref]
+                node.sessions -= 1
+                if node.sessions == 0:
+                    node.idle_since = self.now
+                    if not node.static:
+                        self.push(self.now + idle, self.IDLE, node.id)
+                self.schedule()
+            elif kind == self.IDLE:
+                node = self.nodes[ref]
+                if node.stopped_at is None and node.idle_since is not None and self.now - node.idle_since >= idle:
+                    node.stopped_at = self.now
+            peak = max(peak, sum(1 for n in self.nodes if n.stopped_at is None))
+
+        horizon = self.now
+        node_seconds = sum((n.stopped_at if n.stopped_at is not None else horizon) - n.launched_at
+                           for n in self.nodes)
+        waits = [self.start[i] - s.arrival for i, s in enumerate(self.sessions) if i in self.start]
+        return Result(
+            queue=self.spec.name,
+            min_count=self.spec.min_count,
+            max_count=self.spec.max_count,
+            idletime=self.spec.idletime,
+            sessions=len(waits),
+            waited=sum(1 for w in waits if w > 1),
+            wait_p50=percentile(waits, 50),
+            wait_p95=percentile(waits, 95),
+            wait_p99=percentile(waits, 99),
+            wait_max=max(waits, default=0.0),
+            node_hours=node_seconds / 3600,
+            peak_nodes=peak,
+            boots=sum(1 for n in self.nodes if not n.static),
+        )
+
+
+def sweep(spec: QueueSpec, sessions: List[Session], timing: Timing, min_counts: List[int],
+          max_counts: List[int], idletimes: List[float], seed: int = 0) -> Iterator[Result]:
+    for lo, hi, idle in itertools.product(min_counts, max_counts, idletimes):
+        if lo > hi:
+            continue
+        variant = QueueSpec(spec.node_type, lo, hi, idle)
+        yield Simulation(variant, sessions, timing, seed).run()
+
+
+def report(results: List[Result]) -> str:
+    rows = [(r.queue, r.min_count, r.max_count, f"{r.idletime:g}", r.sessions, r.waited,
+             f"{r.wait_p50:.0f}", f"{r.wait_p95:.0f}", f"{r.wait_p99:.0f}", f"{r.wait_max:.0f}",
+             f"{r.node_hours:.1f}", r.peak_nodes, r.boots)
+            for r in results]
+    return tabulate(rows, headers=["queue", "min", "max", "idle min", "sessions", "waited", "wait p50 s",
+                                   "p95 s", "p99 s", "max s", "node-hours", "peak nodes", "boots"])
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",")]
+
+
+def _floats(value: str) -> List[float]:
+    return [float(v) for v in value.split(",")]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="queue_sim", description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="simulate a trace for a grid of scaling settings")
+    source = run.add_mutually_exclusive_group(required=True)
+    source.add_argument("--config", help="cluster config flavour, e.g. benchmark")
+    source.add_argument("--cluster-config", type=Path, help="rendered cluster config")
+    run.add_argument("--catalog", type=Path, default=profiles.CATALOG_PATH, help="instance catalog (JSON)")
+    run.add_argument("--trace", type=Path, required=True, help="session trace (CSV or JSON lines)")
+    run.add_argument("--queue", action="append", help="queue(s) to simulate (default: all in the trace)")
+    run.add_argument("--min-count", type=_ints, help="MinCount values (default: from the config)")
+    run.add_argument("--max-count", type=_ints, help="MaxCount values (default: from the config)")
+    run.add_argument("--idletime", type=_floats, help="ScaledownIdletime values in minutes (default: from the config)")
+    run.add_argument("--boot-time", type=float, default=Timing.boot, help="median EC2 boot time in seconds")
+    run.add_argument("--bootstrap-time", type=float, default=Timing.bootstrap,
+                     help="median config-compute.sh run time in seconds")
+    run.add_argument("--jitter", type=float, default=Timing.jitter, help="log-normal sigma of both durations")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--json", action="store_true", help="print the results as JSON")
+
+    trace = sub.add_parser("trace", help="write a synthetic session trace")
+    trace.add_argument("--days", type=float, default=5)
+    trace.add_argument("--peak-rate", type=float, default=30, help="sessions per hour during working hours")
+    trace.add_argument("--off-peak", type=float, default=0.05, help="off-hours rate relative to the peak rate")
+    trace.add_argument("--workday", default="8-18", help="working hours, e.g. 8-18")
+    trace.add_argument("--duration", type=float, default=3600, help="median session duration in seconds")
+    trace.add_argument("--queue", default="interactive")
+    trace.add_argument("--seed", type=int, default=0)
+    trace.add_argument("--output", type=Path, required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == "trace":
+        start, end = (int(h) for h in args.workday.split("-"))
+        sessions = synthetic_trace(args.days, args.peak_rate, args.off_peak, (start, end), args.duration,
+                                   queue=args.queue, seed=args.seed)
+        write_trace(sessions, args.output)
+        print(f"wrote {len(sessions)} sessions to {args.output}")
+        return 0
+
+    config = load_cluster_config(args.config, args.cluster_config)
+    try:
+        specs = queue_specs(config, profiles.Catalog.load(args.catalog))
+    except profiles.UnknownInstanceTypeError as e:
+        print(f"queue_sim: {e}", file=sys.stderr)
+        return 1
+    sessions = read_trace(args.trace, "interactive")
+    queues = args.queue or sorted({s.queue for s in sessions})
+    unknown = [q for q in queues if q not in specs]
+    if unknown:
+        print(f"queue_sim: queues not in the cluster config: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+
+    timing = Timing(args.boot_time, args.bootstrap_time, args.jitter)
+    results = []
+    for q in queues:
+        spec = specs[q]
+        results += sweep(spec, [s for s in sessions if s.queue == q], timing,
+                         args.min_count or [spec.min_count], args.max_count or [spec.max_count],
+                         args.idletime or [spec.idletime], args.seed)
+    if args.json:
+        print(json.dumps([asdict(r) for r in results], indent=2))
+    else:
+        print(report(results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
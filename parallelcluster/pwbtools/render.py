@@ -0,0 +1,130 @@
+"""One-pass rendering of the deploy-time scripts and cluster configuration.
+
+`deploy.sh` used to run every template through a chain of up to 20 `sed`
+commands, each of them a separate process and a full pass over the file.
+Bare placeholders like `KEY` or `SSL` could also corrupt longer tokens that
+happen to contain them. The templates now use jinja2 `{{ VARIABLE }}` syntax
+and are rendered here: every template is compiled once, all variables are
+substituted in a single pass and the four artifacts are rendered concurrently.
+Missing variables are reported before any file is written.
+
+Variable values are taken from the environment, e.g.
+
+    python3 -m pwbtools.render --config benchmark --output tmp
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Set
+
+import jinja2
+from jinja2 import meta
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+
+
+@dataclass
+class Artifact:
+    """A template (relative to `BASE_DIR`) and the file name it renders to."""
+    template: str
+    output: str
+
+
+def artifacts(config: str) -> List[Artifact]:
+    return [
+        Artifact("scripts/install-pwb-config.sh", "install-pwb-config.sh"),
+        Artifact("scripts/config-login.sh", "config-login.sh"),
+        Artifact("scripts/config-compute.sh", "config-compute.sh"),
+        Artifact(f"config/cluster-config-wb.{config}.tmpl", "cluster-config-wb.yaml"),
+    ]
+
+
+class MissingVariablesError(Exception):
+    """Raised when templates reference variables that have no value."""
+
+    def __init__(self, missing: Dict[str, Set[str]]):
+        self.missing = missing
+        details = "; ".join(f"{t}: {', '.join(sorted(v))}" for t, v in missing.items())
+        super().__init__(f"unresolved template variables - {details}")
+
+
+def make_environment(base_dir: Path = BASE_DIR) -> jinja2.Environment:
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(str(base_dir)),
+        undefined=jinja2.StrictUndefined,
+        keep_trailing_newline=True,
+        autoescape=False,
+    )
+
+
+class Renderer:
+    """Compiles each template once and renders it with a shared set of variables."""
+
+    def __init__(self, env: Optional[jinja2.Environment] = None):
+        self.env = env or make_environment()
+        self._templates: Dict[str, jinja2.Template] = {}
+        self._variables: Dict[str, Set[str]] = {}
+
+    def template(self, name: str) -> jinja2.Template:
+        if name not in self._templates:
+            source, _, _ = self.env.loader.get_source(self.env, name)
+            self._variables[name] = meta.find_undeclared_variables(self.env.parse(source))
+            self._templates[name] = self.env.get_template(name)
+        return self._templates[name]
+
+    def variables(self, name: str) -> Set[str]:
+        self.template(name)
+        return self._variables[name]
+
+    def check(self, names: List[str], values: Mapping[str, str]):
+        missing = {n: self.variables(n) - set(values) for n in names}
+        missing = {n: v for n, v in missing.items() if v}
+        if missing:
+            raise MissingVariablesError(missing)
+
+    def render(self, name: str, values: Mapping[str, str]) -> str:
+        template = self.template(name)
+        return template.render({k: values[k] for k in self.variables(name)})
+
+    def render_all(self, items: List[Artifact], values: Mapping[str, str],
+                   output_dir: Path) -> List[Path]:
+        """Render all artifacts concurrently into `output_dir`."""
+        self.check([a.template for a in items], values)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        def _render(artifact: Artifact) -> Path:
+            path = output_dir / artifact.output
+            # Write in place so that the file mode of a previously copied script is kept
+            with open(path, "w") as f:
+                f.write(self.render(artifact.template, values))
+            return path
+
+        with ThreadPoolExecutor(max_workers=len(items)) as pool:
+            return list(pool.map(_render, items))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="render", description=__doc__.splitlines()[0])
+    parser.add_argument("--config", required=True, help="cluster config flavour, e.g. benchmark")
+    parser.add_argument("--output", type=Path, default=Path("tmp"), help="output directory")
+    parser.add_argument("--var", action="append", default=[], metavar="NAME=VALUE",
+                        help="set a variable (overrides the environment)")
+    args = parser.parse_args(argv)
+
+    values = dict(os.environ)
+    values.update(v.split("=", 1) for v in args.var)
+    try:
+        for path in Renderer().render_all(artifacts(args.config), values, args.output):
+            print(f"rendered {path}")
+    except (MissingVariablesError, jinja2.TemplateError) as e:
+        print(f"render: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
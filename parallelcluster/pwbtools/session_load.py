@@ -0,0 +1,344 @@
+"""Session launch load generator for Workbench on the benchmark cluster.
+
+Signs in the `positNNNN` users and launches sessions at a given arrival rate
+(Poisson or uniform), then waits for each session to come up. Reports
+p50/p95/p99 of sign-in time and time-to-session, the failure rate and how
+sessions were spread across the login nodes. Every run is saved as JSON so
+that runs can be compared later.
+
+Time-to-session runs from the scheduled arrival, so it includes the time an
+arrival waited for one of the `--concurrency` workers. The achieved launch
+rate and that dispatch lag are reported next to the configured rate, and a
+warning is printed when arrivals found all workers busy.
+
+    python3 -m pwbtools.session_load run --url https://<HPC_HOST>.<HPC_DOMAIN> \\
+        --stack benchmark --count 200 --rate 2 --output results/rate-2.json
+    python3 -m pwbtools.session_load compare results/*.json
+
+`--mock` starts a local `pwbtools.mock_workbench` and runs against it, so the
+harness can be tried without a cluster. The session endpoints are not a
+stable Workbench API, hence `--launch-path`, `--status-path` and
+`--node-field` allow to adapt to the Workbench version in use.
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import requests
+from tabulate import tabulate
+
+CSRF_COOKIE = "rs-csrf-token"
+CSRF_HEADER = "X-RS-CSRF-Token"
+
+PERCENTILES = (50, 95, 99)
+
+
+def encrypt_credentials(public_key: str, username: str, password: str) -> str:
+    """Encrypt `username\\npassword` the way the Workbench sign-in page does (RSA, PKCS#1 v1.5)."""
+    exponent, modulus = (int(x, 16) for x in public_key.strip().split(":"))
+    k = (modulus.bit_length() + 7) // 8
+    message = f"{username}\n{password}".encode()
+    padding = bytes(secrets.randbelow(255) + 1 for _ in range(k - len(message) - 3))
+    block = int.from_bytes(b"\x00\x02" + padding + b"\x00" + message, "big")
+    return base64.b64encode(pow(block, exponent, modulus).to_bytes(k, "big")).decode()
+
+
+@dataclass
+class Options:
+    url: str
+    launch_path: str = "/api/sessions"
+    status_path: str = "/api/sessions/{id}"
+    node_field: str = "host"
+    editor: str = "RStudio"
+    cluster: str = "Slurm"
+    timeout: float = 600.0
+    poll: float = 1.0
+    verify_tls: bool = True
+
+
+@dataclass
+class Attempt:
+    """Outcome of one user signing in and launching one session.
+
+    `scheduled` is the arrival in seconds from the start of the run,
+    `dispatch_lag` the time it waited for a worker (`queued` if all were busy
+    when it arrived) and `time_to_session` the time from the arrival until the
+    session runs.
+    """
+    user: str
+    scheduled: float
+    queued: bool = False
+    dispatch_lag: Optional[float] = None
+    sign_in: Optional[float] = None
+    time_to_session: Optional[float] = None
+    node: Optional[str] = None
+    error: Optional[str] = None
+
+
+class WorkbenchClient:
+    """One browser-like session of a single user."""
+
+    def __init__(self, options: Options):
+        self.options = options
+        self.http = requests.Session()
+        self.http.verify = options.verify_tls
+
+    def _url(self, path: str) -> str:
+        return self.options.url.rstrip("/") + path
+
+    def _csrf(self) -> Dict[str, str]:
+        return {CSRF_HEADER: self.http.cookies.get(CSRF_COOKIE, "")}
+
+    def sign_in(self, username: str, password: str):
+        public_key = self.http.get(self._url("/auth-public-key"), timeout=30)
+        public_key.raise_for_status()
+        self.http.get(self._url("/auth-sign-in"), timeout=30).raise_for_status()
+        response = self.http.post(self._url("/auth-do-sign-in"), timeout=30, allow_redirects=False, data={
+            "persist": "0",
+            "clientPath": "/",
+            "v": encrypt_credentials(public_key.text, username, password),
+            CSRF_COOKIE: self.http.cookies.get(CSRF_COOKIE, ""),
+        })
+        if response.status_code != 302 or "error" in response.headers.get("Location", ""):
+            raise RuntimeError(f"sign-in failed ({response.status_code})")
+
+    def launch(self, name: str) -> str:
+        response = self.http.post(self._url(self.options.launch_path), headers=self._csrf(), timeout=60, json={
+            "name": name, "editor": self.options.editor, "cluster": self.options.cluster})
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def wait_running(self, session_id: str) -> Optional[str]:
+        """Poll until the session runs, return the node it landed on."""
+        deadline = time.monotonic() + self.options.timeout
+        url = self._url(self.options.status_path.format(id=session_id))
+        while time.monotonic() < deadline:
+            response = self.http.get(url, headers=self._csrf(), timeout=30)
+            response.raise_for_status()
+            status = response.json()
+            state = status.get("state")
+            if state == "Running":
+                return status.get(self.options.node_field)
+            if state in ("Failed", "Killed", "Canceled"):
+                raise RuntimeError(f"session {state.lower()}")
+            time.sleep(self.options.poll)
+        raise TimeoutError(f"session not running after {self.options.timeout:.0f} s")
+
+
+def attempt(options: Options, user: str, password: str, scheduled: float, epoch: float,
+            queued: bool = False) -> Attempt:
+    """Sign in and launch a session for an arrival at `epoch + scheduled` (time.monotonic())."""
+    result = Attempt(user, scheduled, queued)
+    arrival = epoch + scheduled
+    result.dispatch_lag = max(0.0, time.monotonic() - arrival)
+    client = WorkbenchClient(options)
+    try:
+        started = time.monotonic()
+        client.sign_in(user, password)
+        result.sign_in = time.monotonic() - started
+        session_id = client.launch(f"load-{secrets.token_hex(4)}")
+        result.node = client.wait_running(session_id)
+        result.time_to_session = time.monotonic() - arrival
+    except (requests.RequestException, RuntimeError, TimeoutError, KeyError, ValueError) as e:
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+
+def arrivals(count: int, rate: float, process: str) -> List[float]:
+    """Offsets in seconds at which sessions are launched."""
+    offsets, t = [], 0.0
+    for _ in range(count):
+        offsets.append(t)
+        t += random.expovariate(rate) if process == "poisson" else 1.0 / rate
+    return offsets
+
+
+def run_load(options: Options, users: Sequence[str], password: str, count: int, rate: float,
+             process: str = "poisson", concurrency: int = 64) -> List[Attempt]:
+    """Launch `count` sessions, cycling through `users`, at `rate` sessions per second.
+
+    Arrivals that find all `concurrency` workers busy wait in the pool's queue
+    and are marked as `queued`.
+    """
+    started = time.monotonic()
+    futures = []
+    lock = threading.Lock()
+    in_flight = 0
+
+    def finished(_):
+        nonlocal in_flight
+        with lock:
+            in_flight -= 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for n, offset in enumerate(arrivals(count, rate, process)):
+            delay = started + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with lock:
+                queued = in_flight >= concurrency
+                in_flight += 1
+            future = pool.submit(attempt, options, users[n % len(users)], password, offset, started, queued)
+            future.add_done_callback(finished)
+            futures.append(future)
+    return [f.result() for f in futures]
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """Percentile with linear interpolation between closest ranks."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def rate_of(offsets: Sequence[float]) -> Optional[float]:
+    """Arrivals per second over the span of `offsets`."""
+    if len(offsets) < 2 or max(offsets) == min(offsets):
+        return None
+    return (len(offsets) - 1) / (max(offsets) - min(offsets))
+
+
+def summarize(attempts: Sequence[Attempt], duration: float) -> dict:
+    ok = [a for a in attempts if a.error is None]
+    lags = [a.dispatch_lag for a in attempts if a.dispatch_lag is not None]
+    offered = rate_of([a.scheduled for a in attempts])
+    achieved = rate_of([a.scheduled + a.dispatch_lag for a in attempts if a.dispatch_lag is not None])
+    summary = {
+        "sessions": len(attempts),
+        "succeeded": len(ok),
+        "failure_rate": round(1 - len(ok) / len(attempts), 4) if attempts else 0.0,
+        "duration_seconds": round(duration, 3),
+        "nodes": dict(sorted(Counter(a.node for a in ok).items(), key=lambda item: str(item[0]))),
+        "errors": dict(Counter(a.error.split(":")[0] for a in attempts if a.error)),
+        "offered_rate": None if offered is None else round(offered, 3),
+        "achieved_rate": None if achieved is None else round(achieved, 3),
+        "queued": sum(a.queued for a in attempts),
+        "dispatch_lag": {"p50": percentile(lags, 50), "p99": percentile(lags, 99), "max": max(lags, default=None)},
+    }
+    for metric in ("sign_in", "time_to_session"):
+        values = [getattr(a, metric) for a in ok]
+        summary[metric] = {f"p{q}": percentile(values, q) for q in PERCENTILES}
+        summary[metric]["mean"] = sum(values) / len(values) if values else None
+    return summary
+
+
+def password_from(args) -> str:
+    if args.password_env in os.environ:
+        return os.environ[args.password_env]
+    if args.stack:
+        from pwbtools.stack_outputs import StackOutputs, make_backend
+        return StackOutputs(args.stack, make_backend(args.backend)).get("posit_user_pass")
+    raise SystemExit(f"set {args.password_env} or pass --stack to read posit_user_pass from the stack")
+
+
+def report(results: List[dict]) -> str:
+    rows = []
+    for r in results:
+        s = r["summary"]
+        tts = s["time_to_session"]
+        fmt = lambda v: "-" if v is None else f"{v:.2f}"  # noqa: E731
+        # runs saved before the dispatch lag was recorded have neither
+        lag = s.get("dispatch_lag", {})
+        rows.append([r["label"], r["parameters"]["rate"], fmt(s.get("achieved_rate")), s["sessions"],
+                     f"{s['failure_rate'] * 100:.1f}%", fmt(lag.get("p99")), fmt(s["sign_in"]["p50"]),
+                     fmt(tts["p50"]), fmt(tts["p95"]), fmt(tts["p99"]),
+                     " ".join(f"{k}:{v}" for k, v in s["nodes"].items())])
+    return tabulate(rows, headers=["run", "rate/s", "achieved/s", "sessions", "failed", "lag p99", "sign-in p50",
+                                   "tts p50", "tts p95", "tts p99", "sessions per node"])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="launch sessions and measure time-to-session")
+    target = run.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Workbench URL, e.g. https://<HPC_HOST>.<HPC_DOMAIN>")
+    target.add_argument("--mock", action="store_true", help="run against a local mock Workbench")
+    run.add_argument("--count", type=int, default=50, help="number of sessions to launch")
+    run.add_argument("--rate", type=float, default=1.0, help="sessions launched per second")
+    run.add_argument("--arrival", choices=["poisson", "uniform"], default="poisson")
+    run.add_argument("--users", type=int, default=10, help="number of positNNNN users to cycle through")
+    run.add_argument("--prefix", default="posit")
+    run.add_argument("--concurrency", type=int, default=64, help="maximum number of users in flight")
+    run.add_argument("--password-env", default="POSIT_USER_PASS", help="environment variable with the password")
+    run.add_argument("--stack", help="read posit_user_pass from this pulumi stack instead")
+    run.add_argument("--backend", help="stack outputs backend, cf. pwbtools.stack_outputs")
+    run.add_argument("--launch-path", default=Options.launch_path)
+    run.add_argument("--status-path", default=Options.status_path)
+    run.add_argument("--node-field", default=Options.node_field, help="field of the session status naming the node")
+    run.add_argument("--editor", default=Options.editor)
+    run.add_argument("--cluster", default=Options.cluster)
+    run.add_argument("--timeout", type=float, default=Options.timeout, help="seconds to wait for a session")
+    run.add_argument("--poll", type=float, default=Options.poll, help="seconds between session status checks")
+    run.add_argument("--insecure", action="store_true", help="do not verify the TLS certificate")
+    run.add_argument("--label", help="name of the run (default: output file name)")
+    run.add_argument("--output", type=Path, help="write results as JSON")
+    run.add_argument("--mock-launch-time", type=float, default=1.0)
+    run.add_argument("--mock-failure-rate", type=float, default=0.0)
+    run.add_argument("--mock-nodes", type=int, default=6)
+
+    compare = sub.add_parser("compare", help="compare saved runs")
+    compare.add_argument("results", type=Path, nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        print(report([json.loads(p.read_text()) for p in args.results]))
+        return 0
+
+    url = args.url
+    if args.mock:
+        from pwbtools.mock_workbench import MockWorkbench, serve
+        password = os.environ.get(args.password_env, "Testme1234")
+        server = serve(MockWorkbench(password, args.mock_nodes, args.mock_launch_time,
+                                     failure_rate=args.mock_failure_rate))
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+    else:
+        password = password_from(args)
+
+    options = Options(url, args.launch_path, args.status_path, args.node_field, args.editor, args.cluster,
+                      args.timeout, args.poll, not args.insecure)
+    users = [f"{args.prefix}{i:04d}" for i in range(1, args.users + 1)]
+    started = time.monotonic()
+    attempts = run_load(options, users, password, args.count, args.rate, args.arrival, args.concurrency)
+    result = {
+        "label": args.label or (args.output.stem if args.output else "run"),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "parameters": {"url": url, "count": args.count, "rate": args.rate, "arrival": args.arrival,
+                       "users": args.users, "concurrency": args.concurrency, "mock": args.mock},
+        "summary": summarize(attempts, time.monotonic() - started),
+        "attempts": [asdict(a) for a in attempts],
+    }
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(result, indent=2))
+    print(report([result]))
+    summary = result["summary"]
+    if summary["queued"]:
+        print(f"session_load: {summary['queued']} of {summary['sessions']} arrivals found all {args.concurrency} "
+              f"workers busy and waited up to {summary['dispatch_lag']['max']:.1f} s, the rate of "
+              f"{args.rate:g}/s was not offered (raise --concurrency)", file=sys.stderr)
+    errors = result["summary"]["errors"]
+    if errors:
+        print("errors: " + ", ".join(f"{k} x{v}" for k, v in errors.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""Single-fetch, cached access to the outputs of the auxiliary pulumi stack.
+
+`deploy.sh`, `cluster-stat.sh` and the pulumi `justfile` used to run one
+`pulumi stack output` per value, each of them starting the pulumi CLI and
+reading the backend again. This module fetches all outputs (and the stack
+config) in one go via `--json --show-secrets` and keeps them in a local cache
+keyed by stack name and the version of the last stack update. As soon as the
+stack is updated, the version changes and the cache is refreshed.
+
+Examples (run from the `parallelcluster` folder):
+
+    python3 -m pwbtools.stack_outputs -s benchmark get jump_host_dns
+    python3 -m pwbtools.stack_outputs -s benchmark shell KEY="key_pair id" EMAIL=config:email
+
+For offline use, `--backend file:<path>` (or `PWB_STACK_BACKEND`) replaces the
+pulumi CLI with a JSON file of the form
+
+    {"<stack>": {"version": 3, "outputs": {...}, "config": {...}}}
+"""
+
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+PULUMI_DIR = Path(__file__).resolve().parents[2] / "pulumi"
+
+CONFIG_PREFIX = "config:"
+
+
+def default_cache_dir() -> Path:
+    if "PWB_STACK_CACHE_DIR" in os.environ:
+        return Path(os.environ["PWB_STACK_CACHE_DIR"])
+    base = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    return Path(base) / "pwbtools" / "stack-outputs"
+
+
+@dataclass
+class StackSnapshot:
+    """All outputs and config values of a stack at a given update version."""
+    stack: str
+    version: int
+    outputs: Dict[str, Any] = field(default_factory=dict)
+    config: Dict[str, Any] = field(default_factory=dict)
+
+
+# ------------------------------------------------------------------------------
+# Backends
+# ------------------------------------------------------------------------------
+
+class PulumiBackend:
+    """Reads stack outputs through the pulumi CLI."""
+
+    def __init__(self, cwd: Path = PULUMI_DIR, pulumi: str = "pulumi"):
+        self.cwd = cwd
+        self.pulumi = pulumi
+
+    def _run(self, args: List[str]) -> str:
+        result = subprocess.run([self.pulumi] + args, cwd=self.cwd,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"pulumi {' '.join(args)} failed: {result.stderr.strip()}")
+        return result.stdout
+
+    def current_stack(self) -> str:
+        return self._run(["stack", "--show-name"]).strip()
+
+    def version(self, stack: str) -> int:
+        history = json.loads(self._run(["stack", "history", "--json", "--page-size", "1", "-s", stack]) or "[]")
+        return history[0]["version"] if history else 0
+
+    def fetch(self, stack: str) -> StackSnapshot:
+        version = self.version(stack)
+        outputs = json.loads(self._run(["stack", "output", "--json", "--show-secrets", "-s", stack]))
+        config = json.loads(self._run(["config", "--json", "--show-secrets", "-s", stack]))
+        return StackSnapshot(stack, version, outputs,
+                             {k: v.get("value") if isinstance(v, dict) else v for k, v in config.items()})
+
+
+class FileBackend:
+    """Local, file based stand-in for the pulumi backend (offline testing)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def _load(self) -> Dict[str, Any]:
+        if not self.path.exists():
+            return {}
+        return json.loads(self.path.read_text())
+
+    def current_stack(self) -> str:
+        stacks = list(self._load())
+        if len(stacks) != 1:
+            raise RuntimeError(f"{self.path} does not define exactly one stack, please use -s")
+        return stacks[0]
+
+    def version(self, stack: str) -> int:
+        return self._load().get(stack, {}).get("version", 0)
+
+    def fetch(self, stack: str) -> StackSnapshot:
+        data = self._load()
+        if stack not in data:
+            raise RuntimeError(f"stack {stack} not found in {self.path}")
+        entry = data[stack]
+        return StackSnapshot(stack, entry.get("version", 0), entry.get("outputs", {}), entry.get("config", {}))
+
+    def publish(self, snapshot: StackSnapshot):
+        """Store a snapshot, i.e. simulate a `pulumi up` of the stack."""
+        data = self._load()
+        data[snapshot.stack] = {"version": snapshot.version, "outputs": snapshot.outputs,
+                                "config": snapshot.config}
+        self.path.write_text(json.dumps(data, indent=2))
+
+
+def make_backend(spec: Optional[str] = None):
+    spec = spec or os.environ.get("PWB_STACK_BACKEND", "pulumi")
+    if spec == "pulumi":
+        return PulumiBackend()
+    if spec.startswith("file:"):
+        return FileBackend(Path(spec[len("file:"):]))
+    raise ValueError(f"Unknown stack backend {spec}, expected 'pulumi' or 'file:<path>'")
+
+
+# ------------------------------------------------------------------------------
+# Cache
+# ------------------------------------------------------------------------------
+
+class StackOutputs:
+    """Stack outputs backed by a local cache that is keyed by stack and version."""
+
+    def __init__(self, stack: str, backend=None, cache_dir: Optional[Path] = None):
+        self.stack = stack
+        self.backend = backend or PulumiBackend()
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self._snapshot: Optional[StackSnapshot] = None
+
+    @property
+    def cache_file(self) -> Path:
+        return self.cache_dir / f"{self.stack}.json"
+
+    def _load_cache(self) -> Optional[StackSnapshot]:
+        try:
+            return StackSnapshot(**json.loads(self.cache_file.read_text()))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _store_cache(self, snapshot: StackSnapshot):
+        # Outputs contain secrets, keep the cache private to the current user
+        self.cache_dir.mkdir(parents=True, exist_ok=True, mode=0o700)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix=f".{self.stack}.")
+        with os.fdopen(fd, "w") as f:
+            json.dump(asdict(snapshot), f)
+        os.replace(tmp, self.cache_file)
+
+    def snapshot(self) -> StackSnapshot:
+        if self._snapshot is None:
+            cached = self._load_cache()
+            if cached is not None and cached.version == self.backend.version(self.stack):
+                self._snapshot = cached
+            else:
+                self.refresh()
+        return self._snapshot
+
+    def refresh(self) -> StackSnapshot:
+        self._snapshot = self.backend.fetch(self.stack)
+        self._store_cache(self._snapshot)
+        return self._snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+        self.cache_file.unlink(missing_ok=True)
+
+    def get(self, name: str) -> Any:
+        """Return an output, or a config value if `name` starts with `config:`."""
+        snapshot = self.snapshot()
+        if name.startswith(CONFIG_PREFIX):
+            key = name[len(CONFIG_PREFIX):]
+            for k, v in snapshot.config.items():
+                if k == key or k.endswith(f":{key}"):
+                    return v
+            raise KeyError(f"config value {key} not set for stack {self.stack}")
+        if name not in snapshot.outputs:
+            raise KeyError(f"output {name} not found in stack {self.stack}")
+        return snapshot.outputs[name]
+
+
+def format_value(value: Any) -> str:
+    """Format a value the same way `pulumi stack output <name>` does."""
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+# ------------------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------------------
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="stack_outputs", description=__doc__.splitlines()[0])
+    parser.add_argument("-s", "--stack", help="pulumi stack name (default: currently selected stack)")
+    parser.add_argument("--backend", help="'pulumi' (default) or 'file:<path>'")
+    parser.add_argument("--cache-dir", type=Path, help="cache location (default: ~/.cache/pwbtools/stack-outputs)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    get = sub.add_parser("get", help="print a single output")
+    get.add_argument("name")
+    shell = sub.add_parser("shell", help="print VAR=value assignments suitable for eval")
+    shell.add_argument("--export", action="store_true", help="prefix assignments with export")
+    shell.add_argument("assignments", nargs="+", metavar="VAR=OUTPUT")
+    sub.add_parser("json", help="print all outputs as JSON")
+    sub.add_parser("refresh", help="refetch all outputs from the backend")
+    sub.add_parser("invalidate", help="drop the cached outputs")
+    args = parser.parse_args(argv)
+
+    backend = make_backend(args.backend)
+    outputs = StackOutputs(args.stack or backend.current_stack(), backend, args.cache_dir)
+    try:
+        if args.command == "get":
+            print(format_value(outputs.get(args.name)))
+        elif args.command == "shell":
+            prefix = "export " if args.export else ""
+            lines = []
+            for assignment in args.assignments:
+                var, _, name = assignment.partition("=")
+                lines.append(f"{prefix}{var}={shlex.quote(format_value(outputs.get(name)))}")
+            print("\n".join(lines))
+        elif args.command == "json":
+            print(json.dumps(outputs.snapshot().outputs, indent=2))
+        elif args.command == "refresh":
+            outputs.refresh()
+        elif args.command == "invalidate":
+            outputs.invalidate()
+    except (KeyError, RuntimeError) as e:
+        print(f"stack_outputs: {e.args[0]}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""Bring-up timeline and critical path of a cluster from the phase events of its nodes.
+
+`install-pwb-config.sh` (head node), `config-login.sh` (login nodes) and
+`config-compute.sh` (compute nodes) append a JSON line for the start and end
+of every phase to `/opt/rstudio/timeline/<host>.jsonl` on the shared storage:
+
+    {"time": 1735689600.12, "host": "ip-10-0-1-5", "script": "config-login",
+     "phase": "payload", "event": "start", "detail": "download"}
+
+This module pairs the events into spans and prints a per-node Gantt chart, the
+critical path of the bring-up and a summary per node role and phase. The
+critical path is walked back from the phase that finished last: its
+predecessor is the phase (on any node) that ended last before it started, and
+the time in between is reported as waiting, e.g. for a node to boot.
+
+Phases named `*-wait` (the login nodes' `config-wait` for the head node's
+configuration, the head node's `elb-wait` and `target-wait`) start early and
+end when another node's work is done. Their predecessor is the phase that
+ended last before the wait ended, preferably on another node, so the path
+runs through the work that unblocked them. Of a wait only the time from that
+predecessor's end to the end of the wait counts as waiting; the work and the
+waiting on the path add up to the bring-up time.
+
+It works offline on copies of the timeline folder, e.g.
+
+    scp -r <HEADNODE>:/opt/rstudio/timeline timeline/
+    python3 -m pwbtools.timeline timeline/
+    python3 -m pwbtools.timeline timeline/ --json > bring-up.json
+"""
+
+import argparse
+import json
+import statistics
+import sys
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROLES = {"install-pwb-config": "head", "config-login": "login", "config-compute": "compute"}
+
+# The span covering a whole script run
+SCRIPT_PHASE = "script"
+
+# Slack when comparing end and start times of different nodes (clock skew, EFS latency)
+TOLERANCE = 0.5
+
+# Suffix of phases that wait for other nodes rather than work
+WAIT_SUFFIX = "-wait"
+
+
+@dataclass
+class Event:
+    time: float
+    host: str
+    script: str
+    phase: str
+    event: str
+    detail: str = ""
+
+
+@dataclass
+class Span:
+    host: str
+    script: str
+    phase: str
+    detail: str
+    start: float
+    end: float
+    complete: bool = True
+
+    @property
+    def role(self) -> str:
+        return ROLES.get(self.script, self.script)
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    @property
+    def waiting(self) -> bool:
+        return self.phase.endswith(WAIT_SUFFIX)
+
+    @property
+    def label(self) -> str:
+        return f"{self.phase} ({self.detail})" if self.detail else self.phase
+
+    def contains(self, other: "Span") -> bool:
+        return (self is not other and self.host == other.host and self.script == other.script
+                and self.start <= other.start and other.end <= self.end
+                and (self.duration > other.duration or self.phase == SCRIPT_PHASE))
+
+
+def read_events(paths: List[Path]) -> Tuple[List[Event], int]:
+    """Events of all `.jsonl` files below `paths` and the number of unreadable lines."""
+    events, bad = [], 0
+    for path in paths:
+        files = sorted(path.rglob("*.jsonl")) if path.is_dir() else [path]
+        for f in files:
+            for line in f.read_text().splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    events.append(Event(**json.loads(line)))
+                except (ValueError, TypeError):
+                    # half-written line of a node that went away
+                    bad += 1
+    return sorted(events, key=lambda e: e.time), bad
+
+
+def pair(events: List[Event]) -> List[Span]:
+    """Spans of matching start/end events, unmatched starts end at the last event of their host."""
+    open_: Dict[Tuple[str, str, str, str], List[float]] = defaultdict(list)
+    last: Dict[str, float] = {}
+    spans = []
+    for e in events:
+        key = (e.host, e.script, e.phase, e.detail)
+        last[e.host] = e.time
+        if e.event == "start":
+            open_[key].append(e.time)
+        elif e.event == "end" and open_[key]:
+            spans.append(Span(*key, open_[key].pop(), e.time))
+    for key, starts in open_.items():
+        for start in starts:
+            spans.append(Span(*key, start, last[key[0]], complete=False))
+    return sorted(spans, key=lambda s: (s.start, -s.duration))
+
+
+def depth(span: Span, spans: List[Span]) -> int:
+    return sum(1 for s in spans if s.contains(span))
+
+
+def leaves(spans: List[Span]) -> List[Span]:
+    """Spans that do not contain another span, i.e. the actual work."""
+    return [s for s in spans if not any(s.contains(o) for o in spans)]
+
+
+@dataclass
+class Step:
+    host: str
+    role: str
+    phase: str
+    start: float
+    duration: float
+    waited: float
+    # a wait phase, its duration is not work
+    waiting: bool = False
+
+
+def critical_path(spans: List[Span]) -> List[Step]:
+    work = leaves(spans)
+    if not work:
+        return []
+    t0 = min(s.start for s in spans)
+    current = max(work, key=lambda s: s.end)
+    path: List[Step] = []
+    visited = set()
+    while True:
+        visited.add(id(current))
+        if current.waiting:
+            # unblocked by the work that ended last before the wait was over
+            before = [s for s in work if id(s) not in visited and s.end <= current.end + TOLERANCE
+                      and s.start < current.end]
+            blocked_until = current.end
+        else:
+            before = [s for s in work if id(s) not in visited and s.end <= current.start + TOLERANCE
+                      and s.start < current.start]
+            blocked_until = current.start
+        pred = None
+        if before:
+            latest = max(s.end for s in before)
+            near = [s for s in before if s.end >= latest - TOLERANCE]
+            # prefer the same node if it finished about as late, another node for a wait
+            pred = next((s for s in near if (s.host == current.host) != current.waiting), near[0])
+        waited = blocked_until - (pred.end if pred else t0)
+        path.append(Step(current.host, current.role, current.label, current.start - t0, current.duration,
+                         max(0.0, waited), current.waiting))
+        if pred is None:
+            return list(reversed(path))
+        current = pred
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def summary(spans: List[Span]) -> List[dict]:
+    groups: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+    for s in spans:
+        groups[(s.role, s.label)].append(s.duration)
+    return [{"role": role, "phase": phase, "count": len(d), "p50": statistics.median(d),
+             "p95": percentile(d, 95), "max": max(d), "total": sum(d)}
+            for (role, phase), d in sorted(groups.items())]
+
+
+# ------------------------------------------------------------------------------
+# Report
+# ------------------------------------------------------------------------------
+
+def gantt(spans: List[Span], width: int = 60) -> str:
+    t0 = min(s.start for s in spans)
+    t1 = max(s.end for s in spans)
+    scale = width / max(t1 - t0, 1e-9)
+    hosts: Dict[str, List[Span]] = defaultdict(list)
+    for s in spans:
+        hosts[s.host].append(s)
+
+    lines = [f"{'':<36} {'start':>8} {'secs':>8}  0{'':<{width - 2}}{t1 - t0:.0f}s"]
+    for host, host_spans in sorted(hosts.items(), key=lambda kv: min(s.start for s in kv[1])):
+        roles = sorted({s.role for s in host_spans})
+        lines.append(f"{host} ({', '.join(roles)})")
+        for s in host_spans:
+            name = "  " * (depth(s, host_spans) + 1) + s.label
+            offset = int((s.start - t0) * scale)
+            length = max(1, int(round(s.duration * scale)))
+            bar = " " * offset + ("#" if s.complete else ">") * min(length, width - offset)
+            lines.append(f"{name[:36]:<36} {s.start - t0:>8.1f} {s.duration:>8.1f}  {bar}")
+    return "\n".join(lines)
+
+
+def render_critical_path(path: List[Step]) -> str:
+    lines = [f"{'start':>8} {'waited':>8} {'secs':>8}  node / phase"]
+    for step in path:
+        duration = f"({step.duration:.1f})" if step.waiting else f"{step.duration:.1f}"
+        lines.append(f"{step.start:>8.1f} {step.waited:>8.1f} {duration:>8}  "
+                     f"{step.host} ({step.role}) {step.phase}")
+    total = sum(s.duration for s in path if not s.waiting)
+    waited = sum(s.waited for s in path)
+    lines.append(f"{'':>8} {waited:>8.1f} {total:>8.1f}  waiting / working on the critical path")
+    lines.append(f"{'':>8} {'':>8} {'':>8}  (secs of wait phases in parentheses, not counted as work)")
+    return "\n".join(lines)
+
+
+def render_summary(rows: List[dict]) -> str:
+    lines = [f"{'role':<8} {'phase':<34} {'count':>5} {'p50 s':>8} {'p95 s':>8} {'max s':>8} {'total s':>9}"]
+    for r in rows:
+        lines.append(f"{r['role']:<8} {r['phase'][:34]:<34} {r['count']:>5} {r['p50']:>8.1f} {r['p95']:>8.1f} "
+                     f"{r['max']:>8.1f} {r['total']:>9.1f}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="timeline", description=__doc__.splitlines()[0])
+    parser.add_argument("paths", type=Path, nargs="+", help="timeline folders or .jsonl files")
+    parser.add_argument("--host", action="append", help="only include these hosts")
+    parser.add_argument("--width", type=int, default=60, help="width of the Gantt bars")
+    parser.add_argument("--json", action="store_true", help="print spans, critical path and summary as JSON")
+    args = parser.parse_args(argv)
+
+    events, bad = read_events(args.paths)
+    if args.host:
+        events = [e for e in events if e.host in args.host]
+    spans = pair(events)
+    if not spans:
+        print("timeline: no phase events found", file=sys.stderr)
+        return 1
+    if bad:
+        print(f"timeline: skipped {bad} unreadable lines", file=sys.stderr)
+
+    path = critical_path(spans)
+    rows = summary(spans)
+    if args.json:
+        t0 = min(s.start for s in spans)
+        print(json.dumps({
+            "t0": t0,
+            "spans": [dict(asdict(s), role=s.role, start=s.start - t0, end=s.end - t0) for s in spans],
+            "critical_path": [asdict(s) for s in path],
+            "summary": rows,
+        }, indent=2))
+        return 0
+
+    incomplete = [s for s in spans if not s.complete]
+    print(gantt(spans, args.width))
+    print()
+    print(render_critical_path(path))
+    print()
+    print(render_summary(rows))
+    if incomplete:
+        print(f"\n{len(incomplete)} phases did not finish (marked with >): "
+              + ", ".join(f"{s.host} {s.label}" for s in incomplete))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
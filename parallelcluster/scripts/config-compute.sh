@@ -6,7 +6,20 @@ mkdir -p /opt/rstudio/config-compute
 exec > /opt/rstudio/config-compute/`hostname`-`date +%s`.log 
 exec 2>&1
 
+# Phase timing, JSON-lines start/end events in /opt/rstudio/timeline (cf. pwbtools/timeline.py)
+TIMELINE=/opt/rstudio/timeline/`hostname`.jsonl
+
+function phase() {
+# $1 - start|end, $2 - phase name, $3 - optional detail
+mkdir -p `dirname $TIMELINE`
+printf '{"time": %s, "host": "%s", "script": "config-compute", "phase": "%s", "event": "%s", "detail": "%s"}\n' \
+    `date +%s.%N` `hostname` $2 $1 "$3" >> $TIMELINE
+}
+
+phase start script
+
 # create scratch folder as part of EFS fs
+phase start scratch-mount
 if ( ! mount | grep /scratch ); then
         # create scratch folder as part of EFS fs
         mkdir -p /scratch /opt/rstudio/scratch
@@ -14,16 +27,24 @@ if ( ! mount | grep /scratch ); then
         mount -t efs ${efsmount}scratch /scratch
 	chmod 777 /scratch 
 fi
+phase end scratch-mount
 
-# Session components
+# Session components, already installed if the image has this version baked in (cf. image/install-pwb.sh)
+if [ "`cat /opt/pwb-payloads/baked-version 2>/dev/null`" == "$1" ]; then
+phase start payload baked
+phase end payload baked
+else
+phase start payload download
 apt -o DPkg::Lock::Timeout=300 update -y
 apt -o DPkg::Lock::Timeout=300 install -y curl libcurl4-gnutls-dev libssl-dev libpq5 rrdtool
 mkdir -p /usr/lib/rstudio-server
 tar xf /opt/rstudio/scripts/rsp-session-jammy-$1-amd64.tar.gz -C /usr/lib/rstudio-server --strip-components=1
+phase end payload download
+fi
 
 
-if ( ! grep AD_DNS /etc/hosts >& /dev/null ); then
-        echo "AD_DNS pwb.posit.co" >> /etc/hosts
+if ( ! grep {{ AD_DNS }} /etc/hosts >& /dev/null ); then
+        echo "{{ AD_DNS }} pwb.posit.co" >> /etc/hosts
 	systemctl restart sssd
 fi
 
@@ -34,8 +55,9 @@ fi
 
 echo "posit0001   ALL=NOPASSWD: ALL" >> /etc/sudoers
 
-if EASYBUILD_SUPPORT 
+if {{ EASYBUILD_SUPPORT }} 
 then 
+    phase start easybuild
     apt -o DPkg::Lock::Timeout=300 update 
     apt -o DPkg::Lock::Timeout=300 install -y lmod 
     cat << EOF > /etc/profile.d/modulepath.sh
@@ -43,4 +65,7 @@ then
 
 export MODULEPATH=/opt/apps/easybuild/modules/all
 EOF
+    phase end easybuild
 fi  
+
+phase end script
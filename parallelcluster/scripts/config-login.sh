@@ -11,73 +11,87 @@ PWB_VERSION=$2
 
 export PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin:/snap/bin
 
+# Phase timing, JSON-lines start/end events in /opt/rstudio/timeline (cf. pwbtools/timeline.py)
+TIMELINE=/opt/rstudio/timeline/`hostname`.jsonl
+
+function phase() {
+# $1 - start|end, $2 - phase name, $3 - optional detail
+mkdir -p `dirname $TIMELINE`
+printf '{"time": %s, "host": "%s", "script": "config-login", "phase": "%s", "event": "%s", "detail": "%s"}\n' \
+    `date +%s.%N` `hostname` $2 $1 "$3" >> $TIMELINE
+}
+
+phase start script
+
 # Add rstudio-server user and group 
 groupadd --system --gid 900 rstudio-server
 useradd -s /bin/bash -m --system --gid rstudio-server --uid 900 rstudio-server
 
-# Install software
+# Install software, already installed if the image has this version baked in (cf. image/install-pwb.sh)
+
+if [ "`cat /opt/pwb-payloads/baked-version 2>/dev/null`" == "$PWB_VERSION" ]; then
+phase start payload baked
+phase end payload baked
+else
+phase start payload download
 
 if ( ! dpkg -l gdebi-core >& /dev/null); then 
 apt-get update 
 apt-get install -y gdebi
 fi
 
-while true 
-do
-    if [ -d /opt/rstudio/scripts ]; then
-        pushd /opt/rstudio/scripts
-        apt-get update -y 
-        gdebi -n rstudio-workbench-${PWB_VERSION}-amd64.deb
-        popd
-        break
-    fi
-done 
+# wait until the session payload is there (downloaded by head-node), cf. pwb_agent.py
+/usr/bin/python3 /opt/rstudio/scripts/pwb_agent.py wait /opt/rstudio/scripts/rstudio-workbench-${PWB_VERSION}-amd64.deb
+pushd /opt/rstudio/scripts
+apt-get update -y 
+gdebi -n rstudio-workbench-${PWB_VERSION}-amd64.deb
+popd
+phase end payload download
+fi
 
+# Logs are shipped to the S3 bucket continuously (cf. pwb_logship.py), so rotation
+# copies and truncates in place instead of stopping rstudio-server and rstudio-launcher
 cat << EOF > /etc/logrotate.d/rstudio
-/var/log/rstudio/rstudio-server/*.log {
+/var/log/rstudio/rstudio-server/*.log /var/log/rstudio/launcher/*.log {
     daily
     missingok
     rotate 7
     compress
     delaycompress
     notifempty
-    create 0640 rstudio-server rstudio-server
+    copytruncate
     su rstudio-server rstudio-server
-    sharedscripts
-    prerotate
-        systemctl stop rstudio-server
-    endscript
-    postrotate
-        systemctl start rstudio-server
-    endscript
-}
-
-/var/log/rstudio/launcher/*.log {
-    daily
-    missingok
-    rotate 7
-    compress
-    delaycompress
-    notifempty
-    create 0640 rstudio-server rstudio-server
-    su rstudio-server rstudio-server 
-    sharedscripts
-    prerotate
-        systemctl stop rstudio-launcher
-    endscript
-    postrotate
-        systemctl start rstudio-launcher
-    endscript
 }
 EOF
 
 systemctl restart logrotate
 
+if ! dpkg -l python3-boto3 >& /dev/null; then
+    apt-get install -y python3-boto3
+fi
+
+cat << EOF > /etc/systemd/system/pwb-logship.service
+[Unit]
+Description=Ship Posit Workbench and launcher logs to S3
+After=remote-fs.target network-online.target
+
+[Service]
+ExecStart=/usr/bin/python3 /opt/rstudio/scripts/pwb_logship.py run --store s3://{{ S3_BUCKETNAME }}/logs
+Restart=always
+RestartSec=10
+
+[Install]
+WantedBy=multi-user.target
+EOF
+systemctl daemon-reload
+systemctl enable --now pwb-logship
+
 VSCODE_EXTDIR=/usr/local/rstudio/code-server
 
 mkdir -p /usr/local/rstudio/code-server
 chmod a+rx /usr/local/rstudio/code-server
 
+phase start vscode-extensions
 for extension in quarto.quarto \
         REditorSupport.r@2.6.1 \
         ms-python.python@2022.10.1
@@ -85,12 +99,15 @@ do
    /usr/lib/rstudio-server/bin/pwb-code-server/bin/code-server --extensions-dir=$VSCODE_EXTDIR \
                         --install-extension $extension
 done
+phase end vscode-extensions
 
 chmod a+rx /usr/local/rstudio/code-server
 
 
 # wait until the workbench config files are there (deployed by head-node)
-while true ; do if [ -f $PWB_CONFIG_DIR/rserver.conf ]; then break; fi; sleep 1; done ; echo "PWB config files found !"
+phase start config-wait
+/usr/bin/python3 /opt/rstudio/scripts/pwb_agent.py wait $PWB_CONFIG_DIR/rserver.conf && echo "PWB config files found !"
+phase end config-wait
 
 my_ip=`ifconfig | grep inet | awk '{print $2}'| head -1`
 
@@ -110,8 +127,10 @@ my_hostname=`grep $my_ip /etc/hosts | tail -1  | awk '{print $3}'`
 echo "www-host-name=$my_hostname" > /etc/rstudio/load-balancer
 
 # add SSL Cert locally to make workbench LB happy
-cp /opt/rstudio/etc/$HPC_DOMAIN.crt /usr/local/share/ca-certificates 
+phase start ca-certificates
+cp /opt/rstudio/etc/{{ HPC_DOMAIN }}.crt /usr/local/share/ca-certificates 
 update-ca-certificates
+phase end ca-certificates
 
 # systemctl overrides
 
@@ -126,6 +145,7 @@ update-ca-certificates
 sysctl -w net.unix.max_dgram_qlen=8192
 sysctl -w net.core.netdev_max_backlog=65535 
 
+phase start workbench-start
 systemctl daemon-reload
 systemctl stop rstudio-server
 systemctl stop rstudio-launcher
@@ -133,25 +153,25 @@ killall apache2
 logrotate -f /etc/logrotate.d/rstudio
 systemctl start rstudio-launcher
 systemctl start rstudio-server
+phase end workbench-start
 
 # Touch a file in /opt/rstudio to signal that workbench is running on this server
 touch /opt/rstudio/workbench-`hostname`.state   
 
-#if ( ! crontab -l | grep rstudio ); then 
-#    (crontab -l ; echo "0-59/1 * * * * /opt/rstudio/scripts/rc.pwb")| crontab -
-#fi
 
-if (EASYBUILD_SUPPORT); then 
+if ({{ EASYBUILD_SUPPORT }}); then 
+    phase start easybuild
     apt-get update && apt-get install -y lmod 
     cat << EOF > /etc/profile.d/modulepath.sh
 #!/bin/bash
 
 export MODULEPATH=/opt/apps/easybuild/modules/all
 EOF
+    phase end easybuild
 fi  
 
-if ( ! grep AD_DNS /etc/hosts >& /dev/null ); then 
-        echo "AD_DNS pwb.posit.co" >> /etc/hosts
+if ( ! grep {{ AD_DNS }} /etc/hosts >& /dev/null ); then 
+        echo "{{ AD_DNS }} pwb.posit.co" >> /etc/hosts
 fi
 
 if ( ! grep posit0001 /etc/sudoers >& /dev/null ); then 
@@ -171,8 +191,9 @@ if ( ! mount | grep /scratch ); then
         mount -t efs ${efsmount}scratch /scratch
 fi
 
-if SINGULARITY_SUPPORT
+if {{ SINGULARITY_SUPPORT }}
 then 
+   phase start apptainer-install
    APPTAINER_VERSION=1.4.2
    pushd /tmp 
    curl -LO https://github.com/apptainer/apptainer/releases/download/v${APPTAINER_VERSION}/apptainer_${APPTAINER_VERSION}_amd64.deb
@@ -180,4 +201,7 @@ then
    apt install -y ./apptainer_${APPTAINER_VERSION}_amd64.deb ./apptainer-suid_${APPTAINER_VERSION}_amd64.deb
    rm -f ./apptainer_${APPTAINER_VERSION}_amd64.deb ./apptainer-suid_${APPTAINER_VERSION}_amd64.deb
    popd
-fi
\ No newline at end of file
+   phase end apptainer-install
+fi
+
+phase end script
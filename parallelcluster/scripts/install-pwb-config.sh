@@ -14,6 +14,18 @@ PWB_BASE_DIR=$SHARED_DIR/rstudio/
 
 PWB_CONFIG_DIR=$PWB_BASE_DIR/etc/rstudio
 
+# Phase timing, JSON-lines start/end events in /opt/rstudio/timeline (cf. pwbtools/timeline.py)
+TIMELINE=/opt/rstudio/timeline/`hostname`.jsonl
+
+function phase() {
+# $1 - start|end, $2 - phase name, $3 - optional detail
+mkdir -p `dirname $TIMELINE`
+printf '{"time": %s, "host": "%s", "script": "install-pwb-config", "phase": "%s", "event": "%s", "detail": "%s"}\n' \
+    `date +%s.%N` `hostname` $2 $1 "$3" >> $TIMELINE
+}
+
+phase start script
+
 
 mkdir -p $PWB_BASE_DIR/{scripts,apptainer}
 
@@ -33,14 +45,24 @@ HPC_HOST=$3
 touch /etc/head-node
 
 # Download session components and store them in $PWB_BASE_DIR/scripts
+# (copied from the image if it has the payloads of this version baked in, cf. image/install-pwb.sh)
 
 pushd $PWB_BASE_DIR/scripts
+if [ "`cat /opt/pwb-payloads/baked-version 2>/dev/null`" == "$PWB_VERSION" ]; then
+phase start payload baked
+cp /opt/pwb-payloads/$PWB_VERSION/rsp-session-jammy-${PWB_VERSION}-amd64.tar.gz .
+cp /opt/pwb-payloads/$PWB_VERSION/rstudio-workbench-${PWB_VERSION}-amd64.deb .
+phase end payload baked
+else
+phase start payload download
 curl -O https://s3.amazonaws.com/rstudio-ide-build/session/jammy/amd64/rsp-session-jammy-${PWB_VERSION}-amd64.tar.gz
 curl -O https://s3.amazonaws.com/rstudio-ide-build/server/jammy/amd64/rstudio-workbench-${PWB_VERSION}-amd64.deb 
+phase end payload download
+fi
 popd
 
-if ( ! grep AD_DNS /etc/hosts >& /dev/null ); then
-        echo "AD_DNS pwb.posit.co" >> /etc/hosts
+if ( ! grep {{ AD_DNS }} /etc/hosts >& /dev/null ); then
+        echo "{{ AD_DNS }} pwb.posit.co" >> /etc/hosts
 fi
 
 if ( ! grep posit0001 /etc/sudoers >& /dev/null ); then
@@ -53,7 +75,9 @@ fi
 
 export AWS_DEFAULT_REGION=`cat /opt/parallelcluster/shared/cluster-config.yaml  | grep ^Region | awk '{print $2}'`
 
+phase start yq
 snap install yq
+phase end yq
 
 export PATH=$PATH:/snap/bin
 
@@ -62,46 +86,59 @@ login_nodes_number=`cat /opt/parallelcluster/shared/cluster-config.yaml | yq .Lo
 
 echo "login nodes": $login_nodes_number
 
-#First, let's get the ELB ARN
-elb=""
-while true
-do
-        elb=`for i in $(aws elbv2 describe-load-balancers | jq -r '.LoadBalancers[].LoadBalancerArn'); do if ( aws elbv2 describe-tags --resource-arns "\$i" | jq --arg cluster_name "$cluster_name" -ce '.TagDescriptions[].Tags[] | select( .Key == "parallelcluster:cluster-name" and .Value==$cluster_name)' > /dev/null); then echo $i; fi; done `
-        if [ ! -z $elb ]; then break; fi
-        sleep 2
-done
+# Load balancer helpers (batched tag lookups with backoff, cf. pwb_alb.py). They run with
+# /usr/bin/python3, python3 on PATH is /opt/python of the AMI that has no boto3.
+apt-get install -y python3-boto3
+aws s3 cp s3://{{ S3_BUCKETNAME }}/pwb_alb.py $PWB_BASE_DIR/scripts
+# Rolling, drain-aware Workbench restarts of the login nodes (cf. pwb_restart.py)
+aws s3 cp s3://{{ S3_BUCKETNAME }}/pwb_restart.py $PWB_BASE_DIR/scripts
+
+#First, let's get the ELB ARN, its target group and the EC2 IDs attached to it
+phase start alb-discover
+discovery=`/usr/bin/python3 $PWB_BASE_DIR/scripts/pwb_alb.py discover --cluster-name "$cluster_name" --targets $login_nodes_number --timeline $TIMELINE`
+phase end alb-discover
+
+elb=`echo $discovery | jq -r '.load_balancer_arn'`
 
 # ELB URL 
-elb_url=`aws elbv2 describe-load-balancers --load-balancer-arns=$elb | jq -r '.[] | .[] | .DNSName'`
+elb_url=`echo $discovery | jq -r '.dns_name'`
 
 # Target Group ARN
-target_arn=`aws elbv2 describe-target-groups --load-balancer-arn=$elb --query TargetGroups[].TargetGroupArn | jq -r '.[]'`
+target_arn=`echo $discovery | jq -r '.target_group_arn'`
 
 # EC2 IDs attached to Target Group 
-ec2_ids=""
-while true
-do
-        ec2_ids=`aws elbv2 describe-target-health --target-group-arn $target_arn --query 'TargetHealthDescriptions[*].Target.Id' | jq -r '.[]'`
-        nr_ids=`set -- $ec2_ids && echo $#`
-        if [ $nr_ids == $login_nodes_number ]; then break; fi
-        sleep 2
-done
-
-# Resolve EC2 IDs into ip addresses and add them as HPC_DOMAIN hostnames into nodes file 
-ctr=0
-ec2_ips=""
-echo "#---do not modify below ---" > $PWB_CONFIG_DIR/nodes
-for i in $ec2_ids; 
-        do 
-                ctr=$(($ctr+1))
-                ip=`aws ec2 describe-instances --filters "Name=instance-id,Values=$i" --query 'Reservations[*].Instances[*].[PrivateIpAddress]' --output text`
-                ec2_ips="$ip $ec2_ips"
-                echo "$ip node${ctr} node${ctr}.${HPC_DOMAIN}" >> $PWB_CONFIG_DIR/nodes
-         done
+ec2_ids=`echo $discovery | jq -r '.target_ids[]'`
+
+# Resolve EC2 IDs into ip addresses (one describe-instances call), add them as HPC_DOMAIN
+# hostnames into nodes file and register them with the int and ext ALB target groups
+phase start alb-register
+/usr/bin/python3 $PWB_BASE_DIR/scripts/pwb_alb.py register --cluster-name "$cluster_name" --hpc-domain "$HPC_DOMAIN" \
+        --nodes-file $PWB_CONFIG_DIR/nodes $ec2_ids
+phase end alb-register
  
 # Append nodes file to /etc/hosts
 cat  $PWB_CONFIG_DIR/nodes >> /etc/hosts
 
+# Keep target groups, nodes file and /etc/hosts in line with the login nodes when
+# ParallelCluster replaces one of them
+cat << EOF > /etc/systemd/system/pwb-reconcile.service
+[Unit]
+Description=Reconcile Workbench login nodes with ALB target groups
+After=network-online.target
+
+[Service]
+Environment=AWS_DEFAULT_REGION=$AWS_DEFAULT_REGION
+ExecStart=/usr/bin/python3 $PWB_BASE_DIR/scripts/pwb_alb.py reconcile --cluster-name "$cluster_name" --hpc-domain "$HPC_DOMAIN" --nodes-file $PWB_CONFIG_DIR/nodes --metrics-file /var/log/pwb-reconcile.jsonl --interval 10
+Restart=always
+RestartSec=10
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+systemctl daemon-reload
+systemctl enable --now pwb-reconcile
+
 # # register ELB in private subnet as target for pulumi created ELB in public subnet 
 # # Find existing internal LB ARN
 # internal_lb_arn=`for arn in $(aws elbv2 describe-load-balancers --query "LoadBalancers[*].LoadBalancerArn" --output text); do
@@ -140,34 +177,8 @@ cat  $PWB_CONFIG_DIR/nodes >> /etc/hosts
 
 
 
-# Find the target group ARN for the int ALB
-pwb_alb_tg_int_arn=$(aws elbv2 describe-target-groups --query "TargetGroups[?starts_with(TargetGroupName, 'pwb-alb-tg-int') && contains(TargetGroupName, '$cluster_name')].TargetGroupArn" --output text)
-# Register the internal ALB as a target to the ALB's target group
-if [ -n "$pwb_alb_tg_int_arn" ]; then
-for i in $ec2_ids; 
-do 
-        ec2_ip=`aws ec2 describe-instances --filters "Name=instance-id,Values=$i" --query 'Reservations[*].Instances[*].[PrivateIpAddress]' --output text`
-        
-        aws elbv2 register-targets --target-group-arn "$pwb_alb_tg_int_arn" --targets Id="$ec2_ip",Port=8787
-done
-fi
-
-# Find the target group ARN for the ext ALB
-pwb_alb_tg_ext_arn=$(aws elbv2 describe-target-groups --query "TargetGroups[?starts_with(TargetGroupName, 'pwb-alb-tg-ext') && contains(TargetGroupName, '$cluster_name')].TargetGroupArn" --output text)
-## Register the external ALB as a target to the ALB's target group
-if [ -n "$pwb_alb_tg_ext_arn" ]; then
-for i in $ec2_ids; 
-do 
-        ec2_ip=`aws ec2 describe-instances --filters "Name=instance-id,Values=$i" --query 'Reservations[*].Instances[*].[PrivateIpAddress]' --output text`
-        
-        aws elbv2 register-targets --target-group-arn "$pwb_alb_tg_ext_arn" --targets Id="$ec2_ip",Port=8787
-done
-fi
-
-
-
 # generate secure-cookie-key as a simple UUID
-sh -c "echo SECURE_COOKIE_KEY > $PWB_CONFIG_DIR/secure-cookie-key"
+sh -c "echo {{ SECURE_COOKIE_KEY }} > $PWB_CONFIG_DIR/secure-cookie-key"
 chmod 0600 $PWB_CONFIG_DIR/secure-cookie-key
 
 cat > $PWB_CONFIG_DIR/launcher-env << EOF
@@ -204,7 +215,7 @@ launcher-sessions-enabled=1
 launcher-default-cluster=Slurm
 EOF
 
-if SSL 
+if {{ SSL }} 
 then
         echo "launcher-sessions-callback-address=https://$HPC_HOST.$HPC_DOMAIN" >> $PWB_CONFIG_DIR/rserver.conf
 else
@@ -268,7 +279,7 @@ audited-jobs-storage-path=/home/rstudio/shared-storage/audited-jobs
 
 EOF
 
-if LOCAL 
+if {{ LOCAL }} 
 then 
 cat >> $PWB_CONFIG_DIR/rserver.conf << EOF
 
@@ -300,7 +311,7 @@ EOF
 mkdir -p $SHARED_DATA/head-node/{audit-data,monitor-data}
 chown -R rstudio-server $SHARED_DATA/head-node/
 
-if SSL 
+if {{ SSL }} 
 then 
     cat << EOF >> $PWB_CONFIG_DIR/rserver.conf
 
@@ -310,12 +321,12 @@ ssl-certificate=$PWB_BASE_DIR/etc/$HPC_DOMAIN.crt
 ssl-certificate-key=$PWB_BASE_DIR/etc/$HPC_DOMAIN.key  
 EOF
 
-        aws s3 cp s3://S3_BUCKETNAME/$HPC_DOMAIN.crt $PWB_BASE_DIR/etc
-        aws s3 cp s3://S3_BUCKETNAME/$HPC_DOMAIN.key $PWB_BASE_DIR/etc
+        aws s3 cp s3://{{ S3_BUCKETNAME }}/$HPC_DOMAIN.crt $PWB_BASE_DIR/etc
+        aws s3 cp s3://{{ S3_BUCKETNAME }}/$HPC_DOMAIN.key $PWB_BASE_DIR/etc
         chmod 0600 $PWB_BASE_DIR/etc/$HPC_DOMAIN.key 
 fi
 
-if EASYBUILD_SUPPORT 
+if {{ EASYBUILD_SUPPORT }} 
 then 
 
     # get rid of modules.sh (left-over from environment-modules)
@@ -354,7 +365,7 @@ thread-pool-size=4
 enable-debug-logging=1
 EOF
 
-if LOCAL 
+if {{ LOCAL }} 
 then 
     echo "enable-cgroups=1" >>  $PWB_CONFIG_DIR/launcher.conf
 fi 
@@ -372,7 +383,7 @@ type=Slurm
 config-file=/etc/rstudio/launcher.slurmbatch.conf
 EOF
 
-if LOCAL 
+if {{ LOCAL }} 
 then 
 cat >> $PWB_CONFIG_DIR/launcher.conf<<EOF
 
@@ -420,7 +431,7 @@ resource-profile-config=/etc/rstudio/launcher.slurmbatch.resources.conf
 
 EOF
 
-if LOCAL 
+if {{ LOCAL }} 
 then 
 cat > $PWB_CONFIG_DIR/launcher.local.conf << EOF 
 scratch-path=/home/rstudio/shared-storage/Local
@@ -433,27 +444,12 @@ max-cpus=4
 max-mem-mb=15000
 EOF
 
-cat > $PWB_CONFIG_DIR/launcher.local.resources.conf<<EOF
-# memory limits calculated based on 90% of total t3.xlarge memory
-[small]
-name = "Small (1 cpu, 1 GB mem)"
-cpus=1
-mem-mb=899
-[medium]
-name = "Medium (2 cpu, 2 GB mem)"
-cpus=2
-mem-mb=3873
-[large]
-name = "Large (4 cpu, 4 GB mem)"
-cpus=4
-mem-mb=7746
-
-EOF
+aws s3 cp s3://{{ S3_BUCKETNAME }}/launcher.local.resources.conf $PWB_CONFIG_DIR
 
 fi
  
 
-if SINGULARITY_SUPPORT 
+if {{ SINGULARITY_SUPPORT }} 
 then 
                 echo -e "# Default GPU brand\ndefault-gpu-brand=nvidia\n" >> $PWB_CONFIG_DIR/launcher.slurmbatch.conf
                 echo -e "# Default GPU brand\ndefault-gpu-brand=nvidia\n" >> $PWB_CONFIG_DIR/launcher.slurminteractive.conf
@@ -479,58 +475,10 @@ allowed-partitions=all,gpu
 #max-mem-mb=1024
 EOF
 
-cat > $PWB_CONFIG_DIR/launcher.slurminteractive.resources.conf<<EOF
-# memory limits calculated based on 90% of total t3.xlarge memory
-[small]
-name = "Small (1 cpu, 1 GB mem)"
-cpus=1
-mem-mb=899
-[medium]
-name = "Medium (2 cpu, 2 GB mem)"
-cpus=2
-mem-mb=3873
-[large]
-name = "Large (4 cpu, 4 GB mem)"
-cpus=4
-mem-mb=7746
-
-EOF
-
-cat > $PWB_CONFIG_DIR/launcher.slurmbatch.resources.conf<<EOF
-# memory limits calculated based on 90% of total t3.xlarge memory
-[small]
-name = "Small (1 cpu, 4 GB mem)"
-cpus=1
-mem-mb=3596
-[medium]
-name = "Medium (2 cpu, 8 GB mem)"
-cpus=2
-mem-mb=7194
-[large]
-name = "Large (4 cpu, 16 GB mem)"
-cpus=4
-mem-mb=14386
-
-EOF
-
-if BENCHMARK_SUPPORT
-then 
-cat > $PWB_CONFIG_DIR/launcher.slurminteractive.resources.conf<<EOF
-[small]
-name = "Small (1 cpu, 1 GB mem)"
-cpus=1
-mem-mb=968
-
-EOF
-
-cat > $PWB_CONFIG_DIR/launcher.slurmbatch.resources.conf<<EOF
-[small]
-name = "Small (1 cpu, 1 GB mem)"
-cpus=1
-mem-mb=968
-
-EOF
-fi
+# Resource profiles are generated by pwbtools.profiles in deploy.sh to fit the
+# instance types of the interactive and all queues
+aws s3 cp s3://{{ S3_BUCKETNAME }}/launcher.slurminteractive.resources.conf $PWB_CONFIG_DIR
+aws s3 cp s3://{{ S3_BUCKETNAME }}/launcher.slurmbatch.resources.conf $PWB_CONFIG_DIR
 
 
 
@@ -568,14 +516,19 @@ EOF
 setfacl -R --set-file=$tmpfile /home/renv
 rm -rf $tmpfile
 
+# pre-warm it with the packages of the pkg.lock files of all R versions (cf. pwb_renvcache.py),
+#  in the background as the cluster does not need to wait for it. Reruns only copy what is missing.
+aws s3 cp s3://{{ S3_BUCKETNAME }}/pwb_renvcache.py $PWB_BASE_DIR/scripts
+nohup /usr/bin/python3 $PWB_BASE_DIR/scripts/pwb_renvcache.py warm --cache /home/renv > /var/log/pwb-renvcache.log 2>&1 &
+
 
 cat << EOF > $PWB_CONFIG_DIR/database.conf
 provider=postgresql
-host=RSW_DB_HOST
+host={{ RSW_DB_HOST }}
 database=pwb
-port=5432
-username=RSW_DB_USER
-password=RSW_DB_PASS
+port={{ RSW_DB_PORT }}
+username={{ RSW_DB_USER }}
+password={{ RSW_DB_PASS }}
 connection-timeout-seconds=10
 EOF
 
@@ -583,11 +536,11 @@ chmod 0600 $PWB_CONFIG_DIR/audit-database.conf
 
 cat << EOF > $PWB_CONFIG_DIR/audit-database.conf
 provider=postgresql
-host=RSW_AUDIT_DB_HOST
+host={{ RSW_AUDIT_DB_HOST }}
 database=audit
-port=5432
-username=RSW_AUDIT_DB_USER
-password=RSW_AUDIT_DB_PASS
+port={{ RSW_AUDIT_DB_PORT }}
+username={{ RSW_AUDIT_DB_USER }}
+password={{ RSW_AUDIT_DB_PASS }}
 connection-timeout-seconds=10
 EOF
 
@@ -602,64 +555,36 @@ EOF
 mkdir -p $SHARED_DATA/crash-dumps
 chmod 777 $SHARED_DATA/crash-dumps
 
-aws s3 cp s3://S3_BUCKETNAME/config-login.sh  $PWB_BASE_DIR/scripts
-chmod +x $PWB_BASE_DIR/scripts/config-login.sh
+# Login node setup and restarts on removal of workbench-<host>.state are handled by
+# pwb_agent.py (pwb-agent.service). rc.pwb is kept for images still running it from cron.
+aws s3 cp s3://{{ S3_BUCKETNAME }}/pwb_agent.py $PWB_BASE_DIR/scripts
+# Log shipper of the login nodes (pwb-logship.service, cf. config-login.sh)
+aws s3 cp s3://{{ S3_BUCKETNAME }}/pwb_logship.py $PWB_BASE_DIR/scripts
+# Storage benchmark for the shared mounts, e.g. python3 $PWB_BASE_DIR/scripts/pwb_fsbench.py run /home
+aws s3 cp s3://{{ S3_BUCKETNAME }}/pwb_fsbench.py $PWB_BASE_DIR/scripts
 
 cat << EOF > $PWB_BASE_DIR/scripts/rc.pwb 
 #!/bin/bash
 
-set -x 
-
 exec >> /var/log/rc.pwb.log
 exec 2>&1
 
-echo "----"
-echo ""
-echo "Running rc.pwb on \$(hostname)"
-echo "Date: \$(date)"
-echo ""
-echo "----"
-echo "" 
-
-if (mount | grep login_nodes >&/dev/null) && [ ! -f /etc/head-node ]; then 
-        # yay - we are on a login node 
-        if [ ! -f /etc/login-node-is-setup ]; then
-                #  we have not set up workbench so let's do it
-                touch /etc/login-node-is-setup
-                # we need to loop until the config-login.sh script is deployed
-                config_not_found=true
-                while \$config_not_found
-                do 
-                   sleep 5
-                   if [ -f $PWB_BASE_DIR/scripts/config-login.sh ]; then 
-                       config_not_found=false
-                   fi
-                done
-                # Now we can run the config scrip      
-                $PWB_BASE_DIR/scripts/config-login.sh $PWB_CONFIG_DIR $PWB_VERSION
-        fi
-
-        if [ -f /opt/rstudio/etc/rstudio/rserver.conf ] && [ ! -f /opt/rstudio/workbench-\`hostname\`.state ]; then 
-                # Something wants us to restart so let's do it
-                systemctl stop rstudio-server 
-                systemctl stop rstudio-launcher
-                killall apache2
-                logrotate -f /etc/logrotate.d/rstudio
-                chmod 0600 /opt/rstudio/etc/rstudio/launcher.pem 
-                systemctl start rstudio-launcher
-                systemctl start rstudio-server 
-                touch /opt/rstudio/workbench-\`hostname\`.state
-        fi
-fi
+exec /usr/bin/python3 $PWB_BASE_DIR/scripts/pwb_agent.py once
 EOF
 
 chmod +x $PWB_BASE_DIR/scripts/rc.pwb 
 
-aws s3 cp s3://S3_BUCKETNAME/config-login.sh  $PWB_BASE_DIR/scripts
+# Workbench version the agent passes to config-login.sh, the shared scripts folder may
+#  still hold packages of earlier versions
+echo $PWB_VERSION > $PWB_BASE_DIR/scripts/pwb-version.tmp
+mv $PWB_BASE_DIR/scripts/pwb-version.tmp $PWB_BASE_DIR/scripts/pwb-version
+
+aws s3 cp s3://{{ S3_BUCKETNAME }}/config-login.sh  $PWB_BASE_DIR/scripts
 chmod +x $PWB_BASE_DIR/scripts/config-login.sh
 
-if SINGULARITY_SUPPORT
+if {{ SINGULARITY_SUPPORT }}
 then 
+   phase start apptainer-install
    APPTAINER_VERSION=1.4.2
    pushd /tmp 
    curl -LO https://github.com/apptainer/apptainer/releases/download/v${APPTAINER_VERSION}/apptainer_${APPTAINER_VERSION}_amd64.deb
@@ -667,9 +592,10 @@ then
    apt install -y ./apptainer_${APPTAINER_VERSION}_amd64.deb ./apptainer-suid_${APPTAINER_VERSION}_amd64.deb
    rm -f ./apptainer_${APPTAINER_VERSION}_amd64.deb ./apptainer-suid_${APPTAINER_VERSION}_amd64.deb
    popd
+   phase end apptainer-install
 fi
 
-if SINGULARITY_SUPPORT 
+if {{ SINGULARITY_SUPPORT }} 
 then
         cd /tmp && \
                 git clone https://github.com/sol-eng/singularity-rstudio.git && \
@@ -678,19 +604,21 @@ then
                 sed -i "s/SLURM_VERSION.*/SLURM_VERSION=$slurm_version/" build.env &&
                 sed -i "s/PWB_VERSION.*/PWB_VERSION=$PWB_VERSION/" build.env &&
                 for i in `ls -d */ | grep -v scripts | grep -v rhel | sed 's#/##'`; do \
-                        ( if [[ ! -f $PWB_BASE_DIR/apptainer/$i.sif ]]; then pushd $i && \
+                        ( if [[ ! -f $PWB_BASE_DIR/apptainer/$i.sif ]]; then phase start apptainer-build $i && pushd $i && \
 			singularity build --build-arg-file ../build.env $PWB_BASE_DIR/apptainer/$i.sif r-session-complete.sdef && \
-                        popd; fi ) & 
+                        popd; phase end apptainer-build $i; fi ) & 
                         if [[ $(jobs -r -p | wc -l) -ge 3 ]]; then
                                 wait -n
                         fi
                 done
 
         # We also need to build the SPANK plugin for singularity
+        phase start spank-plugin
 
         cd /tmp/singularity-rstudio/slurm-singularity-exec/ && \
                 cmake -S . -B build -D CMAKE_INSTALL_PREFIX=/opt/slurm -DINSTALL_PLUGSTACK_CONF=ON && \
                 cmake --build build --target install
+        phase end spank-plugin
 
         cat << EOF > /opt/slurm/etc/plugstack.conf
 include /opt/slurm/etc/plugstack.conf.d/*.conf
@@ -707,3 +635,4 @@ EOF
 
 fi
 
+phase end script
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""Readiness agent for the Workbench login nodes.
+
+Takes over the duties of the former every-minute `rc.pwb` cron job: once the
+head node has published `config-login.sh`, the Workbench version of the
+cluster (`scripts/pwb-version`) and the package of that version to the shared
+`/opt/rstudio` tree, a login node runs its setup, and whenever
+`/opt/rstudio/workbench-<host>.state` is removed Workbench is restarted and
+the state file recreated.
+
+    python3 pwb_agent.py run        # long running, cf. pwb-agent.service
+    python3 pwb_agent.py once       # single pass, used by rc.pwb
+
+`wait` blocks until the given paths exist and replaces the busy-wait loops of
+config-login.sh.
+
+    python3 pwb_agent.py wait /opt/rstudio/etc/rstudio/rserver.conf --timeout 3600
+
+The agent sleeps on inotify events of the watched directories. As /opt/rstudio
+is shared via EFS, where inotify only reports changes made on the local host,
+it also wakes up every `--poll` seconds (default 1) to stat the handful of
+paths it depends on. Use `--root`, `--etc` and `--dry-run` to run it against a
+local directory.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import fcntl
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Set
+
+log = logging.getLogger("pwb_agent")
+
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class Inotify:
+    """Minimal inotify binding, only used to be woken up early."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watched: Set[str] = set()
+
+    def watch(self, path: Path):
+        path = str(path)
+        if path in self.watched or not os.path.isdir(path):
+            return
+        if self._add_watch(self.fd, os.fsencode(path), WATCH_MASK) < 0:
+            log.warning("cannot watch %s: %s", path, os.strerror(ctypes.get_errno()))
+            return
+        self.watched.add(path)
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep until an event arrives or `timeout` passed, return whether there were events."""
+        # directories that vanished lose their watch, re-add them once they are back
+        self.watched = {p for p in self.watched if os.path.isdir(p)}
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+
+class Poller:
+    """Fallback where inotify is not available."""
+
+    def watch(self, path: Path):
+        pass
+
+    def wait(self, timeout: float) -> bool:
+        time.sleep(timeout)
+        return False
+
+
+def make_notifier():
+    try:
+        return Inotify()
+    except (OSError, AttributeError) as e:
+        log.warning("inotify not available (%s), polling only", e)
+        return Poller()
+
+
+def nearest_dir(path: Path) -> Path:
+    """The closest existing directory at or above `path`'s parent."""
+    path = path.parent
+    while not path.is_dir() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def wait_for(paths: Sequence[Path], timeout: Optional[float] = None, poll: float = 1.0, notifier=None) -> bool:
+    """Block until all `paths` exist, return False on timeout."""
+    notifier = notifier or make_notifier()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        missing = [p for p in paths if not p.exists()]
+        if not missing:
+            return True
+        if deadline is not None and time.monotonic() > deadline:
+            return False
+        for p in missing:
+            notifier.watch(nearest_dir(p))
+        notifier.wait(poll)
+
+
+@dataclass
+class Layout:
+    """Paths the agent depends on, relocatable for local runs."""
+    root: Path = Path("/opt/rstudio")
+    etc: Path = Path("/etc")
+    hostname: str = field(default_factory=socket.gethostname)
+
+    @property
+    def scripts(self) -> Path:
+        return self.root / "scripts"
+
+    @property
+    def config_dir(self) -> Path:
+        return self.root / "etc" / "rstudio"
+
+    @property
+    def rserver_conf(self) -> Path:
+        return self.config_dir / "rserver.conf"
+
+    @property
+    def config_login(self) -> Path:
+        return self.scripts / "config-login.sh"
+
+    @property
+    def state(self) -> Path:
+        return self.root / f"workbench-{self.hostname}.state"
+
+    @property
+    def setup_marker(self) -> Path:
+        return self.etc / "login-node-is-setup"
+
+    @property
+    def head_marker(self) -> Path:
+        return self.etc / "head-node"
+
+    @property
+    def version_file(self) -> Path:
+        return self.scripts / "pwb-version"
+
+    def pwb_version(self) -> Optional[str]:
+        """PWB_VERSION of the cluster, written by install-pwb-config.sh."""
+        try:
+            return self.version_file.read_text().strip() or None
+        except OSError:
+            return None
+
+    def session_payload(self) -> Optional[Path]:
+        """The Workbench package of that version downloaded by the head node, if it is there."""
+        version = self.pwb_version()
+        payload = self.scripts / f"rstudio-workbench-{version}-amd64.deb"
+        return payload if version and payload.exists() else None
+
+    def watch_dirs(self) -> List[Path]:
+        return [self.root, self.scripts, self.config_dir]
+
+
+def on_login_node(layout: Layout, mounts: Path = Path("/proc/mounts")) -> bool:
+    """Same check rc.pwb did: the login_nodes shared storage is mounted and we are not the head node."""
+    if layout.head_marker.exists():
+        return False
+    try:
+        return "login_nodes" in mounts.read_text()
+    except OSError:
+        return False
+
+
+class Agent:
+    """Level-triggered: every pass compares the tree with the node state and acts on differences."""
+
+    def __init__(self, layout: Layout, is_login_node: Callable[[], bool],
+                 run_command: Callable[[List[str]], None], notifier=None):
+        self.layout = layout
+        self.is_login_node = is_login_node
+        self.run_command = run_command
+        self.notifier = notifier or make_notifier()
+
+    def restart_commands(self) -> List[List[str]]:
+        return [["systemctl", "stop", "rstudio-server"],
+                ["systemctl", "stop", "rstudio-launcher"],
+                ["killall", "apache2"],
+                ["logrotate", "-f", "/etc/logrotate.d/rstudio"],
+                ["chmod", "0600", str(self.layout.config_dir / "launcher.pem")],
+                ["systemctl", "start", "rstudio-launcher"],
+                ["systemctl", "start", "rstudio-server"]]
+
+    def ready_for_setup(self) -> bool:
+        # config-login.sh is made executable after its upload has finished
+        return os.access(self.layout.config_login, os.X_OK) and self.layout.session_payload() is not None
+
+    def setup(self):
+        log.info("setting up login node %s", self.layout.hostname)
+        started = time.monotonic()
+        self.layout.setup_marker.touch()
+        self.run_command([str(self.layout.config_login), str(self.layout.config_dir), self.layout.pwb_version()])
+        log.info("login node setup finished in %.1f s", time.monotonic() - started)
+
+    def restart(self):
+        log.info("%s is missing, restarting Workbench", self.layout.state)
+        started = time.monotonic()
+        for command in self.restart_commands():
+            self.run_command(command)
+        self.layout.state.touch()
+        log.info("Workbench restarted in %.1f s", time.monotonic() - started)
+
+    def tick(self) -> Optional[str]:
+        """Run one pass, return the action taken."""
+        if not self.is_login_node():
+            return None
+        if not self.layout.setup_marker.exists():
+            if self.ready_for_setup():
+                self.setup()
+                return "setup"
+            return None
+        if self.layout.rserver_conf.exists() and not self.layout.state.exists():
+            self.restart()
+            return "restart"
+        return None
+
+    def run(self, poll: float, stop: threading.Event):
+        while not stop.is_set():
+            self.tick()
+            for d in self.layout.watch_dirs():
+                self.notifier.watch(d)
+            self.notifier.wait(poll)
+
+
+def execute(command: List[str]):
+    # like the shell scripts, a failing step does not stop the remaining ones
+    result = subprocess.run(command)
+    if result.returncode != 0:
+        log.warning("%s exited with %d", " ".join(command), result.returncode)
+
+
+def dry_run(command: List[str]):
+    log.info("would run: %s", " ".join(command))
+
+
+def lock(path: str, blocking: bool):
+    """Keep cron (rc.pwb) and the service from acting at the same time, None if held elsewhere."""
+    f = open(path, "w")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", type=Path, default=Path("/opt/rstudio"), help="shared Workbench tree")
+    parser.add_argument("--etc", type=Path, default=Path("/etc"), help="location of the node marker files")
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds between checks without inotify events")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("run", "once"):
+        action = sub.add_parser(name, help="act continuously" if name == "run" else "act once")
+        action.add_argument("--role", choices=["auto", "login", "other"], default="auto")
+        action.add_argument("--hostname", default=socket.gethostname())
+        action.add_argument("--dry-run", action="store_true", help="log commands instead of running them")
+        action.add_argument("--lock-file", default="/run/pwb-agent.lock")
+    wait = sub.add_parser("wait", help="wait until all paths exist")
+    wait.add_argument("paths", type=Path, nargs="+")
+    wait.add_argument("--timeout", type=float)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s %(name)s %(message)s")
+
+    if args.command == "wait":
+        if wait_for(args.paths, args.timeout, args.poll):
+            return 0
+        log.error("timed out waiting for %s", " ".join(str(p) for p in args.paths))
+        return 1
+
+    layout = Layout(args.root, args.etc, args.hostname)
+    roles = {"auto": lambda: on_login_node(layout), "login": lambda: True, "other": lambda: False}
+    agent = Agent(layout, roles[args.role], dry_run if args.dry_run else execute)
+    held = lock(args.lock_file, blocking=args.command == "run")
+    if held is None:
+        log.info("%s is held by a running agent, nothing to do", args.lock_file)
+        return 0
+    with held:
+        if args.command == "once":
+            agent.tick()
+            return 0
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+        agent.run(args.poll, stop)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+"""Load balancer helpers for the head node of the Workbench cluster.
+
+`discover` finds the load balancer ParallelCluster created for the login node
+pool (tagged with `parallelcluster:cluster-name`), its target group and the
+instance ids registered there. Tags are fetched in batches of 20 ARNs (the API
+limit of DescribeTags), load balancers known to belong to other clusters are
+remembered between polls, and polls back off exponentially with jitter.
+
+    python3 pwb_alb.py discover --cluster-name <CLUSTER> --targets 6
+
+With `--timeline <FILE>`, the time spent waiting for the load balancer and
+for the targets is appended as `elb-wait` and `target-wait` phase events
+(cf. `pwbtools/timeline.py`).
+
+`register` resolves the private IPs of all login nodes with a single
+DescribeInstances call, writes the Workbench `nodes` file from that map and
+registers all IPs with the internal and external ALB target groups, one
+RegisterTargets call per target group.
+
+    python3 pwb_alb.py register --cluster-name <CLUSTER> --hpc-domain <DOMAIN> \
+        --nodes-file /opt/rstudio/etc/rstudio/nodes i-0123 i-0456 ...
+
+`reconcile` keeps both target groups, the nodes file and /etc/hosts in line
+with the running login nodes of the cluster, e.g. after ParallelCluster
+replaced a login node. Every `--interval` seconds it applies the missing
+registrations and deregistrations in one call per target group and rewrites
+the nodes file atomically (surviving nodes keep their `nodeN` name). The time
+from detecting a change until all login nodes are healthy in both target
+groups is appended as a JSON line to `--metrics-file`. Nodes listed in
+`--hold-file` (written by `pwb_restart.py` during rolling restarts) are left
+alone. A pass that finds no login nodes, or that would deregister all targets
+of a target group, only takes effect once `--confirm-passes` consecutive
+passes (default 3) agree, so a transient empty DescribeInstances result or a
+pool replaced mid-pass does not take all nodes out of service.
+
+    python3 pwb_alb.py reconcile --cluster-name <CLUSTER> --hpc-domain <DOMAIN> \
+        --nodes-file /opt/rstudio/etc/rstudio/nodes --interval 10
+
+Results are printed as JSON. Set `--endpoint-url` (or `AWS_ENDPOINT_URL`) to
+run against a local stand-in such as `moto_server`.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+import botocore.exceptions
+
+import boto3
+
+log = logging.getLogger("pwb_alb")
+
+CLUSTER_TAG = "parallelcluster:cluster-name"
+NODE_TYPE_TAG = "parallelcluster:node-type"
+LOGIN_NODE = "LoginNode"
+
+# DescribeTags accepts at most 20 resource ARNs per call
+TAGS_BATCH_SIZE = 20
+
+# Name prefixes of the ALB target groups created by the pulumi stack
+TARGET_GROUP_PREFIXES = ("pwb-alb-tg-int", "pwb-alb-tg-ext")
+
+WORKBENCH_PORT = 8787
+
+NODES_FILE_HEADER = "#---do not modify below ---"
+
+# IPs of login nodes taken out of the target groups on purpose (cf. pwb_restart.py),
+# one per line, the reconciler neither registers nor deregisters them
+HOLD_FILE = "/run/pwb-restart.hold"
+
+
+@dataclass
+class Backoff:
+    """Exponential backoff with full jitter."""
+    base: float = 2.0
+    cap: float = 30.0
+    timeout: Optional[float] = None
+    attempt: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    def sleep(self):
+        if self.timeout is not None and time.monotonic() - self.started > self.timeout:
+            raise TimeoutError(f"gave up after {self.attempt} attempts")
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.attempt))
+        self.attempt += 1
+        time.sleep(delay)
+
+
+@dataclass
+class Discovery:
+    load_balancer_arn: str
+    dns_name: str
+    target_group_arn: str
+    target_ids: List[str]
+
+
+def batched(items: List[str], size: int) -> Iterator[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class LoadBalancerFinder:
+    """Finds the login node load balancer of a cluster with as few API calls as possible."""
+
+    def __init__(self, cluster_name: str, elbv2=None):
+        self.cluster_name = cluster_name
+        self.elbv2 = elbv2 or boto3.client("elbv2")
+        # ARNs of load balancers whose tags did not match, tags do not change in between polls
+        self.negative: Set[str] = set()
+        self.calls: Dict[str, int] = {}
+
+    def _call(self, name: str, **kwargs):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        return getattr(self.elbv2, name)(**kwargs)
+
+    def _load_balancers(self) -> Dict[str, dict]:
+        result = {}
+        kwargs = {}
+        while True:
+            page = self._call("describe_load_balancers", **kwargs)
+            for lb in page["LoadBalancers"]:
+                result[lb["LoadBalancerArn"]] = lb
+            if not page.get("NextMarker"):
+                return result
+            kwargs["Marker"] = page["NextMarker"]
+
+    def find_once(self) -> Optional[dict]:
+        load_balancers = self._load_balancers()
+        candidates = sorted(arn for arn in load_balancers if arn not in self.negative)
+        for batch in batched(candidates, TAGS_BATCH_SIZE):
+            for description in self._call("describe_tags", ResourceArns=batch)["TagDescriptions"]:
+                tags = {t["Key"]: t["Value"] for t in description.get("Tags", [])}
+                if tags.get(CLUSTER_TAG) == self.cluster_name:
+                    return load_balancers[description["ResourceArn"]]
+                self.negative.add(description["ResourceArn"])
+        return None
+
+    def find(self, backoff: Backoff) -> dict:
+        while True:
+            lb = self.find_once()
+            if lb is not None:
+                return lb
+            log.info("no load balancer tagged for %s yet, %d known not to match",
+                     self.cluster_name, len(self.negative))
+            backoff.sleep()
+
+    def target_ids(self, target_group_arn: str, expected: int, backoff: Backoff) -> List[str]:
+        while True:
+            health = self._call("describe_target_health", TargetGroupArn=target_group_arn)
+            ids = [t["Target"]["Id"] for t in health["TargetHealthDescriptions"]]
+            if len(ids) >= expected:
+                return ids
+            log.info("%d of %d targets registered", len(ids), expected)
+            backoff.sleep()
+
+    def discover(self, expected_targets: int, timeout: Optional[float] = None,
+                 phase: Callable[[str, str], None] = lambda event, name: None) -> Discovery:
+        phase("start", "elb-wait")
+        lb = self.find(Backoff(timeout=timeout))
+        phase("end", "elb-wait")
+        groups = self._call("describe_target_groups", LoadBalancerArn=lb["LoadBalancerArn"])["TargetGroups"]
+        target_group_arn = groups[0]["TargetGroupArn"]
+        phase("start", "target-wait")
+        ids = self.target_ids(target_group_arn, expected_targets, Backoff(timeout=timeout))
+        phase("end", "target-wait")
+        return Discovery(lb["LoadBalancerArn"], lb["DNSName"], target_group_arn, ids)
+
+
+def timeline(path: str, script: str) -> Callable[[str, str], None]:
+    """Appends phase events in the format of the `phase` function of the node scripts."""
+    def phase(event: str, name: str):
+        record = {"time": time.time(), "host": socket.gethostname(), "script": script,
+                  "phase": name, "event": event, "detail": ""}
+        with open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    return phase
+
+
+class TargetRegistrar:
+    """Resolves login node IPs once and registers them with the ALB target groups in bulk."""
+
+    def __init__(self, cluster_name: str, ec2=None, elbv2=None):
+        self.cluster_name = cluster_name
+        self.ec2 = ec2 or boto3.client("ec2")
+        self.elbv2 = elbv2 or boto3.client("elbv2")
+
+    def resolve_ips(self, instance_ids: List[str]) -> Dict[str, str]:
+        """Map instance ids to private IPs with one (paginated) DescribeInstances call."""
+        ips = {}
+        paginator = self.ec2.get_paginator("describe_instances")
+        for page in paginator.paginate(InstanceIds=instance_ids):
+            for reservation in page["Reservations"]:
+                for instance in reservation["Instances"]:
+                    ips[instance["InstanceId"]] = instance["PrivateIpAddress"]
+        return ips
+
+    def target_groups(self) -> Dict[str, str]:
+        """Map each of TARGET_GROUP_PREFIXES to the ARN of the group of this cluster."""
+        groups = {}
+        paginator = self.elbv2.get_paginator("describe_target_groups")
+        for page in paginator.paginate():
+            for group in page["TargetGroups"]:
+                name = group["TargetGroupName"]
+                for prefix in TARGET_GROUP_PREFIXES:
+                    if name.startswith(prefix) and self.cluster_name in name:
+                        groups[prefix] = group["TargetGroupArn"]
+        return groups
+
+    def register(self, target_group_arn: str, ips: List[str], port: int = WORKBENCH_PORT):
+        if ips:
+            self.elbv2.register_targets(TargetGroupArn=target_group_arn,
+                                        Targets=[{"Id": ip, "Port": port} for ip in ips])
+
+
+def render_nodes(names: Dict[str, str], hpc_domain: str) -> str:
+    """Content of the Workbench nodes file, one `ip nodeN nodeN.domain` line per login node."""
+    lines = [NODES_FILE_HEADER]
+    for ip, name in sorted(names.items(), key=lambda item: int(item[1][4:])):
+        lines.append(f"{ip} {name} {name}.{hpc_domain}")
+    return "\n".join(lines) + "\n"
+
+
+def nodes_file(instance_ids: List[str], ips: Dict[str, str], hpc_domain: str) -> str:
+    return render_nodes({ips[i]: f"node{n}" for n, i in enumerate(instance_ids, start=1)}, hpc_domain)
+
+
+def parse_nodes(content: str) -> Dict[str, str]:
+    """Map IPs to node names of an existing nodes file."""
+    names = {}
+    for line in content.splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and fields[1].startswith("node") and fields[1][4:].isdigit():
+            names[fields[0]] = fields[1]
+    return names
+
+
+def assign_names(current: Dict[str, str], ips: Set[str]) -> Dict[str, str]:
+    """Keep the names of surviving nodes, give new nodes the lowest free `nodeN`."""
+    names = {ip: name for ip, name in current.items() if ip in ips}
+    used = set(names.values())
+    n = 1
+    for ip in sorted(ips - names.keys()):
+        while f"node{n}" in used:
+            n += 1
+        names[ip] = f"node{n}"
+        used.add(names[ip])
+    return names
+
+
+def update_hosts(hosts: str, old_nodes: str, new_nodes: str) -> str:
+    """Replace the lines of the previous nodes file in a hosts file with the current ones."""
+    stale = {line.strip() for line in old_nodes.splitlines()} | {NODES_FILE_HEADER}
+    kept = [line for line in hosts.splitlines() if line.strip() not in stale]
+    return "\n".join(kept + new_nodes.splitlines()) + "\n"
+
+
+def read_hold(path: Optional[str]) -> Set[str]:
+    return set(read_text(path).split()) if path else set()
+
+
+def read_text(path: str) -> str:
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
+
+
+def write_atomic(path: str, content: str, mode: int = 0o644):
+    """Write via a temporary file in the same directory and rename it into place."""
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        pass
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".pwb_alb.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+@dataclass
+class Change:
+    """A difference between the login node pool and the target groups / nodes file."""
+    detected: float
+    added: Set[str] = field(default_factory=set)
+    removed: Set[str] = field(default_factory=set)
+    launched: Optional[float] = None
+
+
+class Reconciler:
+    """Converges target groups, nodes file and hosts file onto the running login nodes."""
+
+    def __init__(self, cluster_name: str, hpc_domain: str, nodes_path: str, hosts_path: Optional[str] = "/etc/hosts",
+                 metrics_path: Optional[str] = None, ec2=None, elbv2=None, clock=time.time,
+                 hold_path: Optional[str] = None, confirm_passes: int = 3):
+        self.registrar = TargetRegistrar(cluster_name, ec2, elbv2)
+        self.hpc_domain = hpc_domain
+        self.nodes_path = nodes_path
+        self.hosts_path = hosts_path
+        self.metrics_path = metrics_path
+        self.hold_path = hold_path
+        self.clock = clock
+        self.groups: Dict[str, str] = {}
+        self.pending: Optional[Change] = None
+        self.confirm_passes = confirm_passes
+        # consecutive passes that would have deregistered all targets or emptied the nodes file
+        self.wipe_passes = 0
+        self.wipe_held = False
+
+    def login_nodes(self) -> Dict[str, float]:
+        """Map private IPs of the running login nodes to their launch time (epoch seconds)."""
+        nodes = {}
+        paginator = self.registrar.ec2.get_paginator("describe_instances")
+        filters = [{"Name": f"tag:{CLUSTER_TAG}", "Values": [self.registrar.cluster_name]},
+                   {"Name": f"tag:{NODE_TYPE_TAG}", "Values": [LOGIN_NODE]},
+                   {"Name": "instance-state-name", "Values": ["running"]}]
+        for page in paginator.paginate(Filters=filters):
+            for reservation in page["Reservations"]:
+                for instance in reservation["Instances"]:
+                    nodes[instance["PrivateIpAddress"]] = instance["LaunchTime"].timestamp()
+        return nodes
+
+    def target_states(self, target_group_arn: str) -> Dict[str, str]:
+        """Map registered IPs to their health state, draining targets are already on their way out."""
+        health = self.registrar.elbv2.describe_target_health(TargetGroupArn=target_group_arn)
+        return {t["Target"]["Id"]: t["TargetHealth"]["State"] for t in health["TargetHealthDescriptions"]
+                if t["TargetHealth"]["State"] != "draining"}
+
+    def sync_targets(self, desired: Set[str], allow_wipe: bool = True) -> Dict[str, Dict[str, str]]:
+        if len(self.groups) < len(TARGET_GROUP_PREFIXES):
+            self.groups = self.registrar.target_groups()
+        states = {}
+        for prefix, arn in self.groups.items():
+            current = self.target_states(arn)
+            # read after the targets, pwb_restart.py holds a node before deregistering it
+            held = read_hold(self.hold_path)
+            add, remove = desired - current.keys() - held, current.keys() - desired - held
+            if remove and not allow_wipe and not current.keys() - held - remove:
+                log.warning("%s: not deregistering all targets %s until %d passes agree", prefix, sorted(remove),
+                            self.confirm_passes)
+                self.wipe_held = True
+                remove = set()
+            if add or remove:
+                log.info("%s: registering %s, deregistering %s", prefix, sorted(add), sorted(remove))
+                self._record(added=add, removed=remove)
+            self.registrar.register(arn, sorted(add))
+            if remove:
+                self.registrar.elbv2.deregister_targets(
+                    TargetGroupArn=arn, Targets=[{"Id": ip, "Port": WORKBENCH_PORT} for ip in sorted(remove)])
+            current = {ip: state for ip, state in current.items() if ip not in remove}
+            current.update({ip: "initial" for ip in add})
+            states[prefix] = {ip: state for ip, state in current.items() if ip not in held}
+        return states
+
+    def sync_files(self, desired: Set[str]):
+        old = read_text(self.nodes_path)
+        current = parse_nodes(old)
+        new = render_nodes(assign_names(current, desired), self.hpc_domain)
+        if new != old:
+            log.info("rewriting %s", self.nodes_path)
+            self._record(added=desired - current.keys(), removed=current.keys() - desired)
+            write_atomic(self.nodes_path, new)
+        if self.hosts_path:
+            hosts = read_text(self.hosts_path)
+            updated = update_hosts(hosts, old, new)
+            if updated != hosts:
+                log.info("rewriting %s", self.hosts_path)
+                write_atomic(self.hosts_path, updated)
+
+    def _record(self, added: Set[str], removed: Set[str]):
+        if self.pending is None:
+            self.pending = Change(detected=self.clock())
+        self.pending.added |= added
+        self.pending.removed |= removed
+
+    def step(self) -> Optional[dict]:
+        """Run one reconciliation pass, return the metrics record once a change has converged."""
+        nodes = self.login_nodes()
+        desired = set(nodes)
+        allow_wipe = self.wipe_passes + 1 >= self.confirm_passes
+        self.wipe_held = False
+        states = self.sync_targets(desired, allow_wipe)
+        if desired or allow_wipe:
+            self.sync_files(desired)
+        elif parse_nodes(read_text(self.nodes_path)):
+            log.warning("no running login nodes, keeping %s until %d passes agree", self.nodes_path,
+                        self.confirm_passes)
+            self.wipe_held = True
+        self.wipe_passes = self.wipe_passes + 1 if self.wipe_held else 0
+        if self.pending is None:
+            return None
+        launched = [nodes[ip] for ip in self.pending.added if ip in nodes]
+        if launched:
+            self.pending.launched = max(launched)
+        if not all(state == "healthy" for group in states.values() for state in group.values()):
+            return None
+
+        now = self.clock()
+        record = {"time": now, "added": sorted(self.pending.added), "removed": sorted(self.pending.removed),
+                  "converged_seconds": round(now - self.pending.detected, 3),
+                  "since_launch_seconds": round(now - self.pending.launched, 3) if self.pending.launched else None}
+        self.pending = None
+        log.info("converged: %s", json.dumps(record))
+        if self.metrics_path:
+            with open(self.metrics_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        return record
+
+    def run(self, interval: float, stop: threading.Event):
+        backoff = Backoff(base=interval, cap=max(interval, 300.0))
+        while not stop.is_set():
+            try:
+                self.step()
+                backoff.attempt = 0
+                stop.wait(interval)
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError):
+                log.exception("reconciliation failed, retrying")
+                backoff.sleep()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoint-url", help="AWS endpoint, e.g. a local moto server")
+    parser.add_argument("--region", help="AWS region (default: AWS_DEFAULT_REGION)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    discover = sub.add_parser("discover", help="find login node load balancer, target group and targets")
+    discover.add_argument("--cluster-name", required=True)
+    discover.add_argument("--targets", type=int, required=True, help="number of login nodes to wait for")
+    discover.add_argument("--timeout", type=float, help="give up after this many seconds")
+    discover.add_argument("--timeline", help="append elb-wait and target-wait phase events to this file")
+    discover.add_argument("--timeline-script", default="install-pwb-config", help="script name of these events")
+    register = sub.add_parser("register", help="write nodes file and register login nodes with the ALBs")
+    register.add_argument("--cluster-name", required=True)
+    register.add_argument("--hpc-domain", required=True)
+    register.add_argument("--nodes-file", required=True)
+    register.add_argument("instance_ids", nargs="+")
+    reconcile = sub.add_parser("reconcile", help="keep target groups, nodes file and /etc/hosts in line with login nodes")
+    reconcile.add_argument("--cluster-name", required=True)
+    reconcile.add_argument("--hpc-domain", required=True)
+    reconcile.add_argument("--nodes-file", required=True)
+    reconcile.add_argument("--hosts-file", default="/etc/hosts", help="hosts file to update, empty to skip")
+    reconcile.add_argument("--metrics-file", help="append convergence times as JSON lines")
+    reconcile.add_argument("--hold-file", default=HOLD_FILE, help="IPs of login nodes to leave alone")
+    reconcile.add_argument("--interval", type=float, default=10.0, help="seconds between passes")
+    reconcile.add_argument("--confirm-passes", type=int, default=3,
+                           help="passes that must agree before all targets or nodes are removed")
+    reconcile.add_argument("--once", action="store_true", help="run a single pass and exit")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s %(name)s %(message)s")
+    session = boto3.session.Session(region_name=args.region)
+
+    if args.command == "discover":
+        finder = LoadBalancerFinder(args.cluster_name, session.client("elbv2", endpoint_url=args.endpoint_url))
+        if args.timeline:
+            os.makedirs(os.path.dirname(args.timeline) or ".", exist_ok=True)
+            result = finder.discover(args.targets, args.timeout, timeline(args.timeline, args.timeline_script))
+        else:
+            result = finder.discover(args.targets, args.timeout)
+        log.info("API calls: %s", finder.calls)
+        print(json.dumps(asdict(result)))
+
+    elif args.command == "register":
+        registrar = TargetRegistrar(args.cluster_name, session.client("ec2", endpoint_url=args.endpoint_url),
+                                    session.client("elbv2", endpoint_url=args.endpoint_url))
+        ips = registrar.resolve_ips(args.instance_ids)
+        with open(args.nodes_file, "w") as f:
+            f.write(nodes_file(args.instance_ids, ips, args.hpc_domain))
+        groups = registrar.target_groups()
+        for prefix, arn in groups.items():
+            registrar.register(arn, [ips[i] for i in args.instance_ids])
+            log.info("registered %d targets with %s", len(ips), prefix)
+        print(json.dumps({"ips": ips, "target_groups": groups}))
+
+    elif args.command == "reconcile":
+        reconciler = Reconciler(args.cluster_name, args.hpc_domain, args.nodes_file, args.hosts_file or None,
+                                args.metrics_file, session.client("ec2", endpoint_url=args.endpoint_url),
+                                session.client("elbv2", endpoint_url=args.endpoint_url),
+                                hold_path=args.hold_file, confirm_passes=args.confirm_passes)
+        if args.once:
+            reconciler.step()
+            return 0
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+        reconciler.run(args.interval, stop)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
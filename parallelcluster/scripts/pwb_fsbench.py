@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""Storage benchmark of the access patterns of Workbench sessions on a mount.
+
+R session startup is dominated by metadata-heavy small-file I/O: `library()`
+looks up every package in each library path and reads a handful of small
+files (`DESCRIPTION`, `Meta/*.rds`, the lazy-load `R/<pkg>.rdx/.rdb`), with
+renv those are reached through the symlinks of the project library into the
+global cache (`/home/renv`, cf. install-pwb-config.sh). This builds such a
+cache of `--packages` installed packages below `<path>` and runs, with each
+number of `--workers` processes at the same time,
+
+    workload      one op is                                       like
+    write         create, write and close a package file          install.packages()
+    stat          stat() a package file or a missing path         .libPaths() lookups
+    open          open, read 4 KiB and close a package file       packageDescription()
+    read          read a package file entirely                    lazy loading
+    renv-link     symlink a package into a project library        renv::restore()
+    renv-load     load a package through the project library      library() with renv
+    stream-write  write 1 MiB sequentially, fsync at the end      suspending a session
+    stream-read   read 1 MiB sequentially                         resuming a session
+
+The result is printed as JSON: ops/s, MB/s and latency percentiles per
+workload and number of workers along with the file system type and mount
+options of `<path>`, so that runs against different mounts, layouts or
+FSx/EFS settings can be put side by side with `compare`:
+
+    python3 pwb_fsbench.py run /home --label fsx-scratch2 > home.json
+    python3 pwb_fsbench.py run /opt/rstudio --label efs-tls > opt.json
+    python3 pwb_fsbench.py run /dev/shm --label tmpfs > tmpfs.json
+    python3 pwb_fsbench.py compare home.json opt.json tmpfs.json
+
+`--acl` sets the default ACL of `/home/renv` on the cache first, and
+`--drop-caches` (root only) drops the page, dentry and inode caches before
+each reading workload to measure cold instead of warm starts. Everything is
+written below `<path>/pwb-fsbench-<host>-<pid>` and removed at the end unless
+`--keep` is given.
+"""
+
+import argparse
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger("pwb_fsbench")
+
+FORMAT = 1
+
+WORKLOADS = ["write", "stat", "open", "read", "renv-link", "renv-load", "stream-write", "stream-read"]
+
+# Workloads preceded by dropping the caches with --drop-caches
+READING = {"stat", "open", "read", "renv-load", "stream-read"}
+
+# Files of an installed R package and their typical size in bytes
+PACKAGE_FILES = {
+    "DESCRIPTION": 1500, "NAMESPACE": 2000, "INDEX": 1000,
+    "Meta/package.rds": 1200, "Meta/nsInfo.rds": 800, "Meta/Rd.rds": 4000, "Meta/hsearch.rds": 4000,
+    "Meta/links.rds": 1000, "Meta/features.rds": 150,
+    "R/{pkg}": 1000, "R/{pkg}.rdb": 200000, "R/{pkg}.rdx": 8000,
+    "help/AnIndex": 2000, "help/aliases.rds": 1000, "help/paths.rds": 1000,
+    "help/{pkg}.rdb": 100000, "help/{pkg}.rdx": 4000,
+    "html/00Index.html": 4000, "html/R.css": 1800,
+}
+
+# Share of packages with compiled code and the size of their shared object
+COMPILED_SHARE = 0.4
+COMPILED_SIZE = 500000
+
+# Files read by library() for each package
+LOADED_FILES = ["DESCRIPTION", "NAMESPACE", "Meta/package.rds", "Meta/nsInfo.rds", "R/{pkg}.rdx", "R/{pkg}.rdb"]
+
+# Layout of the renv cache and a project library, cf. renv::paths$cache()
+RENV_CACHE = "cache/v5/R-4.4/x86_64-pc-linux-gnu"
+RENV_LIBRARY = "renv/library/R-4.4/x86_64-pc-linux-gnu"
+
+# Default ACL of /home/renv, cf. install-pwb-config.sh
+RENV_ACL = ("user::rwx,group::rwx,mask::rwx,other::rwx,"
+            "default:user::rwx,default:group::rwx,default:mask::rwx,default:other::rwx")
+
+CHUNK = 1 << 20
+
+
+@functools.lru_cache(maxsize=None)
+def payload() -> bytes:
+    return os.urandom(CHUNK)
+
+
+@dataclass
+class Fixture:
+    """A renv cache of installed packages below `root`."""
+    root: Path
+    packages: Dict[str, List[Tuple[str, int]]] = field(default_factory=dict)
+
+    @classmethod
+    def generate(cls, root: Path, packages: int, seed: int) -> "Fixture":
+        rng = random.Random(seed)
+        fixture = cls(root)
+        for n in range(packages):
+            pkg = f"pkg{n:04d}"
+            files = [(name.format(pkg=pkg), max(1, int(size * rng.uniform(0.5, 1.5))))
+                     for name, size in PACKAGE_FILES.items()]
+            if rng.random() < COMPILED_SHARE:
+                files.append((f"libs/{pkg}.so", int(COMPILED_SIZE * rng.uniform(0.2, 2.0))))
+            fixture.packages[pkg] = files
+        return fixture
+
+    def package_dir(self, pkg: str) -> Path:
+        return self.root / RENV_CACHE / pkg / "1.0.0" / f"{int(pkg[3:]):032x}" / pkg
+
+    def project_library(self, worker: int) -> Path:
+        return self.root / "projects" / f"w{worker}" / RENV_LIBRARY
+
+    def files(self) -> List[Tuple[Path, int]]:
+        return [(self.package_dir(pkg) / name, size) for pkg, files in self.packages.items() for name, size in files]
+
+    @property
+    def bytes(self) -> int:
+        return sum(size for files in self.packages.values() for _, size in files)
+
+    def build(self, threads: int):
+        def install(pkg: str):
+            write_package(self.package_dir(pkg), self.packages[pkg])
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(install, self.packages))
+
+
+@dataclass
+class Options:
+    passes: int = 3
+    write_packages: int = 20
+    stream_mb: int = 64
+    fsync: bool = False
+
+
+@dataclass
+class Sample:
+    """Timings of one worker process."""
+    started: float = 0.0
+    finished: float = 0.0
+    bytes: int = 0
+    latencies: List[float] = field(default_factory=list)
+
+
+def write_file(path: Path, size: int, fsync: bool = False):
+    data = memoryview(payload())
+    with open(path, "wb") as f:
+        while size > 0:
+            size -= f.write(data[:min(size, len(data))])
+        if fsync:
+            os.fsync(f.fileno())
+
+
+def read_file(path: Path, buffer: bytearray, limit: Optional[int] = None) -> int:
+    total = 0
+    with open(path, "rb", buffering=0) as f:
+        view = memoryview(buffer)[:limit] if limit else buffer
+        while True:
+            n = f.readinto(view)
+            total += n
+            if not n or limit:
+                return total
+
+
+def write_package(target: Path, files: List[Tuple[str, int]], fsync: bool = False,
+                  sample: Optional[Sample] = None):
+    """Install into a lock directory and move it into place, as R CMD INSTALL does."""
+    staging = target.parent / f"00LOCK-{target.name}"
+    for name, size in files:
+        path = staging / name
+        started = time.perf_counter()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_file(path, size, fsync)
+        if sample is not None:
+            sample.latencies.append(time.perf_counter() - started)
+            sample.bytes += size
+    os.rename(staging, target)
+
+
+# ------------------------------------------------------------------------------
+# Workloads, run in worker processes
+# ------------------------------------------------------------------------------
+
+def do_write(fixture: Fixture, worker: int, options: Options, sample: Sample):
+    root = fixture.root / "write" / f"w{worker}"
+    for pkg in list(fixture.packages)[:options.write_packages]:
+        root.mkdir(parents=True, exist_ok=True)
+        write_package(root / pkg, fixture.packages[pkg], options.fsync, sample)
+
+
+def do_stat(fixture: Fixture, worker: int, options: Options, sample: Sample):
+    missing = fixture.root / "site-library"
+    for _ in range(options.passes):
+        for pkg, files in fixture.packages.items():
+            started = time.perf_counter()
+            try:
+                os.stat(missing / pkg / "DESCRIPTION")
+            except FileNotFoundError:
+                pass
+            sample.latencies.append(time.perf_counter() - started)
+            base = fixture.package_dir(pkg)
+            for name, _ in files:
+                started = time.perf_counter()
+                os.stat(base / name)
+                sample.latencies.append(time.perf_counter() - started)
+
+
+def do_open(fixture: Fixture, worker: int, options: Options, sample: Sample):
+    buffer = bytearray(4096)
+    files = fixture.files()
+    for _ in range(options.passes):
+        for path, _ in files:
+            started = time.perf_counter()
+            sample.bytes += read_file(path, buffer, len(buffer))
+            sample.latencies.append(time.perf_counter() - started)
+
+
+def do_read(fixture: Fixture, worker: int, options: Options, sample: Sample):
+    buffer = bytearray(CHUNK)
+    files = fixture.files()
+    for _ in range(options.passes):
+        for path, _ in files:
+            started = time.perf_counter()
+            sample.bytes += read_file(path, buffer)
+            sample.latencies.append(time.perf_counter() - started)
+
+
+def link_project(fixture: Fixture, worker: int, sample: Optional[Sample] = None):
+    library = fixture.project_library(worker)
+    if library.exists():
+        shutil.rmtree(library)
+    library.mkdir(parents=True)
+    for pkg in fixture.packages:
+        started = time.perf_counter()
+        os.symlink(fixture.package_dir(pkg), library / pkg)
+        if sample is not None:
+            sample.latencies.append(time.perf_counter() - started)
+
+
+def do_renv_link(fixture: Fixture, worker: int, options: Options, sample: Sample):
+    link_project(fixture, worker, sample)
+
+
+def do_renv_load(fixture: Fixture, worker: int, options: Options, sample: Sample):
+    library = fixture.project_library(worker)
+    buffer = bytearray(CHUNK)
+    for _ in range(options.passes):
+        for pkg in fixture.packages:
+            started = time.perf_counter()
+            os.stat(library / pkg)
+            for name in LOADED_FILES:
+                sample.bytes += read_file(library / pkg / name.format(pkg=pkg), buffer)
+            sample.latencies.append(time.perf_counter() - started)
+
+
+def do_stream_write(fixture: Fixture, worker: int, options: Options, sample: Sample):
+    path = fixture.root / "stream" / f"w{worker}"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = payload()
+    with open(path, "wb") as f:
+        for _ in range(options.stream_mb):
+            started = time.perf_counter()
+            sample.bytes += f.write(data)
+            sample.latencies.append(time.perf_counter() - started)
+        os.fsync(f.fileno())
+
+
+def do_stream_read(fixture: Fixture, worker: int, options: Options, sample: Sample):
+    buffer = bytearray(CHUNK)
+    with open(fixture.root / "stream" / f"w{worker}", "rb", buffering=0) as f:
+        while True:
+            started = time.perf_counter()
+            n = f.readinto(buffer)
+            if not n:
+                break
+            sample.bytes += n
+            sample.latencies.append(time.perf_counter() - started)
+
+
+WORKLOAD_FUNCTIONS = {
+    "write": do_write, "stat": do_stat, "open": do_open, "read": do_read, "renv-link": do_renv_link,
+    "renv-load": do_renv_load, "stream-write": do_stream_write, "stream-read": do_stream_read,
+}
+
+_barrier = None
+
+
+def _init_worker(barrier):
+    global _barrier
+    _barrier = barrier
+
+
+def _run_worker(workload: str, fixture: Fixture, worker: int, options: Options) -> Sample:
+    # every process takes exactly one task and all of them start together
+    _barrier.wait()
+    sample = Sample(started=time.monotonic())
+    WORKLOAD_FUNCTIONS[workload](fixture, worker, options, sample)
+    sample.finished = time.monotonic()
+    return sample
+
+
+# ------------------------------------------------------------------------------
+# Runner
+# ------------------------------------------------------------------------------
+
+def percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def summarize(workload: str, workers: int, samples: List[Sample]) -> dict:
+    latencies = sorted(v for s in samples for v in s.latencies)
+    seconds = max(s.finished for s in samples) - min(s.started for s in samples)
+    nbytes = sum(s.bytes for s in samples)
+    return {
+        "workload": workload, "workers": workers, "ops": len(latencies), "seconds": round(seconds, 4),
+        "ops_s": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "mb_s": round(nbytes / seconds / 1e6, 2) if seconds else 0.0,
+        "latency_ms": {name: round(percentile(latencies, q) * 1000, 4)
+                       for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))},
+    }
+
+
+def prepare(workload: str, fixture: Fixture, workers: int, options: Options):
+    """Untimed setup and cleanup so that each workload starts from the same state."""
+    if workload == "write":
+        shutil.rmtree(fixture.root / "write", ignore_errors=True)
+    elif workload == "renv-load":
+        for worker in range(workers):
+            if not fixture.project_library(worker).exists():
+                link_project(fixture, worker)
+    elif workload == "stream-read":
+        for worker in range(workers):
+            path = fixture.root / "stream" / f"w{worker}"
+            if not path.exists() or path.stat().st_size < options.stream_mb * CHUNK:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                write_file(path, options.stream_mb * CHUNK)
+
+
+def drop_caches() -> bool:
+    os.sync()
+    try:
+        Path("/proc/sys/vm/drop_caches").write_text("3\n")
+        return True
+    except OSError as e:
+        log.warning("cannot drop caches: %s", e)
+        return False
+
+
+def run_workload(workload: str, fixture: Fixture, workers: int, options: Options, cold: bool) -> dict:
+    prepare(workload, fixture, workers, options)
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(workers)
+    with context.Pool(workers, initializer=_init_worker, initargs=(barrier,)) as pool:
+        if cold and workload in READING:
+            drop_caches()
+        samples = pool.starmap(_run_worker, [(workload, fixture, w, options) for w in range(workers)], chunksize=1)
+    result = summarize(workload, workers, samples)
+    log.info("%-12s %3d workers  %10.1f ops/s %9.2f MB/s  p99 %8.3f ms", workload, workers, result["ops_s"],
+             result["mb_s"], result["latency_ms"]["p99"])
+    return result
+
+
+def unescape(value: str) -> str:
+    return value.encode().decode("unicode_escape")
+
+
+def mount_of(path: Path, mountinfo: Path = Path("/proc/self/mountinfo")) -> dict:
+    """File system type, source and options of the mount `path` is on."""
+    path = str(path.resolve())
+    best = {}
+    try:
+        lines = mountinfo.read_text().splitlines()
+    except OSError:
+        return best
+    for line in lines:
+        fields = line.split()
+        sep = fields.index("-")
+        mount = unescape(fields[4])
+        if (path == mount or path.startswith(mount.rstrip("/") + "/")) and len(mount) >= len(best.get("mount", "")):
+            best = {"mount": mount, "type": fields[sep + 1], "source": unescape(fields[sep + 2]),
+                    "options": fields[5] + "," + fields[sep + 3]}
+    return best
+
+
+def run(args) -> dict:
+    root = args.path / f"pwb-fsbench-{socket.gethostname()}-{os.getpid()}"
+    root.mkdir(parents=True)
+    filesystem = mount_of(root)
+    options = Options(args.passes, args.write_packages, args.stream_mb, args.fsync)
+    fixture = Fixture.generate(root, args.packages, args.seed)
+    try:
+        if args.acl:
+            subprocess.run(["setfacl", "--set", RENV_ACL, str(root)], check=True)
+        started = time.monotonic()
+        fixture.build(max(args.workers))
+        setup = time.monotonic() - started
+        log.info("%d packages, %d files, %.1f MB in %.1f s below %s (%s)", len(fixture.packages),
+                 len(fixture.files()), fixture.bytes / 1e6, setup, root, filesystem.get("type", "unknown"))
+        results = [run_workload(workload, fixture, workers, options, args.drop_caches)
+                   for workload in args.workloads for workers in args.workers]
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    return {
+        "format": FORMAT,
+        "label": args.label or f"{filesystem.get('type', 'unknown')}:{args.path}",
+        "host": socket.gethostname(),
+        "path": str(args.path),
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "filesystem": filesystem,
+        "params": {"packages": len(fixture.packages), "files": len(fixture.files()), "bytes": fixture.bytes,
+                   "passes": options.passes, "write_packages": options.write_packages,
+                   "stream_mb": options.stream_mb, "fsync": options.fsync, "acl": args.acl,
+                   "drop_caches": args.drop_caches, "seed": args.seed},
+        "setup_seconds": round(setup, 3),
+        "results": results,
+    }
+
+
+def compare(reports: List[dict]) -> str:
+    """Table of the results of several runs, relative to the first one."""
+    for report in reports[1:]:
+        if report["params"] != reports[0]["params"]:
+            log.warning("%s was run with different parameters than %s", report["label"], reports[0]["label"])
+    rows = {}
+    for n, report in enumerate(reports):
+        for result in report["results"]:
+            rows.setdefault((result["workload"], result["workers"]), {})[n] = result
+    width = max(len(r["label"]) for r in reports)
+    lines = [f"{'workload':<13} {'workers':>7}  {'label':<{width}} {'ops/s':>11} {'MB/s':>9} {'p50 ms':>9} "
+             f"{'p99 ms':>9} {'vs first':>9}"]
+    for (workload, workers), results in rows.items():
+        base = results.get(0)
+        for n, report in enumerate(reports):
+            result = results.get(n)
+            head = f"{workload:<13} {workers:>7}" if n == 0 else " " * 21
+            if result is None:
+                lines.append(f"{head}  {report['label']:<{width}} {'-':>11}")
+                continue
+            relative = f"{result['ops_s'] / base['ops_s']:>8.2f}x" if base and base["ops_s"] else f"{'-':>9}"
+            lines.append(f"{head}  {report['label']:<{width}} {result['ops_s']:>11.1f} {result['mb_s']:>9.2f} "
+                         f"{result['latency_ms']['p50']:>9.3f} {result['latency_ms']['p99']:>9.3f} {relative}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("run", help="run the workloads below a path and print the results as JSON")
+    bench.add_argument("path", type=Path, help="directory on the mount to test, e.g. /home or /dev/shm")
+    bench.add_argument("--label", help="name of the run in compare (default: <fstype>:<path>)")
+    bench.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=WORKLOADS)
+    bench.add_argument("--workers", type=int, nargs="+", default=[1, 8], help="processes running at the same time")
+    bench.add_argument("--packages", type=int, default=150, help="packages in the renv cache")
+    bench.add_argument("--passes", type=int, default=3, help="passes over the packages of the reading workloads")
+    bench.add_argument("--write-packages", type=int, default=20, help="packages installed by each writer")
+    bench.add_argument("--stream-mb", type=int, default=64, help="MiB written and read by each streaming worker")
+    bench.add_argument("--fsync", action="store_true", help="fsync every file of the write workload")
+    bench.add_argument("--acl", action="store_true", help="set the default ACL of /home/renv on the cache")
+    bench.add_argument("--drop-caches", action="store_true", help="drop the kernel caches before reading (root)")
+    bench.add_argument("--seed", type=int, default=1, help="seed of the package file sizes")
+    bench.add_argument("--keep", action="store_true", help="keep the files written below the path")
+    bench.add_argument("--output", type=Path, help="write the JSON to this file instead of stdout")
+    table = sub.add_parser("compare", help="compare the JSON results of several runs")
+    table.add_argument("reports", type=Path, nargs="+")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s %(name)s %(message)s")
+
+    if args.command == "compare":
+        print(compare([json.loads(path.read_text()) for path in args.reports]))
+        return 0
+
+    if min(args.workers) < 1:
+        parser.error("--workers must be at least 1")
+    if not args.path.is_dir():
+        parser.error(f"{args.path} is not a directory")
+    try:
+        report = run(args)
+    except (OSError, subprocess.CalledProcessError) as e:
+        log.error("%s", e)
+        return 1
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""Log shipper for the Workbench and launcher logs of the login nodes.
+
+Tails `/var/log/rstudio/**/*.log`, batches the lines as JSON records
+(`time`, `host`, `file`, `line`) and writes each batch gzip-compressed into a
+central store, partitioned by UTC date and hour:
+
+    <store>/dt=2024-05-01/hour=13/<host>-<epoch ms>-<seq>.jsonl.gz
+
+The store is a prefix in the S3 bucket of the stack (`s3://<bucket>/logs`) or
+a local directory. The read offset of every file is kept in `--state` and only
+advanced once a batch is stored, a restart ships from there again (at least
+once). Files truncated in place (logrotate `copytruncate`) are read from the
+start again, files renamed by a rotation are read to their end before the new
+file is picked up. Hence logrotate no longer needs to stop rstudio-server and
+rstudio-launcher. Lines written between the last read and a `copytruncate`
+are picked up from the rotated copy (`<file>.1`, uncompressed thanks to
+`delaycompress`).
+
+Memory is bounded: at most `--max-batch-bytes` of lines are buffered, reading
+stops while the store is not reachable, and lines longer than `--max-line`
+bytes are cut.
+
+    python3 pwb_logship.py run --store s3://<BUCKET>/logs   # cf. pwb-logship.service
+    python3 pwb_logship.py once --store /tmp/logs           # single pass and flush
+
+Set `--endpoint-url` (or `AWS_ENDPOINT_URL`) to run against a local stand-in
+such as `moto_server`.
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+log = logging.getLogger("pwb_logship")
+
+PATTERNS = ["/var/log/rstudio/**/*.log"]
+
+STATE_FILE = "/var/lib/pwb-logship/offsets.json"
+
+
+class DirectoryStore:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def put(self, key: str, data: bytes):
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".pwb_logship.")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def __str__(self):
+        return str(self.root)
+
+
+class S3Store:
+    def __init__(self, bucket: str, prefix: str, endpoint_url: Optional[str] = None, client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        if client is None:
+            import boto3
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.s3 = client
+
+    def put(self, key: str, data: bytes):
+        self.s3.put_object(Bucket=self.bucket, Key=f"{self.prefix}/{key}" if self.prefix else key, Body=data,
+                           ContentType="application/x-ndjson", ContentEncoding="gzip")
+
+    def __str__(self):
+        return f"s3://{self.bucket}/{self.prefix}"
+
+
+def make_store(spec: str, endpoint_url: Optional[str] = None):
+    if spec.startswith("s3://"):
+        bucket, _, prefix = spec[len("s3://"):].partition("/")
+        return S3Store(bucket, prefix, endpoint_url)
+    return DirectoryStore(Path(spec))
+
+
+@dataclass
+class Tail:
+    """A log file read from `offset`, `pending` is read but not yet stored."""
+    path: str
+    inode: int
+    offset: int = 0
+    pending: int = 0
+    partial: bytes = b""
+    handle: Optional[object] = None
+    # name in the records, the rotated copy of a file is shipped under the original name
+    file: Optional[str] = None
+
+    def open(self):
+        if self.handle is None:
+            self.handle = open(self.path, "rb")
+            if os.fstat(self.handle.fileno()).st_ino != self.inode:
+                self.handle.close()
+                self.handle = None
+                raise FileNotFoundError(self.path)
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+
+class Shipper:
+    def __init__(self, store, patterns: Sequence[str] = tuple(PATTERNS), state_path: Optional[str] = STATE_FILE,
+                 host: Optional[str] = None, max_batch_bytes: int = 4 << 20, max_batch_age: float = 10.0,
+                 chunk_size: int = 64 << 10, max_line: int = 16 << 10, clock=time.time):
+        self.store = store
+        self.patterns = list(patterns)
+        self.state_path = state_path
+        self.host = host or socket.gethostname()
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_age = max_batch_age
+        self.chunk_size = chunk_size
+        self.max_line = max_line
+        self.clock = clock
+        self.tails: Dict[str, Tail] = {}
+        self.retired: List[Tail] = []
+        self.batch: List[bytes] = []
+        self.batch_bytes = 0
+        self.batch_started: Optional[float] = None
+        self.seq = 0
+        self.stats = {"lines": 0, "bytes": 0, "objects": 0, "stored_bytes": 0, "truncations": 0,
+                      "rotations": 0, "store_errors": 0, "peak_batch_bytes": 0}
+        self.offsets = self._load_state()
+
+    def _load_state(self) -> Dict[str, dict]:
+        if not self.state_path:
+            return {}
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        state = {t.path: {"inode": t.inode, "offset": t.offset} for t in self.tails.values()}
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.state_path)), prefix=".pwb_logship.")
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_path)
+
+    def scan(self):
+        """Pick up new files and notice truncated, rotated or removed ones."""
+        paths = {p for pattern in self.patterns for p in glob.glob(pattern, recursive=True)}
+        for path in paths | set(self.tails):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                st = None
+            tail = self.tails.get(path)
+            if tail is not None and (st is None or st.st_ino != tail.inode):
+                # renamed (or removed) by a rotation, the open handle still reads the old file
+                self.retired.append(self.tails.pop(path))
+                self.stats["rotations"] += 1
+                tail = None
+            if st is None:
+                continue
+            if tail is None:
+                known = self.offsets.pop(path, None)
+                offset = known["offset"] if known and known["inode"] == st.st_ino else 0
+                tail = self.tails[path] = Tail(path, st.st_ino, offset, offset)
+            if st.st_size < tail.pending:
+                log.info("%s was truncated, reading it from the start", path)
+                self.stats["truncations"] += 1
+                self._read_copy(tail)
+                tail.pending = 0
+                tail.partial = b""
+                tail.offset = 0
+
+    def _read_copy(self, tail: Tail):
+        """Read the rest of a truncated file from the copy logrotate made right before."""
+        copies = []
+        for candidate in glob.glob(glob.escape(tail.path) + ".*"):
+            st = os.stat(candidate)
+            if not candidate.endswith(".gz") and st.st_size >= tail.pending:
+                copies.append((st.st_mtime, candidate, st.st_ino))
+        if copies:
+            _, candidate, inode = max(copies)
+            self.retired.append(Tail(candidate, inode, tail.pending, tail.pending, tail.partial,
+                                     file=tail.file or tail.path))
+
+    def _append(self, tail: Tail, line: bytes, now: float):
+        record = json.dumps({"time": now, "host": self.host, "file": tail.file or tail.path,
+                             "line": line[:self.max_line].decode("utf-8", "replace")}).encode() + b"\n"
+        if self.batch_started is None:
+            self.batch_started = now
+        self.batch.append(record)
+        self.batch_bytes += len(record)
+        self.stats["lines"] += 1
+
+    def read(self, tail: Tail) -> int:
+        """Read complete lines of `tail` into the batch as long as there is room, return bytes read."""
+        try:
+            tail.open()
+        except FileNotFoundError:
+            return 0
+        total = 0
+        while self.batch_bytes < self.max_batch_bytes:
+            tail.handle.seek(tail.pending)
+            data = tail.handle.read(min(self.chunk_size, self.max_batch_bytes - self.batch_bytes))
+            if not data:
+                break
+            tail.pending += len(data)
+            total += len(data)
+            now = self.clock()
+            lines = (tail.partial + data).split(b"\n")
+            tail.partial = lines.pop()
+            if len(tail.partial) > self.max_line:
+                lines.append(tail.partial)
+                tail.partial = b""
+            for line in lines:
+                self._append(tail, line, now)
+        self.stats["bytes"] += total
+        self.stats["peak_batch_bytes"] = max(self.stats["peak_batch_bytes"], self.batch_bytes)
+        return total
+
+    def due(self) -> bool:
+        return bool(self.batch) and (self.batch_bytes >= self.max_batch_bytes
+                                     or self.clock() - self.batch_started >= self.max_batch_age)
+
+    def flush(self) -> bool:
+        """Store the batch and advance the offsets, False if the store failed."""
+        if not self.batch:
+            return True
+        started = datetime.fromtimestamp(self.batch_started, timezone.utc)
+        key = (f"dt={started:%Y-%m-%d}/hour={started:%H}/"
+               f"{self.host}-{int(self.batch_started * 1000)}-{self.seq:06d}.jsonl.gz")
+        data = gzip.compress(b"".join(self.batch), compresslevel=6)
+        try:
+            self.store.put(key, data)
+        except Exception:
+            log.exception("storing %s in %s failed, keeping %d lines", key, self.store, len(self.batch))
+            self.stats["store_errors"] += 1
+            return False
+        self.seq += 1
+        self.stats["objects"] += 1
+        self.stats["stored_bytes"] += len(data)
+        self.batch, self.batch_bytes, self.batch_started = [], 0, None
+        # complete lines only, a partial line is read again next time
+        for tail in self.tails.values():
+            tail.offset = tail.pending - len(tail.partial)
+        self._save_state()
+        return True
+
+    def finish(self, tail: Tail) -> bool:
+        """Whether a retired file has been read completely, its last line may lack the newline."""
+        if tail.handle is not None and os.fstat(tail.handle.fileno()).st_size > tail.pending:
+            return False
+        if tail.partial:
+            self._append(tail, tail.partial, self.clock())
+            tail.partial = b""
+        tail.close()
+        return True
+
+    def step(self) -> int:
+        """One pass over all files, storing batches as they fill up. Returns bytes read."""
+        self.scan()
+        total = 0
+        for tail in self.retired + list(self.tails.values()):
+            while True:
+                read = self.read(tail)
+                total += read
+                if self.batch_bytes < self.max_batch_bytes:
+                    break
+                if not self.flush():
+                    return total
+        self.retired = [t for t in self.retired if not self.finish(t)]
+        if self.due():
+            self.flush()
+        return total
+
+    def run(self, interval: float, stop: threading.Event):
+        backoff = interval
+        while not stop.is_set():
+            self.step()
+            # back off while the store fails, the batch is full then and nothing is read
+            backoff = min(backoff * 2, 60.0) if self.batch_bytes >= self.max_batch_bytes else interval
+            stop.wait(backoff)
+        self.flush()
+        for tail in list(self.tails.values()) + self.retired:
+            tail.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoint-url", help="S3 endpoint, e.g. a local moto server")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("run", "once"):
+        action = sub.add_parser(name, help="ship continuously" if name == "run" else "one pass and flush")
+        action.add_argument("--store", required=True, help="s3://<bucket>/<prefix> or a local directory")
+        action.add_argument("--pattern", action="append", help=f"log files to ship (default: {PATTERNS[0]})")
+        action.add_argument("--state", default=STATE_FILE, help="file keeping the shipped offsets")
+        action.add_argument("--host", default=socket.gethostname())
+        action.add_argument("--interval", type=float, default=1.0, help="seconds between passes")
+        action.add_argument("--max-batch-bytes", type=int, default=4 << 20)
+        action.add_argument("--max-batch-age", type=float, default=10.0, help="seconds before a batch is stored")
+        action.add_argument("--max-line", type=int, default=16 << 10, help="longer lines are cut")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s %(name)s %(message)s")
+    shipper = Shipper(make_store(args.store, args.endpoint_url), args.pattern or PATTERNS, args.state, args.host,
+                      args.max_batch_bytes, args.max_batch_age, max_line=args.max_line)
+    if args.command == "once":
+        shipper.step()
+        ok = shipper.flush()
+        print(json.dumps(shipper.stats))
+        return 0 if ok else 1
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    shipper.run(args.interval, stop)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
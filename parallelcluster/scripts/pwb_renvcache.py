@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""Warm the global renv cache from the pkg.lock files of the R versions of the image.
+
+run.R installs the packages Workbench needs into the site library of every R
+version (`/opt/R/<version>/lib/R/site-library`) and records them in a pak
+`pkg.lock` there, while renv points to the global cache in `/home/renv`
+(`RENV_PATHS_CACHE`), which install-pwb-config.sh only creates. So the first
+`renv::restore()` of every user and R version downloads and installs all of
+these packages again. This copies the packages of every `pkg.lock` from the
+site library into renv's cache layout
+
+    <cache>/v5/<os prefix>/R-<x.y>/<platform>/<package>/<version>/<hash>/<package>
+
+with one thread per package (`--jobs`) that copies it for one R version after
+the other, `<hash>` being renv's hash of the
+DESCRIPTION file. renv then links these packages into the project libraries
+instead of installing them.
+
+The hash is computed here as renv does, and checked against the one of
+`renv:::renv_hash_description()` by one Rscript call per R version that has
+renv in its site library (`/opt/R/<version>/bin/Rscript`, `--no-verify` to
+skip it). renv's hash is used for the packages where they differ, which are
+listed per R version (mismatches).
+
+A file with the same path, size and content as in the same package version
+already in the cache for another R version is hardlinked to it instead of
+copied, so identical package builds shared by several R versions take the
+space of one. Only files of the same size are read to compare them, all others
+are copied straight away. A package is copied to `<cache>/.warm/staging` first
+and renamed into place, so renv never sees a partial copy. A rerun skips the
+packages already in the cache and links to them, i.e. only new packages or R
+versions are copied.
+
+    python3 pwb_renvcache.py warm                # all /opt/R/*/lib/R/site-library/pkg.lock
+    python3 pwb_renvcache.py warm --cache /tmp/renv /opt/R/4.4.3/lib/R/site-library/pkg.lock
+
+Prints a JSON summary per R version: packages already in the cache (hits),
+copied (warmed) and listed in `pkg.lock` but not installed (missing), the hit
+rate among the installed packages, the hashes checked against renv's
+(verified, mismatches), and the bytes written compared to the size of the
+warmed packages.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger("pwb_renvcache")
+
+LOCK_FILES = "/opt/R/*/lib/R/site-library/pkg.lock"
+
+CACHE = "/home/renv"
+
+# renv_cache_version()
+CACHE_VERSION = "v5"
+
+# DESCRIPTION fields hashed by renv, cf. renv_hash_description()
+HASH_FIELDS = ["Package", "Version", "Title", "Author", "Maintainer", "Description", "Depends", "Imports",
+               "Suggests", "LinkingTo"]
+
+# [[:space:]] removed from the field values before hashing
+WHITESPACE = re.compile(r"\s")
+
+# Source or RemoteType of the packages renv treats as CRAN-like, cf. renv_record_cranlike()
+CRAN_LIKE = ("cran", "repository", "standard", "bioconductor", "bioc")
+
+# Prints "<path>\t<hash>" for the DESCRIPTION files given as arguments
+RENV_HASH = ('if (requireNamespace("renv", quietly = TRUE)) for (path in commandArgs(TRUE)) '
+             'cat(path, "\\t", renv:::renv_hash_description(path), "\\n", sep = "")')
+
+CHUNK = 1 << 20
+
+
+def read_dcf(path: Path) -> Dict[str, str]:
+    """Fields of a DESCRIPTION file, continuation lines joined by newlines."""
+    raw = path.read_bytes()
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        text = raw.decode("latin-1")
+    fields: Dict[str, str] = {}
+    last = None
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if line[0] in " \t" and last:
+            fields[last] += "\n" + line.strip()
+        else:
+            last, _, value = line.partition(":")
+            fields[last] = value.strip()
+    return fields
+
+
+def remote_fields(description: Dict[str, str]) -> List[str]:
+    """Remote* fields hashed by renv, sorted, none for CRAN-like packages, cf. renv_hash_fields_remotes()."""
+    source = description.get("Source") or description.get("RemoteType") or "unknown"
+    if source.lower() in CRAN_LIKE and len(description.get("RemoteSha", "")) < 40:
+        return []
+    # ^Remote(?!s), i.e. not the Remotes field of the package sources
+    remotes = [k for k in description if k.startswith("Remote") and not k.startswith("Remotes")]
+    if description.get("RemoteRef") == "HEAD":
+        remotes.remove("RemoteRef")
+    # R sorts in the collation of the locale, the same order for these names
+    return sorted(remotes, key=lambda k: (k.lower(), k))
+
+
+def renv_hash(description: Dict[str, str]) -> str:
+    """md5 of the relevant DESCRIPTION fields without whitespace, as renv computes it."""
+    names = [k for k in HASH_FIELDS + remote_fields(description) if k in description]
+    contents = "\n".join(f"{k}: {WHITESPACE.sub('', description[k])}" for k in names)
+    return hashlib.md5((contents + "\n").encode("utf-8")).hexdigest()
+
+
+def os_prefix(os_release: Path = Path("/etc/os-release")) -> str:
+    """Prefix of RENV_PATHS_PREFIX_AUTO (set by run.R), e.g. linux-ubuntu-noble."""
+    values = {}
+    try:
+        for line in os_release.read_text().splitlines():
+            key, sep, value = line.partition("=")
+            if sep and not key.startswith("#"):
+                values[key.strip()] = value.strip().strip("\"'")
+    except OSError:
+        pass
+    distribution = next((values[k] for k in ("ID", "ID_LIKE") if values.get(k)), "unknown")
+    version = next((values[k] for k in ("UBUNTU_CODENAME", "VERSION_CODENAME", "VERSION_ID", "BUILD_ID")
+                    if values.get(k)), "unknown")
+    return f"{platform.system().lower()}-{distribution}-{version}"
+
+
+def same_content(a: Path, b: Path) -> bool:
+    """Whether two files of the same size are equal, read up to the first difference."""
+    with open(a, "rb") as fa, open(b, "rb") as fb:
+        while True:
+            chunk = fa.read(CHUNK)
+            if chunk != fb.read(CHUNK):
+                return False
+            if not chunk:
+                return True
+
+
+def renv_hashes(rscript: Path, descriptions: List[Path]) -> Dict[str, str]:
+    """Hashes of DESCRIPTION files by renv itself, none if renv or the R version are not there."""
+    if not rscript.is_file() or not descriptions:
+        return {}
+    try:
+        result = subprocess.run([str(rscript), "-e", RENV_HASH, *map(str, descriptions)], capture_output=True,
+                                text=True, timeout=600, check=True)
+    except (OSError, subprocess.SubprocessError) as e:
+        log.warning("%s: cannot verify the hashes with renv: %s", rscript, e)
+        return {}
+    hashes = {}
+    for line in result.stdout.splitlines():
+        path, sep, digest = line.rpartition("\t")
+        if sep:
+            hashes[path] = digest.strip()
+    return hashes
+
+
+@dataclass
+class VersionStats:
+    r_version: str
+    lock: str
+    cache: str
+    packages: int = 0
+    hits: int = 0
+    warmed: int = 0
+    missing: List[str] = field(default_factory=list)
+    verified: int = 0
+    mismatches: List[str] = field(default_factory=list)
+    files_copied: int = 0
+    files_linked: int = 0
+    bytes_warmed: int = 0
+    bytes_written: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of the installed packages that were in the cache already."""
+        installed = self.packages - len(self.missing)
+        return self.hits / installed if installed else 1.0
+
+    @property
+    def savings(self) -> float:
+        return 1 - self.bytes_written / self.bytes_warmed if self.bytes_warmed else 0.0
+
+
+@dataclass
+class Job:
+    package: str
+    version: str
+    source: Path
+    stats: VersionStats
+    # renv:::renv_hash_description() of the installed DESCRIPTION
+    expected: Optional[str] = None
+
+
+class Warmer:
+    def __init__(self, cache: Path, prefix: Optional[str] = None, machine: Optional[str] = None):
+        self.cache = Path(cache)
+        self.prefix = os_prefix() if prefix is None else prefix
+        self.machine = machine or platform.machine()
+        self.staging = self.cache / ".warm" / "staging"
+        self.lock = threading.Lock()
+
+    def platform_dir(self, r_version: str) -> Path:
+        """Cache of an R version, cf. renv::paths$cache()."""
+        components = [self.prefix] if self.prefix else []
+        components += ["R-" + ".".join(r_version.split(".")[:2]), f"{self.machine}-pc-linux-gnu"]
+        return self.cache.joinpath(CACHE_VERSION, *components)
+
+    def jobs(self, lock: Path) -> List[Job]:
+        """Packages of a pkg.lock, next to the site library they were installed into by run.R."""
+        data = json.loads(lock.read_text())
+        library = lock.parent
+        # /opt/R/<version>/lib/R/site-library/pkg.lock
+        r_version = library.parents[2].name if re.match(r"^\d+\.\d+", library.parents[2].name) \
+            else data.get("r_version", "unknown")
+        stats = VersionStats(r_version, str(lock), str(self.platform_dir(r_version)))
+        jobs = []
+        for record in data.get("packages", []):
+            stats.packages += 1
+            jobs.append(Job(record["package"], record["version"], library / record["package"], stats))
+        return jobs
+
+    def verify(self, jobs: List[Job], rscript: Path):
+        """Hashes of the installed packages computed by renv of their R version."""
+        descriptions = {str(job.source / "DESCRIPTION"): job for job in jobs
+                        if (job.source / "DESCRIPTION").is_file()}
+        for path, digest in renv_hashes(rscript, [Path(p) for p in descriptions]).items():
+            if path in descriptions:
+                descriptions[path].expected = digest
+
+    def copy(self, source: str, destination: str, peers: List[str], stats: VersionStats) -> int:
+        """Copies a package directory, files equal to the one of a peer in the cache hardlinked to it.
+
+        Returns the size of the files.
+        """
+        os.mkdir(destination)
+        size = 0
+        with os.scandir(source) as entries:
+            for entry in entries:
+                target = os.path.join(destination, entry.name)
+                if entry.is_symlink():
+                    os.symlink(os.readlink(entry.path), target)
+                elif entry.is_dir():
+                    size += self.copy(entry.path, target, [os.path.join(p, entry.name) for p in peers], stats)
+                else:
+                    st = entry.stat()
+                    size += st.st_size
+                    if not any(self.link(entry.path, st, os.path.join(p, entry.name), target) for p in peers):
+                        shutil.copy2(entry.path, target)
+                        with self.lock:
+                            stats.files_copied += 1
+                            stats.bytes_written += st.st_size
+                        continue
+                    with self.lock:
+                        stats.files_linked += 1
+        return size
+
+    @staticmethod
+    def link(source: str, st: os.stat_result, peer: str, target: str) -> bool:
+        """Hardlinks the file of a peer if it has the same size, mode and content as `source`."""
+        try:
+            other = os.stat(peer)
+            if other.st_size != st.st_size or other.st_mode != st.st_mode or not same_content(source, peer):
+                return False
+            os.link(peer, target)
+        except OSError:
+            return False
+        return True
+
+    def warm(self, job: Job, peers: List[str]) -> Optional[Path]:
+        """Package in the cache, copied unless it is there already, None if it is not installed."""
+        stats = job.stats
+        description = job.source / "DESCRIPTION"
+        fields = read_dcf(description) if description.is_file() else {}
+        if fields.get("Version") != job.version:
+            # not installed by run.R, or another version
+            with self.lock:
+                stats.missing.append(job.package)
+            return None
+        digest = renv_hash(fields)
+        if job.expected:
+            with self.lock:
+                stats.verified += 1
+                if job.expected != digest:
+                    stats.mismatches.append(job.package)
+            if job.expected != digest:
+                log.warning("R %s: %s %s hashed as %s, renv has %s", stats.r_version, job.package, job.version,
+                            digest, job.expected)
+                digest = job.expected
+        target = self.platform_dir(stats.r_version) / job.package / job.version / digest / job.package
+        if target.exists():
+            with self.lock:
+                stats.hits += 1
+            return target
+
+        staging = self.staging / f"{job.package}-{uuid.uuid4().hex}"
+        self.staging.mkdir(parents=True, exist_ok=True)
+        size = self.copy(str(job.source), str(staging), peers, stats)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.rename(staging, target)
+        except OSError:
+            # put into place by a concurrent run
+            shutil.rmtree(staging, ignore_errors=True)
+            with self.lock:
+                stats.hits += 1
+            return target
+        with self.lock:
+            stats.warmed += 1
+            stats.bytes_warmed += size
+        return target
+
+    def warm_package(self, jobs: List[Job]):
+        """A package version for all R versions, linking to the copies for the previous ones."""
+        peers: List[str] = []
+        for job in jobs:
+            target = self.warm(job, peers)
+            # R versions of the same minor version share the cache, the last one is tried first
+            if target is not None and str(target) not in peers:
+                peers.insert(0, str(target))
+
+    def run(self, locks: List[Path], jobs: int = 8, verify: bool = True) -> List[VersionStats]:
+        work = []
+        for lock in locks:
+            version_jobs = self.jobs(lock)
+            if verify:
+                # /opt/R/<version>/lib/R/site-library/pkg.lock
+                self.verify(version_jobs, lock.parent.parents[2] / "bin" / "Rscript")
+            work += version_jobs
+        versions = list({id(job.stats): job.stats for job in work}.values())
+        packages: Dict[Tuple[str, str], List[Job]] = defaultdict(list)
+        for job in work:
+            packages[(job.package, job.version)].append(job)
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(self.warm_package, packages.values()))
+        for stats in versions:
+            log.info("R %s: %d packages, %d hits, %d warmed, %d missing, %d of %d hashes as renv's, "
+                     "%.1f MB written for %.1f MB", stats.r_version, stats.packages, stats.hits, stats.warmed,
+                     len(stats.missing), stats.verified - len(stats.mismatches), stats.verified,
+                     stats.bytes_written / 1e6, stats.bytes_warmed / 1e6)
+        shutil.rmtree(self.staging, ignore_errors=True)
+        return versions
+
+
+def report(versions: List[VersionStats], seconds: float) -> dict:
+    result = {"versions": [], "seconds": round(seconds, 3)}
+    for stats in versions:
+        record = asdict(stats)
+        record["hit_rate"] = round(stats.hit_rate, 4)
+        record["savings"] = round(stats.savings, 4)
+        result["versions"].append(record)
+    packages = sum(v.packages for v in versions)
+    installed = packages - sum(len(v.missing) for v in versions)
+    warmed = sum(v.bytes_warmed for v in versions)
+    written = sum(v.bytes_written for v in versions)
+    result.update({
+        "packages": packages,
+        "hits": sum(v.hits for v in versions),
+        "warmed": sum(v.warmed for v in versions),
+        "missing": sum(len(v.missing) for v in versions),
+        "verified": sum(v.verified for v in versions),
+        "mismatches": sum(len(v.mismatches) for v in versions),
+        "hit_rate": round(sum(v.hits for v in versions) / installed, 4) if installed else 1.0,
+        "bytes_warmed": warmed,
+        "bytes_written": written,
+        "savings": round(1 - written / warmed, 4) if warmed else 0.0,
+    })
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    warm = sub.add_parser("warm", help="copy the packages of the lock files into the cache")
+    warm.add_argument("locks", type=Path, nargs="*", help=f"pkg.lock files (default: {LOCK_FILES})")
+    warm.add_argument("--cache", type=Path, default=Path(CACHE), help="RENV_PATHS_CACHE of the R versions")
+    warm.add_argument("--prefix", help="RENV_PATHS_PREFIX, '' for none (default: as RENV_PATHS_PREFIX_AUTO)")
+    warm.add_argument("--jobs", type=int, default=8, help="packages copied at the same time")
+    warm.add_argument("--no-verify", dest="verify", action="store_false",
+                      help="do not check the hashes against renv of the R versions")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s %(name)s %(message)s")
+    locks = args.locks or [Path(p) for p in sorted(glob.glob(LOCK_FILES))]
+    if not locks:
+        log.error("no pkg.lock files found")
+        return 1
+    started = time.monotonic()
+    try:
+        result = report(Warmer(args.cache, args.prefix).run(locks, args.jobs, args.verify), time.monotonic() - started)
+    except (OSError, ValueError) as e:
+        log.error("%s", e)
+        return 1
+    print(json.dumps(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
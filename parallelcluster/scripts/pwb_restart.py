@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""Rolling restart of Workbench on the login nodes, one wave after the other.
+
+Removing `/opt/rstudio/workbench-<host>.state` of every login node restarts
+Workbench everywhere at once (cf. pwb_agent.py), while the ALB keeps sending
+requests to nodes that are down. This restarts at most `--max-unavailable`
+nodes at a time instead. For each node of a wave it
+
+1. puts the node on hold, so that `pwb_alb.py reconcile` leaves it alone,
+2. deregisters it from the internal and external ALB target group and waits
+   until connection draining is over,
+3. removes its state file and waits for the agent to recreate it,
+4. waits until Workbench answers the ALB health check (`302`),
+5. registers it again, waits until it is healthy in both target groups and
+   releases the hold.
+
+The next wave starts once all nodes of the current wave are back. A node that
+does not come back stops the rollout. Timings per node and wave are printed as
+JSON.
+
+    python3 pwb_restart.py --cluster-name <CLUSTER> --max-unavailable 1
+
+Runs on the head node next to pwb_alb.py and pwb_agent.py. Set
+`--endpoint-url` (or `AWS_ENDPOINT_URL`) and `--root` to run against a local
+stand-in such as `moto_server`, cf. `benchmarks/rolling_restart.py`.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+
+import boto3
+import botocore.exceptions
+
+import pwb_agent
+import pwb_alb
+
+log = logging.getLogger("pwb_restart")
+
+HEALTH_URL = "http://{ip}:%d/" % pwb_alb.WORKBENCH_PORT
+
+# Status of the ALB health check, Workbench redirects to the sign-in page
+HEALTHY_STATUS = 302
+
+# Failed AWS calls, the node is reported as not restarted like on a timeout
+AWS_ERRORS = (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError)
+
+
+class RestartError(Exception):
+    pass
+
+
+@dataclass
+class LoginNode:
+    ip: str
+    hostname: str
+    instance_id: str
+
+
+@dataclass
+class NodeTimings:
+    ip: str
+    hostname: str
+    drain: float = 0.0
+    restart: float = 0.0
+    health: float = 0.0
+    register: float = 0.0
+    error: str = ""
+
+    @property
+    def total(self) -> float:
+        return self.drain + self.restart + self.health + self.register
+
+
+@dataclass
+class Wave:
+    number: int
+    nodes: List[NodeTimings] = field(default_factory=list)
+    seconds: float = 0.0
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def http_probe(url: str, timeout: float = 5.0) -> bool:
+    """Whether `url` answers like the ALB health check expects."""
+    opener = urllib.request.build_opener(NoRedirect)
+    try:
+        with opener.open(url, timeout=timeout) as response:
+            return response.status == HEALTHY_STATUS
+    except urllib.error.HTTPError as e:
+        return e.code == HEALTHY_STATUS
+    except OSError:
+        return False
+
+
+class Hold:
+    """IPs in the hold file of the reconciler, shared by the nodes of a wave."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _update(self, change: Callable[[Set[str]], None]):
+        if not self.path:
+            return
+        with self.lock:
+            ips = pwb_alb.read_hold(self.path)
+            change(ips)
+            pwb_alb.write_atomic(self.path, "".join(f"{ip}\n" for ip in sorted(ips)))
+
+    def add(self, ip: str):
+        self._update(lambda ips: ips.add(ip))
+
+    def release(self, ip: str):
+        self._update(lambda ips: ips.discard(ip))
+
+
+class Orchestrator:
+    def __init__(self, cluster_name: str, root: Path = Path("/opt/rstudio"), hold_path: Optional[str] = pwb_alb.HOLD_FILE,
+                 ec2=None, elbv2=None, probe: Optional[Callable[[str], bool]] = None,
+                 poll: float = 2.0, timeout: float = 600.0):
+        self.registrar = pwb_alb.TargetRegistrar(cluster_name, ec2, elbv2)
+        self.root = root
+        self.hold = Hold(hold_path)
+        self.probe = probe or (lambda ip: http_probe(HEALTH_URL.format(ip=ip)))
+        self.poll = poll
+        self.timeout = timeout
+        self.groups: Dict[str, str] = {}
+
+    def login_nodes(self) -> List[LoginNode]:
+        nodes = []
+        filters = [{"Name": f"tag:{pwb_alb.CLUSTER_TAG}", "Values": [self.registrar.cluster_name]},
+                   {"Name": f"tag:{pwb_alb.NODE_TYPE_TAG}", "Values": [pwb_alb.LOGIN_NODE]},
+                   {"Name": "instance-state-name", "Values": ["running"]}]
+        for page in self.registrar.ec2.get_paginator("describe_instances").paginate(Filters=filters):
+            for reservation in page["Reservations"]:
+                for instance in reservation["Instances"]:
+                    # hostname as in workbench-<host>.state, e.g. ip-10-0-0-5
+                    nodes.append(LoginNode(instance["PrivateIpAddress"], instance["PrivateDnsName"].split(".")[0],
+                                           instance["InstanceId"]))
+        return sorted(nodes, key=lambda n: n.hostname)
+
+    def states(self, ip: str) -> Dict[str, str]:
+        """Health state of `ip` in each target group, `unused` once it is gone."""
+        target = [{"Id": ip, "Port": pwb_alb.WORKBENCH_PORT}]
+        return {prefix: self.registrar.elbv2.describe_target_health(
+                    TargetGroupArn=arn, Targets=target)["TargetHealthDescriptions"][0]["TargetHealth"]["State"]
+                for prefix, arn in self.groups.items()}
+
+    def drain_timeout(self) -> float:
+        """Longest deregistration delay of the target groups."""
+        delays = []
+        for arn in self.groups.values():
+            attributes = self.registrar.elbv2.describe_target_group_attributes(TargetGroupArn=arn)["Attributes"]
+            delays += [float(a["Value"]) for a in attributes if a["Key"] == "deregistration_delay.timeout_seconds"]
+        return max(delays, default=300.0)
+
+    def wait(self, what: str, done: Callable[[], bool], timeout: float) -> float:
+        started = time.monotonic()
+        while not done():
+            if time.monotonic() - started > timeout:
+                raise RestartError(f"timed out after {timeout:.0f} s waiting for {what}")
+            time.sleep(self.poll)
+        return time.monotonic() - started
+
+    def restart_node(self, node: LoginNode, drain_timeout: float) -> NodeTimings:
+        timings = NodeTimings(node.ip, node.hostname)
+        target = [{"Id": node.ip, "Port": pwb_alb.WORKBENCH_PORT}]
+        self.hold.add(node.ip)
+        try:
+            for arn in self.groups.values():
+                self.registrar.elbv2.deregister_targets(TargetGroupArn=arn, Targets=target)
+            timings.drain = self.wait(f"{node.hostname} to drain",
+                                      lambda: all(s == "unused" for s in self.states(node.ip).values()),
+                                      drain_timeout + self.timeout)
+
+            state = pwb_agent.Layout(self.root, hostname=node.hostname).state
+            state.unlink(missing_ok=True)
+            started = time.monotonic()
+            if not pwb_agent.wait_for([state], self.timeout, self.poll):
+                raise RestartError(f"{state} was not recreated within {self.timeout:.0f} s")
+            timings.restart = time.monotonic() - started
+
+            timings.health = self.wait(f"{node.hostname} to answer with {HEALTHY_STATUS}",
+                                       lambda: self.probe(node.ip), self.timeout)
+
+            started = time.monotonic()
+            for arn in self.groups.values():
+                self.registrar.register(arn, [node.ip])
+            self.wait(f"{node.hostname} to become healthy",
+                      lambda: all(s == "healthy" for s in self.states(node.ip).values()), self.timeout)
+            timings.register = time.monotonic() - started
+            log.info("%s restarted in %.1f s", node.hostname, timings.total)
+        except (RestartError, *AWS_ERRORS) as e:
+            timings.error = str(e)
+            log.error("%s: %s", node.hostname, e)
+            # leave the node to the reconciler, it registers it again once it is running
+        finally:
+            self.hold.release(node.ip)
+        return timings
+
+    def run(self, max_unavailable: int, only: Optional[Set[str]] = None) -> List[Wave]:
+        self.groups = self.registrar.target_groups()
+        if len(self.groups) < len(pwb_alb.TARGET_GROUP_PREFIXES):
+            raise RestartError(f"target groups of {self.registrar.cluster_name} not found: {self.groups}")
+        nodes = [n for n in self.login_nodes() if not only or only & {n.ip, n.hostname, n.instance_id}]
+        drain_timeout = self.drain_timeout()
+        waves = []
+        for i in range(0, len(nodes), max_unavailable):
+            wave = Wave(len(waves) + 1)
+            batch = nodes[i:i + max_unavailable]
+            log.info("wave %d: %s", wave.number, " ".join(n.hostname for n in batch))
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=len(batch)) as pool:
+                wave.nodes = list(pool.map(lambda n: self.restart_node(n, drain_timeout), batch))
+            wave.seconds = time.monotonic() - started
+            waves.append(wave)
+            if any(t.error for t in wave.nodes):
+                log.error("stopping after wave %d, %d nodes not restarted", wave.number, len(nodes) - i - len(batch))
+                break
+        return waves
+
+
+def report(waves: List[Wave]) -> dict:
+    result = {"waves": [], "seconds": round(sum(w.seconds for w in waves), 3),
+              "failed": [t.hostname for w in waves for t in w.nodes if t.error]}
+    for wave in waves:
+        record = asdict(wave)
+        record["seconds"] = round(wave.seconds, 3)
+        for phase in ("drain", "restart", "health", "register"):
+            record[f"max_{phase}"] = round(max(getattr(t, phase) for t in wave.nodes), 3)
+        for node in record["nodes"]:
+            for phase in ("drain", "restart", "health", "register"):
+                node[phase] = round(node[phase], 3)
+        result["waves"].append(record)
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoint-url", help="AWS endpoint, e.g. a local moto server")
+    parser.add_argument("--region", help="AWS region (default: AWS_DEFAULT_REGION)")
+    parser.add_argument("--cluster-name", required=True)
+    parser.add_argument("--max-unavailable", type=int, default=1, help="login nodes restarted at the same time")
+    parser.add_argument("--nodes", nargs="*", help="restrict to these IPs, hostnames or instance ids")
+    parser.add_argument("--root", type=Path, default=Path("/opt/rstudio"), help="shared Workbench tree")
+    parser.add_argument("--hold-file", default=pwb_alb.HOLD_FILE, help="hold file of pwb_alb.py reconcile")
+    parser.add_argument("--poll", type=float, default=2.0, help="seconds between checks")
+    parser.add_argument("--timeout", type=float, default=600.0, help="seconds to wait for each step of a node")
+    args = parser.parse_args(argv)
+    if args.max_unavailable < 1:
+        parser.error("--max-unavailable must be at least 1")
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s %(name)s %(message)s")
+    session = boto3.session.Session(region_name=args.region)
+    orchestrator = Orchestrator(args.cluster_name, args.root, args.hold_file,
+                                session.client("ec2", endpoint_url=args.endpoint_url),
+                                session.client("elbv2", endpoint_url=args.endpoint_url),
+                                poll=args.poll, timeout=args.timeout)
+    try:
+        result = report(orchestrator.run(args.max_unavailable, set(args.nodes or [])))
+    except (RestartError, *AWS_ERRORS) as e:
+        log.error("%s", e)
+        return 1
+    print(json.dumps(result))
+    return 1 if result["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
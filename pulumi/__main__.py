@@ -1,25 +1,79 @@
 """An AWS Python Pulumi program"""
 
 import hashlib
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 
 import jinja2
 import pulumi
 import json
 from pulumi_aws import ec2, rds, directoryservice, secretsmanager
-from pulumi_aws import iam, s3, Provider, get_region, lb, acm, route53
+from pulumi_aws import iam, s3, lb, acm, route53
 import pulumi_awsx as awsx
 from pulumi_command import remote
 from pulumi_random import RandomPassword, RandomUuid
 from pulumi_tls import PrivateKey
 
+from bundle import BundleFile, FileBundle
+from lookups import LookupCache
+
 # ------------------------------------------------------------------------------
 # Helper functions
 # ------------------------------------------------------------------------------
 
+# Tiers of the stack in the order they are created, `pulumi config set tiers data,edge`
+# restricts a stack to some of them (default: all).
+TIERS = ["data", "directory", "bootstrap", "edge"]
+
+# Tiers that need other tiers
+TIER_REQUIRES = {"bootstrap": ["directory"]}
+
+
+def parse_tiers(value: Optional[str]) -> List[str]:
+    if not value:
+        return list(TIERS)
+    tiers = [t.strip() for t in value.split(",") if t.strip()]
+    unknown = [t for t in tiers if t not in TIERS]
+    if unknown:
+        raise ValueError(f"unknown tiers {', '.join(unknown)}, choose from {', '.join(TIERS)}")
+    for tier in tiers:
+        missing = [t for t in TIER_REQUIRES.get(tier, []) if t not in tiers]
+        if missing:
+            raise ValueError(f"tier {tier} needs tier(s) {', '.join(missing)}")
+    return [t for t in TIERS if t in tiers]
+
+
+# Connection pooling in front of the Workbench databases, `pulumi config set db_pooling pgbouncer`
+POOLING = ["none", "rds-proxy", "pgbouncer"]
+
+PGBOUNCER_PORT = 6432
+
+
+@dataclass
+class DatabaseSize:
+    """Sizing of an RDS instance, e.g. `pulumi config set --path rsw_db.instance_class db.t4g.small`."""
+    instance_class: str = "db.t4g.micro"
+    allocated_storage: int = 5
+    # gp2 (AWS default), gp3, io1 or io2
+    storage_type: Optional[str] = None
+    # provisioned IOPS, only for gp3, io1 and io2
+    iops: Optional[int] = None
+    multi_az: bool = False
+
+    @classmethod
+    def from_config(cls, value: Optional[Dict]) -> "DatabaseSize":
+        value = value or {}
+        unknown = set(value) - {f.name for f in fields(cls)}
+        if unknown:
+            raise ValueError(f"unknown database settings {', '.join(sorted(unknown))}")
+        size = cls(**value)
+        if size.iops and size.storage_type not in ("gp3", "io1", "io2"):
+            raise ValueError(f"iops need storage_type gp3, io1 or io2, not {size.storage_type or 'gp2'}")
+        return size
+
+
 @dataclass
 class ConfigValues:
     """A single object to manage all config files."""
@@ -38,30 +92,99 @@ class ConfigValues:
         self.ServerInstanceType = self.config.require("ServerInstanceType")
         self.billing_code = self.config.require("billing_code")
         self.my_ip = self.config.require("my_ip")
+        self.tiers = parse_tiers(self.config.get("tiers"))
+
+        # Workbench databases and the optional pooling layer in front of them
+        self.rsw_db = DatabaseSize.from_config(self.config.get_object("rsw_db"))
+        self.rsw_audit_db = DatabaseSize.from_config(self.config.get_object("rsw_audit_db"))
+        self.db_pooling = self.config.get("db_pooling") or "none"
+        if self.db_pooling not in POOLING:
+            raise ValueError(f"db_pooling must be one of {', '.join(POOLING)}, not {self.db_pooling}")
+        self.db_pool_mode = self.config.get("db_pool_mode") or "session"
+        self.db_pool_size = self.config.get_int("db_pool_size") or 20
+        self.pgbouncer_instance_type = self.config.get("pgbouncer_instance_type") or "t3.small"
+
+
+class FileIndex:
+    """Reads every server side file once per run and memoizes its content hash."""
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        self._sources: Dict[str, str] = {}
+        self._digests: Dict[str, str] = {}
+
+    def read(self, path: str) -> str:
+        if path not in self._sources:
+            self._sources[path] = (self.base_dir / path).read_text()
+        return self._sources[path]
+
+    def digest(self, path: str) -> str:
+        if path not in self._digests:
+            self._digests[path] = hashlib.sha224(bytes(self.read(path), encoding='utf-8')).hexdigest()
+        return self._digests[path]
+
+
+class IndexedLoader(jinja2.FileSystemLoader):
+    """FileSystemLoader that takes template sources from the shared FileIndex."""
+
+    def __init__(self, index: FileIndex):
+        super().__init__(str(index.base_dir))
+        self.index = index
+
+    def get_source(self, environment, template):
+        return self.index.read(template), str(self.index.base_dir / template), lambda: True
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+FILE_INDEX = FileIndex(BASE_DIR)
+
+TEMPLATES = jinja2.Environment(
+    loader=IndexedLoader(FILE_INDEX),
+    bytecode_cache=jinja2.FileSystemBytecodeCache(),
+    keep_trailing_newline=True,
+    auto_reload=False,
+)
 
 
 def create_template(path: str) -> jinja2.Template:
-    with open(path, 'r') as f:
-        template = jinja2.Template(f.read())
-    return template
+    return TEMPLATES.get_template(path)
 
 
 def hash_file(path: str) -> pulumi.Output:
-    with open(path, mode="r") as f:
-        text = f.read()
-    hash_str = hashlib.sha224(bytes(text, encoding='utf-8')).hexdigest()
-    return pulumi.Output.concat(hash_str)
+    return pulumi.Output.concat(FILE_INDEX.digest(path))
+
+
+def render_pgbouncer_ini(databases: List[Dict], client_user: str, pool_mode: str = "session",
+                         pool_size: int = 20, port: int = PGBOUNCER_PORT,
+                         auth_file: str = "/etc/pgbouncer/userlist.txt",
+                         socket_dir: str = "/var/run/postgresql", max_client_conn: int = 1000,
+                         server_tls_sslmode: str = "require") -> str:
+    """pgbouncer.ini for `databases` (dicts with name, host, port, dbname, user and password)."""
+    return create_template("server-side-files/pgbouncer/pgbouncer.ini").render(
+        databases=databases, client_user=client_user, pool_mode=pool_mode, pool_size=pool_size,
+        port=port, auth_file=auth_file, socket_dir=socket_dir, max_client_conn=max_client_conn,
+        server_tls_sslmode=server_tls_sslmode)
+
+
+def render_pgbouncer_user_data(databases: List[Dict], client_user: str, client_password: str,
+                               **kwargs) -> str:
+    return create_template("server-side-files/pgbouncer/user-data.sh").render(
+        pgbouncer_ini=render_pgbouncer_ini(databases, client_user, **kwargs).rstrip("\n"),
+        client_user=client_user, client_password=client_password)
 
 
 def get_password(
-        name: str
+        name: str,
+        opts: Optional[pulumi.ResourceOptions] = None
 ):
     return RandomPassword(name,
                           length=16,
                           special=False,
                           min_lower=1,
                           min_numeric=1,
-                          min_upper=1
+                          min_upper=1,
+                          opts=opts
                           ).result
 
 def get_password2( 
@@ -83,7 +206,8 @@ def make_server(
         subnet_id: str,
         instance_type: str,
         ami: str,
-        key_name: str
+        key_name: str,
+        opts: Optional[pulumi.ResourceOptions] = None
 ):
     # Stand up a server.
     server = ec2.Instance(
@@ -100,6 +224,7 @@ def make_server(
             "http_put_response_hop_limit": 1,
             "http_tokens": "required",
         },
+        opts=opts,
     )
 
     # Export final pulumi variables.
@@ -109,6 +234,781 @@ def make_server(
     return server
 
 
+# ------------------------------------------------------------------------------
+# Tiers
+# ------------------------------------------------------------------------------
+
+class Tier(pulumi.ComponentResource):
+    """A part of the stack that can be enabled per stack and targeted on its own.
+
+    The resources of all tiers used to be registered directly below the stack,
+    the alias keeps their former URNs so that they are neither replaced nor
+    recreated.
+    """
+
+    def __init__(self, kind: str, name: str, opts: Optional[pulumi.ResourceOptions] = None):
+        super().__init__(f"rsw-ha:index:{kind}", name, None, opts)
+
+    def child(self, **kwargs) -> pulumi.ResourceOptions:
+        return pulumi.ResourceOptions(parent=self, aliases=[pulumi.Alias(parent=pulumi.ROOT_STACK_RESOURCE)],
+                                      **kwargs)
+
+
+class DataTier(Tier):
+    """PostgreSQL databases of Workbench (default and audit) and MySQL for Slurm accounting."""
+
+    def __init__(self, name: str, config: ConfigValues, tags: Dict, stack_name: str,
+                 vpc: pulumi.Output, private_subnets: pulumi.Output, lookups: LookupCache,
+                 opts: Optional[pulumi.ResourceOptions] = None):
+        super().__init__("DataTier", name, opts)
+
+        # --------------------------------------------------------------------------
+        # Posit Workbench DB (PostgreSQL)
+        # --------------------------------------------------------------------------
+
+        rsw_security_group_db = ec2.SecurityGroup(
+            "postgres",
+            description="Security group for PostgreSQL access",
+            ingress=[
+                {"protocol": "TCP", "from_port": 5432, "to_port": 5432,
+                 'cidr_blocks': [vpc.cidr_block], "description": "PostgreSQL DB"}
+            ],
+            egress=[
+                {"protocol": "All", "from_port": 0, "to_port": 0,
+                 'cidr_blocks': ['0.0.0.0/0'], "description": "Allow all outbound traffic"},
+            ],
+            tags=tags,
+            vpc_id=vpc.id,
+            opts=self.child()
+        )
+        pulumi.export("rsw_security_group_db", rsw_security_group_db.id)
+
+        subnetgroup = rds.SubnetGroup("postgresdbsubnetgroup",
+                                      subnet_ids=private_subnets.ids,
+                                      tags={
+                                          "Name": "Postgres subnet group",
+                                      },
+                                      opts=self.child())
+
+        # Default DB 
+
+        rsw_db_pass = get_password("rsw_db_pass", opts=self.child())
+        pulumi.export("rsw_db_pass", pulumi.Output.secret(rsw_db_pass))
+
+        rsw_db = rds.Instance(
+            "rsw-db",
+            instance_class=config.rsw_db.instance_class,
+            allocated_storage=config.rsw_db.allocated_storage,
+            storage_type=config.rsw_db.storage_type,
+            iops=config.rsw_db.iops,
+            multi_az=config.rsw_db.multi_az,
+            backup_retention_period=7,
+            username=config.rsw_db_username,
+            password=rsw_db_pass,
+            db_name="pwb",
+            engine="postgres",
+            publicly_accessible=False,
+            skip_final_snapshot=True,
+            tags=tags | {"Name": "pwb-db"},
+            vpc_security_group_ids=[rsw_security_group_db.id],
+            db_subnet_group_name=subnetgroup,
+            storage_encrypted=True,
+            performance_insights_enabled=True, # TODO: Update pro-actively to Database Insights standard
+            copy_tags_to_snapshot=True,
+            opts=self.child()
+        )
+        pulumi.export("rsw_db_port", rsw_db.port)
+        pulumi.export("rsw_db_address", rsw_db.address)
+        pulumi.export("rsw_db_endpoint", rsw_db.endpoint)
+        pulumi.export("rsw_db_name", rsw_db.db_name)
+        pulumi.export("rsw_db_user", config.rsw_db_username)
+
+
+        # Audit DB 
+
+        rsw_audit_db_pass = get_password("rsw_audit_db_pass", opts=self.child())
+        pulumi.export("rsw_audit_db_pass", pulumi.Output.secret(rsw_audit_db_pass))
+
+        rsw_audit_db = rds.Instance(
+            "rsw-audit-db",
+            instance_class=config.rsw_audit_db.instance_class,
+            allocated_storage=config.rsw_audit_db.allocated_storage,
+            storage_type=config.rsw_audit_db.storage_type,
+            iops=config.rsw_audit_db.iops,
+            multi_az=config.rsw_audit_db.multi_az,
+            backup_retention_period=7,
+            username=config.rsw_db_username,
+            password=rsw_audit_db_pass,
+            db_name="audit",
+            engine="postgres",
+            publicly_accessible=False,
+            skip_final_snapshot=True,
+            tags=tags | {"Name": "pwb-audit-db"},
+            vpc_security_group_ids=[rsw_security_group_db.id],
+            db_subnet_group_name=subnetgroup,
+            storage_encrypted=True,
+            performance_insights_enabled=True, # TODO: Update pro-actively to Database Insights standard
+            copy_tags_to_snapshot=True,
+            opts=self.child()
+        )
+        pulumi.export("rsw_audit_db_port", rsw_audit_db.port)
+        pulumi.export("rsw_audit_db_address", rsw_audit_db.address)
+        pulumi.export("rsw_audit_db_endpoint", rsw_audit_db.endpoint)
+        pulumi.export("rsw_audit_db_name", rsw_audit_db.db_name)
+        pulumi.export("rsw_audit_db_user", config.rsw_db_username)
+
+        # --------------------------------------------------------------------------
+        # Connection pooling for the Workbench databases (optional)
+        # --------------------------------------------------------------------------
+
+        # What database.conf and audit-database.conf point to (cf. deploy.sh),
+        # the databases themselves unless db_pooling is set
+        pools = {
+            "rsw_db": (rsw_db.address, rsw_db.port, rsw_db_pass),
+            "rsw_audit_db": (rsw_audit_db.address, rsw_audit_db.port, rsw_audit_db_pass),
+        }
+        if config.db_pooling == "rds-proxy":
+            pools = self.rds_proxies(config, tags, stack_name, private_subnets, rsw_security_group_db, {
+                "rsw_db": (rsw_db, rsw_db_pass),
+                "rsw_audit_db": (rsw_audit_db, rsw_audit_db_pass),
+            })
+        elif config.db_pooling == "pgbouncer":
+            pools = self.pgbouncer(config, tags, stack_name, vpc, private_subnets, lookups, {
+                "rsw_db": (rsw_db, rsw_db_pass),
+                "rsw_audit_db": (rsw_audit_db, rsw_audit_db_pass),
+            })
+        pulumi.export("db_pooling", config.db_pooling)
+        for db, (address, port, password) in pools.items():
+            pulumi.export(f"{db}_pool_address", address)
+            pulumi.export(f"{db}_pool_port", port)
+            pulumi.export(f"{db}_pool_pass", pulumi.Output.secret(password))
+
+        # --------------------------------------------------------------------------
+        # SLURM Accounting DB (MySQL)
+        # --------------------------------------------------------------------------
+
+        slurm_security_group_db = ec2.SecurityGroup(
+            "mysql",
+            description="Security group for MySQL access",
+            ingress=[
+                {"protocol": "TCP", "from_port": 3306, "to_port": 3306,
+                 'cidr_blocks': [vpc.cidr_block], "description": "MySQL DB"}
+            ],
+            egress=[
+                {"protocol": "All", "from_port": 0, "to_port": 0,
+                 'cidr_blocks': ['0.0.0.0/0'], "description": "Allow all outbound traffic"},
+            ],
+            tags=tags,
+            vpc_id=vpc.id,
+            opts=self.child()
+        )
+        pulumi.export("slurm_security_group_db", slurm_security_group_db.id)
+
+        slurm_db_pass = get_password("slurm_db_pass", opts=self.child())
+        pulumi.export("slurm_db_pass", pulumi.Output.secret(slurm_db_pass))
+
+        secret = secretsmanager.Secret(f"SlurmDBPassword-{stack_name}", opts=self.child())
+        slurm_db_pass_sec = secretsmanager.SecretVersion(f"SlurmDBPassword-{stack_name}",
+                                               secret_id=secret.id,
+                                               secret_string=slurm_db_pass,
+                                               opts=self.child())
+        pulumi.export("slurm_db_pass_arn", slurm_db_pass_sec.arn)
+
+        mysql_param_group = rds.ParameterGroup(
+            "mysql-encryption-param-group",
+            family="mysql8.0",  # adjust to your MySQL version
+            description="Custom MySQL parameter group enforcing encryption in transit",
+            parameters=[
+                rds.ParameterGroupParameterArgs(
+                    name="require_secure_transport",
+                    value="1",
+                ),
+            ],
+            opts=self.child()
+        )
+
+        slurm_db = rds.Instance(
+            "slurm-db",
+            instance_class="db.t4g.medium",
+            allocated_storage=5,
+            backup_retention_period=7,
+            username=config.slurm_db_username,
+            password=slurm_db_pass,
+            db_name="slurm",
+            engine="mysql",
+            publicly_accessible=False,
+            skip_final_snapshot=True,
+            tags=tags | {"Name": "slurm-db"},
+            vpc_security_group_ids=[slurm_security_group_db.id],
+            db_subnet_group_name=subnetgroup,
+            parameter_group_name=mysql_param_group.name,
+            performance_insights_enabled=True,
+            performance_insights_retention_period=7,
+            storage_encrypted=True,
+            copy_tags_to_snapshot=True,
+            opts=self.child()
+        )
+
+        pulumi.export("slurm_db_port", slurm_db.port)
+        pulumi.export("slurm_db_address", slurm_db.address)
+        pulumi.export("slurm_db_endpoint", slurm_db.endpoint)
+        pulumi.export("slurm_db_name", slurm_db.db_name)
+        pulumi.export("slurm_db_user", config.slurm_db_username)
+
+
+        self.register_outputs({})
+
+
+    def rds_proxies(self, config: ConfigValues, tags: Dict, stack_name: str,
+                    private_subnets: pulumi.Output, security_group: ec2.SecurityGroup,
+                    databases: Dict[str, tuple]) -> Dict[str, tuple]:
+        """One RDS Proxy per database, they read the credentials from Secrets Manager."""
+        secrets = {}
+        for db, (instance, password) in databases.items():
+            secrets[db] = secretsmanager.Secret(f"{db}-proxy-credentials-{stack_name}", opts=self.child())
+            secretsmanager.SecretVersion(f"{db}-proxy-credentials-{stack_name}",
+                                         secret_id=secrets[db].id,
+                                         secret_string=pulumi.Output.json_dumps({
+                                             "username": config.rsw_db_username,
+                                             "password": password,
+                                         }),
+                                         opts=self.child())
+
+        role = iam.Role(f"pwb-db-proxy-{stack_name}",
+                        assume_role_policy=json.dumps({
+                            "Version": "2012-10-17",
+                            "Statement": [{
+                                "Action": "sts:AssumeRole",
+                                "Effect": "Allow",
+                                "Principal": {"Service": "rds.amazonaws.com"},
+                            }],
+                        }),
+                        tags=tags,
+                        opts=self.child())
+        iam.RolePolicy(f"pwb-db-proxy-{stack_name}",
+                       role=role.id,
+                       policy=pulumi.Output.all(*[s.arn for s in secrets.values()]).apply(
+                           lambda arns: json.dumps({
+                               "Version": "2012-10-17",
+                               "Statement": [{
+                                   "Action": ["secretsmanager:GetSecretValue"],
+                                   "Effect": "Allow",
+                                   "Resource": arns,
+                               }],
+                           })),
+                       opts=self.child())
+
+        pools = {}
+        for db, (instance, password) in databases.items():
+            proxy_name = f"{db.replace('_', '-')}-proxy-{stack_name}"
+            proxy = rds.Proxy(proxy_name,
+                              name=proxy_name,
+                              engine_family="POSTGRESQL",
+                              role_arn=role.arn,
+                              auths=[rds.ProxyAuthArgs(
+                                  auth_scheme="SECRETS",
+                                  iam_auth="DISABLED",
+                                  secret_arn=secrets[db].arn,
+                              )],
+                              vpc_subnet_ids=private_subnets.ids,
+                              vpc_security_group_ids=[security_group.id],
+                              require_tls=False,
+                              tags=tags | {"Name": proxy_name},
+                              opts=self.child())
+            target_group = rds.ProxyDefaultTargetGroup(proxy_name,
+                                                       db_proxy_name=proxy.name,
+                                                       connection_pool_config=rds.ProxyDefaultTargetGroupConnectionPoolConfigArgs(
+                                                           max_connections_percent=90,
+                                                           max_idle_connections_percent=50,
+                                                           connection_borrow_timeout=120,
+                                                       ),
+                                                       opts=self.child())
+            rds.ProxyTarget(proxy_name,
+                            db_proxy_name=proxy.name,
+                            target_group_name=target_group.name,
+                            db_instance_identifier=instance.identifier,
+                            opts=self.child())
+            pools[db] = (proxy.endpoint, 5432, password)
+        return pools
+
+    def pgbouncer(self, config: ConfigValues, tags: Dict, stack_name: str, vpc: pulumi.Output,
+                  private_subnets: pulumi.Output, lookups: LookupCache,
+                  databases: Dict[str, tuple]) -> Dict[str, tuple]:
+        """One pgbouncer instance for both databases, Workbench logs in with a pool password."""
+        pool_pass = get_password("db_pool_pass", opts=self.child())
+
+        pgbouncer_security_group = ec2.SecurityGroup(
+            "pgbouncer",
+            description="Security group for pgbouncer access",
+            ingress=[
+                {"protocol": "TCP", "from_port": PGBOUNCER_PORT, "to_port": PGBOUNCER_PORT,
+                 'cidr_blocks': [vpc.cidr_block], "description": "pgbouncer"}
+            ],
+            egress=[
+                {"protocol": "All", "from_port": 0, "to_port": 0,
+                 'cidr_blocks': ['0.0.0.0/0'], "description": "Allow all outbound traffic"},
+            ],
+            tags=tags,
+            vpc_id=vpc.id,
+            opts=self.child()
+        )
+
+        ami = lookups.lookup("pgbouncer_ami", ec2.get_ami_output, ["id"],
+                             most_recent=True,
+                             owners=["099720109477"],  # Canonical
+                             filters=[
+                                 {"name": "name", "values": ["ubuntu/images/hvm-ssd-gp3/ubuntu-noble-24.04-amd64-server-*"]},
+                                 {"name": "architecture", "values": ["x86_64"]},
+                             ])
+
+        names = {"rsw_db": "pwb", "rsw_audit_db": "audit"}
+        settings = pulumi.Output.all(*[pulumi.Output.all(i.address, i.port, p) for i, p in databases.values()])
+        user_data = pulumi.Output.all(settings, pool_pass).apply(lambda x: render_pgbouncer_user_data(
+            databases=[dict(name=names[db], host=host, port=port, dbname=names[db],
+                            user=config.rsw_db_username, password=password)
+                       for db, (host, port, password) in zip(databases, x[0])],
+            client_user=config.rsw_db_username,
+            client_password=x[1],
+            pool_mode=config.db_pool_mode,
+            pool_size=config.db_pool_size,
+        ))
+
+        server = ec2.Instance(
+            f"pgbouncer-{stack_name}",
+            instance_type=config.pgbouncer_instance_type,
+            vpc_security_group_ids=[pgbouncer_security_group.id],
+            ami=ami.id,
+            subnet_id=private_subnets.ids[0],
+            user_data=pulumi.Output.secret(user_data),
+            user_data_replace_on_change=True,
+            associate_public_ip_address=False,
+            metadata_options={
+                "http_put_response_hop_limit": 1,
+                "http_tokens": "required",
+            },
+            tags=tags | {"Name": f"pgbouncer-{stack_name}"},
+            opts=self.child()
+        )
+        pulumi.export("pgbouncer_private_ip", server.private_ip)
+        return {db: (server.private_ip, PGBOUNCER_PORT, pool_pass) for db in databases}
+
+
+class DirectoryTier(Tier):
+    """SimpleAD directory for the users of Workbench and the cluster."""
+
+    def __init__(self, name: str, config: ConfigValues, tags: Dict, stack_name: str,
+                 vpc: pulumi.Output, private_subnets: pulumi.Output,
+                 opts: Optional[pulumi.ResourceOptions] = None):
+        super().__init__("DirectoryTier", name, opts)
+
+        # --------------------------------------------------------------------------
+        # Active Directory (SimpleAD)
+        # --------------------------------------------------------------------------
+
+        ad_password = get_password("ad_password", opts=self.child())
+        pulumi.export("ad_password", pulumi.Output.secret(ad_password))
+    
+        secret = secretsmanager.Secret(f"SimpleADPassword-{stack_name}", opts=self.child())
+        ad_password_sec = secretsmanager.SecretVersion(f"SimpleADPassword-{stack_name}",
+                                               secret_id=secret.id,
+                                               secret_string=ad_password,
+                                               opts=self.child())
+        pulumi.export("ad_password_arn", ad_password_sec.arn)
+
+        ad = directoryservice.Directory("pwb_directory",
+                                        name=config.domain_name,
+                                        password=ad_password,
+                                        # edition="Standard",
+                                        type="SimpleAD",
+                                        size="Small",
+                                        description="Directory for PWB environment",
+                                        vpc_settings=directoryservice.DirectoryVpcSettingsArgs(
+                                            vpc_id=vpc.id,
+                                            subnet_ids=private_subnets.ids,
+                                        ),
+                                        tags=tags | {"Name": f"pwb-directory-{stack_name}"},
+                                        opts=self.child()
+                                        )
+        pulumi.export('ad_dns_1', ad.dns_ip_addresses[0])
+        pulumi.export('ad_dns_2', ad.dns_ip_addresses[1])
+        pulumi.export('ad_access_url', ad.access_url)
+
+        self.directory = ad
+        self.password = ad_password
+
+
+        self.register_outputs({})
+
+
+class BootstrapTier(Tier):
+    """Jump host that joins the directory and provisions its users."""
+
+    def __init__(self, name: str, config: ConfigValues, tags: Dict, stack_name: str,
+                 vpc: pulumi.Output, private_subnets: pulumi.Output, lookups: LookupCache,
+                 key_pair: ec2.KeyPair, ssh_key: PrivateKey, posit_user_pass: pulumi.Output,
+                 directory: DirectoryTier, opts: Optional[pulumi.ResourceOptions] = None):
+        super().__init__("BootstrapTier", name, opts)
+
+        # --------------------------------------------------------------------------
+        # Jump Host (AD)
+        # --------------------------------------------------------------------------
+
+        ad = directory.directory
+        ad_password = directory.password
+
+        ssh_security_group = ec2.SecurityGroup(
+            "ssh",
+            description="ssh access ",
+            ingress=[
+                {"protocol": "TCP", "from_port": 22, "to_port": 22,
+                 'cidr_blocks': [vpc.cidr_block], "description": "SSH"},
+            ],
+            egress=[
+                {"protocol": "All", "from_port": 0, "to_port": 0,
+                 'cidr_blocks': ['0.0.0.0/0'], "description": "Allow all outbout traffic"},
+            ],
+            tags=tags,
+            vpc_id=vpc.id,
+            opts=self.child()
+        )
+        pulumi.export("ssh_security_group", ssh_security_group.id)
+
+        # Fetch the most recent Ubuntu 20.04 AMI with HVM and x86_64 architecture in the specified region
+        ami = lookups.lookup("ami", ec2.get_ami_output, ["id"],
+                             most_recent=True,
+                             owners=["099720109477"],  # Canonical
+                             filters=[
+                                 {"name": "name", "values": ["ubuntu/images/hvm-ssd/ubuntu-focal-20.04-amd64-server-*"]},
+                                 {"name": "architecture", "values": ["x86_64"]},
+                                 {"name": "virtualization-type", "values": ["hvm"]},
+                             ])
+
+        # Export the AMI ID
+        pulumi.export("ami_id", ami.id)
+
+        jump_host = make_server(
+            "jump_host",
+            "ad",
+            tags=tags | {"Name": f"jump-host-ad-{stack_name}"},
+            vpc_group_ids=[ssh_security_group.id],
+            instance_type=config.ServerInstanceType,
+            subnet_id=private_subnets.ids[0],
+            ami=ami.id,
+            key_name=key_pair.key_name,
+            opts=self.child()
+        )
+
+        pulumi.export("jump_host_dns", jump_host.private_dns)
+        pulumi.export("jump_host_public_ip", jump_host.private_ip)
+        pulumi.export("jump_host_instance_id", jump_host.id)
+
+        connection = remote.ConnectionArgs(
+            host=jump_host.private_ip,  # host=jump_host.id,
+            user="ubuntu",
+            #private_key=Path(f"{key_pair.key_name}.pem").read_text()
+            private_key=ssh_key.private_key_openssh
+        )
+
+        # Copy the server side files
+        @dataclass
+        class serverSideFile:
+            file_in: str
+            file_out: str
+            template_render_command: pulumi.Output
+
+        server_side_files = [
+            serverSideFile(
+                "server-side-files/config/krb5.conf",
+                "~/krb5.conf",
+                pulumi.Output.all().apply(
+                    lambda x: create_template("server-side-files/config/krb5.conf").render(domain_name=config.domain_name))
+
+            ),
+            serverSideFile(
+                "server-side-files/config/resolv.conf",
+                "~/resolv.conf",
+                pulumi.Output.all(config.domain_name, ad.dns_ip_addresses, config.aws_region).apply(
+                    lambda x: create_template("server-side-files/config/resolv.conf").render(domain_name=x[0], dns1=x[1][0],
+                                                                                             dns2=x[1][1], aws_region=x[2]))
+            ),
+            serverSideFile(
+                "server-side-files/provision_users.py",
+                "~/provision_users.py",
+                pulumi.Output.from_input(FILE_INDEX.read("server-side-files/provision_users.py"))
+            ),
+            serverSideFile(
+                "server-side-files/justfile",
+                "~/justfile",
+                pulumi.Output.from_input(FILE_INDEX.read("server-side-files/justfile"))
+            ),
+        ]
+
+        # All files incl. .env go to the jump host as one archive over a single
+        # SSH session, only files whose hash changed are unpacked there
+        jump_host_files = [
+            f.template_render_command.apply(lambda text, out=f.file_out: BundleFile(out, text))
+            for f in server_side_files
+        ] + [
+            pulumi.Output.concat(
+                'export AD_PASSWD=', ad_password, '\n',
+                'export AD_DOMAIN=', config.domain_name, '\n',
+                'export POSIT_USER_PASS=', posit_user_pass, '\n',
+            ).apply(lambda text: BundleFile("~/.env", text)),
+        ]
+
+        command_copy_files = FileBundle(
+            "jump-host-files",
+            files=jump_host_files,
+            connection=connection,
+            post_script="\n".join([
+                """[ -x ~/bin/just ] || curl --proto '=https' --tlsv1.2 -sSf https://just.systems/install.sh | bash -s -- --to ~/bin""",
+                """grep -qxF 'export PATH="$PATH:$HOME/bin"' ~/.bashrc || echo 'export PATH="$PATH:$HOME/bin"' >> ~/.bashrc""",
+            ]),
+            opts=self.child(depends_on=jump_host)
+        )
+
+        command_build_jumphost = remote.Command(
+            f"build-jump-host",
+            # create="alias just='/home/ubuntu/bin/just'; just build-rsw",
+            create="""export PATH="$PATH:$HOME/bin"; just integrate-ad""",
+            connection=connection,
+            opts=self.child(depends_on=[jump_host, command_copy_files])
+        )
+
+
+        self.register_outputs({})
+
+
+class EdgeTier(Tier):
+    """Public and internal load balancers of Workbench with their DNS records."""
+
+    def __init__(self, name: str, tags: Dict, stack_name: str, vpc: pulumi.Output,
+                 public_subnets: pulumi.Output, lookups: LookupCache,
+                 opts: Optional[pulumi.ResourceOptions] = None):
+        super().__init__("EdgeTier", name, opts)
+
+        #########################################################################
+        # Section: Public Load Balancer
+        # Date: 2024-12-13
+        #########################################################################
+
+        # Security group for the public ALB
+        alb_sg = ec2.SecurityGroup(
+            f"pwb-alb-sg-{stack_name}",
+            description="Security group for public ALB",
+            vpc_id=vpc.id,
+            ingress=[
+                ec2.SecurityGroupIngressArgs(
+                    protocol="tcp",
+                    from_port=443,
+                    to_port=443,
+                    cidr_blocks=["0.0.0.0/0"],
+                    description="Allow HTTPS from anywhere",
+                ),
+                ec2.SecurityGroupIngressArgs(
+                    protocol="tcp",
+                    from_port=8787,
+                    to_port=8787,
+                    cidr_blocks=["0.0.0.0/0"],
+                    description="Allow TCP 8787 from anywhere",
+                ),
+            ],
+            egress=[
+                ec2.SecurityGroupEgressArgs(
+                    protocol="-1",
+                    from_port=0,
+                    to_port=0,
+                    cidr_blocks=["0.0.0.0/0"],
+                    description="Allow all outbound traffic",
+                )
+            ],
+            tags=tags | {"Name": f"pwb-alb-sg-{stack_name}"},
+            opts=self.child()
+        )
+
+        lb_security_group = ec2.SecurityGroup(
+            f"public-nlb-secgrp-{stack_name}",
+            name=f"public-nlb-secgrp-{stack_name}",
+            vpc_id=vpc.id,
+            ingress=[
+                # Allow all 80/443 incoming
+                ec2.SecurityGroupIngressArgs(
+                    from_port=443,
+                    to_port=443,
+                    protocol="tcp",
+                    cidr_blocks=["0.0.0.0/0"],
+                )
+            ],
+            egress=[
+                # Allow outbound traffic to private subnet HTTP only
+                ec2.SecurityGroupEgressArgs(
+                    from_port=443,
+                    to_port=443,
+                    protocol="tcp",
+                    cidr_blocks=[vpc.cidr_block]
+                )
+            ],
+            tags=tags,
+            opts=self.child(delete_before_replace=True),
+        )
+
+        # Create an internal and public(ext) Application Load Balancer
+        pwb_alb_ext = lb.LoadBalancer(
+            f"pwb-alb-ext-{stack_name}",
+            name=f"pwb-alb-ext-{stack_name}",
+            internal=False, # This makes it a public-facing ALB
+            load_balancer_type="application",
+            security_groups=[alb_sg.id],
+            subnets=public_subnets.ids, # Place it in public subnets
+            tags=tags | {"Name": f"pwb-alb-ext-{stack_name}"},
+            opts=self.child(delete_before_replace=True),
+        )
+        pulumi.export("pwb_alb_ext_arn", pwb_alb_ext.arn)
+        pulumi.export("pwb_alb_ext_dns_name", pwb_alb_ext.dns_name)
+
+        pwb_alb_int = lb.LoadBalancer(
+            f"pwb-alb-int-{stack_name}",
+            name=f"pwb-alb-int-{stack_name}",
+            internal=True,
+            load_balancer_type="application",
+            security_groups=[alb_sg.id],
+            subnets=public_subnets.ids, # Place it in public subnets
+            tags=tags | {"Name": f"pwb-alb-int-{stack_name}"},
+            opts=self.child(delete_before_replace=True),
+        )
+        pulumi.export("pwb_alb_int_arn", pwb_alb_int.arn)
+        pulumi.export("pwb_alb_int_dns_name", pwb_alb_int.dns_name)
+
+        # Get the ACM certificate
+        cert = lookups.lookup("certificate", acm.get_certificate_output, ["arn"],
+                              domain="*.pcluster.soleng.posit.it",
+                              most_recent=True,
+                              statuses=["ISSUED"])
+
+        # Create a target group for the ALB.
+        # The head node will register itself with this target group.
+        alb_target_group_ext = lb.TargetGroup(
+            f"pwb-alb-tg-ext-{stack_name}",
+            port=8787, # The internal service port
+            protocol="HTTP",
+            vpc_id=vpc.id,
+            target_type="ip",
+            stickiness=lb.TargetGroupStickinessArgs(
+                type="app_cookie",
+                cookie_name="rs-csrf-token",
+                enabled=True,
+            ),
+            health_check=lb.TargetGroupHealthCheckArgs(
+                enabled=True,
+                protocol="HTTP",
+                path="/",
+                port="traffic-port",
+                matcher="302", # RStudio Workbench redirects with a 302
+            ),
+            tags=tags | {"Name": f"pwb-alb-tg-ext-{stack_name}"},
+            opts=self.child()
+        )
+        pulumi.export("alb_target_group_ext_arn", alb_target_group_ext.arn)
+
+        alb_target_group_int = lb.TargetGroup(
+            f"pwb-alb-tg-int-{stack_name}",
+            port=8787, # The internal service port
+            protocol="HTTP",
+            vpc_id=vpc.id,
+            target_type="ip",
+            stickiness=lb.TargetGroupStickinessArgs(
+                type="app_cookie",
+                cookie_name="rs-csrf-token",
+                enabled=True,
+            ),
+            health_check=lb.TargetGroupHealthCheckArgs(
+                enabled=True,
+                protocol="HTTP",
+                path="/",
+                port="traffic-port",
+                matcher="302", # RStudio Workbench redirects with a 302
+            ),
+            tags=tags | {"Name": f"pwb-alb-tg-int-{stack_name}"},
+            opts=self.child()
+        )
+        pulumi.export("alb_target_group_int_arn", alb_target_group_int.arn)
+
+
+        # Create a listener for HTTPS traffic
+        alb_listener_ext = lb.Listener(
+            f"pwb-alb-listener-ext-{stack_name}",
+            load_balancer_arn=pwb_alb_ext.arn,
+            port=443,
+            protocol="HTTPS",
+            certificate_arn=cert.arn,
+            default_actions=[lb.ListenerDefaultActionArgs(
+                type="forward",
+                target_group_arn=alb_target_group_ext.arn,
+            )],
+            tags=tags,
+            opts=self.child(delete_before_replace=True,depends_on=[pwb_alb_ext]),
+        )
+        pulumi.export("alb_listener_ext_arn", alb_listener_ext.arn)
+
+        alb_listener_int = lb.Listener(
+            f"pwb-alb-listener-int-{stack_name}",
+            load_balancer_arn=pwb_alb_int.arn,
+            port=443,
+            protocol="HTTPS",
+            certificate_arn=cert.arn,
+            default_actions=[lb.ListenerDefaultActionArgs(
+                type="forward",
+                target_group_arn=alb_target_group_int.arn,
+            )],
+            tags=tags,
+            opts=self.child(delete_before_replace=True,depends_on=[pwb_alb_int]),
+        )
+        pulumi.export("alb_listener_int_arn", alb_listener_int.arn)
+
+
+        # --------------------------------------------------------------------------
+        # Route53 for demo.pcluster.soleng.posit.it
+        # --------------------------------------------------------------------------
+
+        # Get the hosted zone for soleng.posit.it
+        soleng_zone = lookups.lookup("zone", route53.get_zone_output, ["id"], name="soleng.posit.it")
+
+        # Create an A record for demo.pcluster.soleng.posit.it
+        # This assumes you have an ALB resource named 'alb'
+        dns_record_ext = route53.Record(
+            "pwb-dns-record-ext",
+            zone_id=soleng_zone.id,
+            name=stack_name + "-ext.pcluster.soleng.posit.it",
+            type="A",
+            aliases=[route53.RecordAliasArgs(
+                name=pwb_alb_ext.dns_name,
+                zone_id=pwb_alb_ext.zone_id,
+                evaluate_target_health=True,
+            )],
+            opts=self.child(delete_before_replace=True,depends_on=[pwb_alb_ext])
+        )
+
+        pulumi.export("pwb_url_ext", dns_record_ext.fqdn)
+
+        dns_record_int = route53.Record(
+            "pwb-dns-record-int",
+            zone_id=soleng_zone.id,
+            name=stack_name + ".pcluster.soleng.posit.it",
+            type="A",
+            aliases=[route53.RecordAliasArgs(
+                name=pwb_alb_int.dns_name,
+                zone_id=pwb_alb_int.zone_id,
+                evaluate_target_health=True,
+            )],
+            opts=self.child(delete_before_replace=True,depends_on=[pwb_alb_int])
+        )
+
+        pulumi.export("pwb_url_int", dns_record_int.fqdn)
+
+
+        self.register_outputs({})
+
+
 def main():
     config = ConfigValues()
 
@@ -128,6 +1028,9 @@ def main():
     stack_name = pulumi.get_stack()
     pulumi.export("stack_name", stack_name)
 
+    # Data source lookups run concurrently (output form invokes), cf. lookups.py
+    lookups = LookupCache.from_env(stack_name)
+
     # --------------------------------------------------------------------------
     # Pulumi secrets
     # --------------------------------------------------------------------------
@@ -214,40 +1117,29 @@ def main():
     #     private_dns_enabled=True,  # Enable private DNS for this endpoint
     # )
 
-    vpc = ec2.get_vpc(filters=[ec2.GetVpcFilterArgs(
-            name="tag:Name",
-            values=["shared"]
-        )])
-    
+    vpc = lookups.lookup("vpc", ec2.get_vpc_output, ["id", "cidr_block"],
+                         filters=[{"name": "tag:Name", "values": ["shared"]}])
 
-    public_subnets = ec2.get_subnets(filters=[
-    ec2.GetSubnetsFilterArgs(
-        name="vpc-id",
-        values=[vpc.id]
-    ),
-    ec2.GetSubnetsFilterArgs(
-        name="tag:Name",
-        values=["*public*"]
-    )
+    # Both subnet lookups only wait for the VPC lookup
+    public_subnets = lookups.lookup("public_subnets", ec2.get_subnets_output, ["ids"], filters=[
+        {"name": "vpc-id", "values": [vpc.id]},
+        {"name": "tag:Name", "values": ["*public*"]},
     ])
 
     # Export the subnet IDs
     pulumi.export("public_subnet_ids", public_subnets.ids)
 
-    private_subnets = ec2.get_subnets(filters=[
-    ec2.GetSubnetsFilterArgs(
-        name="vpc-id",
-        values=[vpc.id]
-    ),
-    ec2.GetSubnetsFilterArgs(
-        name="tag:Name",
-        values=["*private*"]
-    )
+    private_subnets = lookups.lookup("private_subnets", ec2.get_subnets_output, ["ids"], filters=[
+        {"name": "vpc-id", "values": [vpc.id]},
+        {"name": "tag:Name", "values": ["*private*"]},
     ])
 
     # Export the subnet IDs
     pulumi.export("private_subnet_ids", private_subnets.ids)
 
+    pulumi.export("vpc_public_subnet", public_subnets.ids[0])
+    pulumi.export("vpc_private_subnet", private_subnets.ids[0])
+
     # --------------------------------------------------------------------------
     # ELB access from within AWS ParallelCluster
     # --------------------------------------------------------------------------
@@ -263,7 +1155,11 @@ def main():
                                     "elasticloadbalancing:DescribeTargetGroups",
                                     "elasticloadbalancing:DescribeLoadBalancers",
                                     "elasticloadbalancing:DescribeTargetHealth",
-                                    "elasticloadbalancing:RegisterTargets"
+                                    "elasticloadbalancing:RegisterTargets",
+                                    # replaced login nodes (pwb_alb.py reconcile) and rolling
+                                    # restarts (pwb_restart.py, drains by the deregistration delay)
+                                    "elasticloadbalancing:DeregisterTargets",
+                                    "elasticloadbalancing:DescribeTargetGroupAttributes"
                                 ],
                                 "Effect": "Allow",
                                 "Resource": "*",
@@ -308,7 +1204,7 @@ def main():
     policy = iam.Policy("s3access",
                         path="/",
                         description="S3 Access from login nodes of parallelcluster",
-                        policy=json.dumps({
+                        policy=pulumi.Output.json_dumps({
                             "Version": "2012-10-17",
                             "Statement": [{
                                 "Action": [
@@ -320,6 +1216,11 @@ def main():
                                 ],
                                 "Effect": "Allow",
                                 "Resource": "*",
+                            }, {
+                                # Workbench and launcher logs, cf. pwb_logship.py
+                                "Action": ["s3:PutObject"],
+                                "Effect": "Allow",
+                                "Resource": pulumi.Output.concat(s3bucket.arn, "/logs/*"),
                             }],
                         }))
 
@@ -368,567 +1269,25 @@ def main():
 
 
     # --------------------------------------------------------------------------
-    # Posit Workbench DB (PostgreSQL)
+    # Tiers, enabled per stack via the tiers config value
     # --------------------------------------------------------------------------
 
-    rsw_security_group_db = ec2.SecurityGroup(
-        "postgres",
-        description="Security group for PostgreSQL access",
-        ingress=[
-            {"protocol": "TCP", "from_port": 5432, "to_port": 5432,
-             'cidr_blocks': [vpc.cidr_block], "description": "PostgreSQL DB"}
-        ],
-        egress=[
-            {"protocol": "All", "from_port": 0, "to_port": 0,
-             'cidr_blocks': ['0.0.0.0/0'], "description": "Allow all outbound traffic"},
-        ],
-        tags=tags,
-        vpc_id=vpc.id
-    )
-    pulumi.export("rsw_security_group_db", rsw_security_group_db.id)
-
-    subnetgroup = rds.SubnetGroup("postgresdbsubnetgroup",
-                                  subnet_ids=private_subnets.ids,
-                                  tags={
-                                      "Name": "Postgres subnet group",
-                                  })
-
-    # Default DB 
-
-    rsw_db_pass = get_password("rsw_db_pass")
-    pulumi.export("rsw_db_pass", pulumi.Output.secret(rsw_db_pass))
-
-    rsw_db = rds.Instance(
-        "rsw-db",
-        instance_class="db.t4g.micro",
-        allocated_storage=5,
-        backup_retention_period=7,
-        username=config.rsw_db_username,
-        password=rsw_db_pass,
-        db_name="pwb",
-        engine="postgres",
-        publicly_accessible=False,
-        skip_final_snapshot=True,
-        tags=tags | {"Name": "pwb-db"},
-        vpc_security_group_ids=[rsw_security_group_db.id],
-        db_subnet_group_name=subnetgroup,
-        storage_encrypted=True,
-        performance_insights_enabled=True, # TODO: Update pro-actively to Database Insights standard
-        copy_tags_to_snapshot=True
-    )
-    pulumi.export("rsw_db_port", rsw_db.port)
-    pulumi.export("rsw_db_address", rsw_db.address)
-    pulumi.export("rsw_db_endpoint", rsw_db.endpoint)
-    pulumi.export("rsw_db_name", rsw_db.db_name)
-    pulumi.export("rsw_db_user", config.rsw_db_username)
-
-
-    # Audit DB 
-
-    rsw_audit_db_pass = get_password("rsw_audit_db_pass")
-    pulumi.export("rsw_audit_db_pass", pulumi.Output.secret(rsw_audit_db_pass))
-
-    rsw_audit_db = rds.Instance(
-        "rsw-audit-db",
-        instance_class="db.t4g.micro",
-        allocated_storage=5,
-        backup_retention_period=7,
-        username=config.rsw_db_username,
-        password=rsw_audit_db_pass,
-        db_name="audit",
-        engine="postgres",
-        publicly_accessible=False,
-        skip_final_snapshot=True,
-        tags=tags | {"Name": "pwb-audit-db"},
-        vpc_security_group_ids=[rsw_security_group_db.id],
-        db_subnet_group_name=subnetgroup,
-        storage_encrypted=True,
-        performance_insights_enabled=True, # TODO: Update pro-actively to Database Insights standard
-        copy_tags_to_snapshot=True
-    )
-    pulumi.export("rsw_audit_db_port", rsw_audit_db.port)
-    pulumi.export("rsw_audit_db_address", rsw_audit_db.address)
-    pulumi.export("rsw_audit_db_endpoint", rsw_audit_db.endpoint)
-    pulumi.export("rsw_audit_db_name", rsw_audit_db.db_name)
-    pulumi.export("rsw_audit_db_user", config.rsw_db_username)
+    pulumi.export("tiers", config.tiers)
 
-    # --------------------------------------------------------------------------
-    # SLURM Accounting DB (MySQL)
-    # --------------------------------------------------------------------------
+    if "data" in config.tiers:
+        DataTier("data", config, tags, stack_name, vpc, private_subnets, lookups)
 
-    slurm_security_group_db = ec2.SecurityGroup(
-        "mysql",
-        description="Security group for MySQL access",
-        ingress=[
-            {"protocol": "TCP", "from_port": 3306, "to_port": 3306,
-             'cidr_blocks': [vpc.cidr_block], "description": "MySQL DB"}
-        ],
-        egress=[
-            {"protocol": "All", "from_port": 0, "to_port": 0,
-             'cidr_blocks': ['0.0.0.0/0'], "description": "Allow all outbound traffic"},
-        ],
-        tags=tags,
-        vpc_id=vpc.id
-    )
-    pulumi.export("slurm_security_group_db", slurm_security_group_db.id)
-
-    slurm_db_pass = get_password("slurm_db_pass")
-    pulumi.export("slurm_db_pass", pulumi.Output.secret(slurm_db_pass))
-
-    secret = secretsmanager.Secret(f"SlurmDBPassword-{stack_name}")
-    slurm_db_pass_sec = secretsmanager.SecretVersion(f"SlurmDBPassword-{stack_name}",
-                                           secret_id=secret.id,
-                                           secret_string=slurm_db_pass)
-    pulumi.export("slurm_db_pass_arn", slurm_db_pass_sec.arn)
-
-    mysql_param_group = rds.ParameterGroup(
-    "mysql-encryption-param-group",
-    family="mysql8.0",  # adjust to your MySQL version
-    description="Custom MySQL parameter group enforcing encryption in transit",
-    parameters=[
-        rds.ParameterGroupParameterArgs(
-            name="require_secure_transport",
-            value="1",
-        ),
-    ],
-)
-
-    slurm_db = rds.Instance(
-        "slurm-db",
-        instance_class="db.t4g.medium",
-        allocated_storage=5,
-        backup_retention_period=7,
-        username=config.slurm_db_username,
-        password=slurm_db_pass,
-        db_name="slurm",
-        engine="mysql",
-        publicly_accessible=False,
-        skip_final_snapshot=True,
-        tags=tags | {"Name": "slurm-db"},
-        vpc_security_group_ids=[slurm_security_group_db.id],
-        db_subnet_group_name=subnetgroup,
-        parameter_group_name=mysql_param_group.name,
-        performance_insights_enabled=True,
-        performance_insights_retention_period=7,
-        storage_encrypted=True,
-        copy_tags_to_snapshot=True
-    )
-
-    pulumi.export("slurm_db_port", slurm_db.port)
-    pulumi.export("slurm_db_address", slurm_db.address)
-    pulumi.export("slurm_db_endpoint", slurm_db.endpoint)
-    pulumi.export("slurm_db_name", slurm_db.db_name)
-    pulumi.export("slurm_db_user", config.slurm_db_username)
-
-    # --------------------------------------------------------------------------
-    # Active Directory (SimpleAD)
-    # --------------------------------------------------------------------------
-
-    ad_password = get_password("ad_password")
-    pulumi.export("ad_password", pulumi.Output.secret(ad_password))
-    
-    secret = secretsmanager.Secret(f"SimpleADPassword-{stack_name}")
-    ad_password_sec = secretsmanager.SecretVersion(f"SimpleADPassword-{stack_name}",
-                                           secret_id=secret.id,
-                                           secret_string=ad_password)
-    pulumi.export("ad_password_arn", ad_password_sec.arn)
-
-    ad = directoryservice.Directory("pwb_directory",
-                                    name=config.domain_name,
-                                    password=ad_password,
-                                    # edition="Standard",
-                                    type="SimpleAD",
-                                    size="Small",
-                                    description="Directory for PWB environment",
-                                    vpc_settings=directoryservice.DirectoryVpcSettingsArgs(
-                                        vpc_id=vpc.id,
-                                        subnet_ids=private_subnets.ids,
-                                    ),
-                                    tags=tags | {"Name": f"pwb-directory-{stack_name}"},
-                                    )
-    pulumi.export('ad_dns_1', ad.dns_ip_addresses[0])
-    pulumi.export('ad_dns_2', ad.dns_ip_addresses[1])
-    pulumi.export('ad_access_url', ad.access_url)
-
-    # --------------------------------------------------------------------------
-    # Jump Host (AD)
-    # --------------------------------------------------------------------------
-
-     
-
-    ssh_security_group = ec2.SecurityGroup(
-        "ssh",
-        description="ssh access ",
-        ingress=[
-            {"protocol": "TCP", "from_port": 22, "to_port": 22,
-             'cidr_blocks': [vpc.cidr_block], "description": "SSH"},
-        ],
-        egress=[
-            {"protocol": "All", "from_port": 0, "to_port": 0,
-             'cidr_blocks': ['0.0.0.0/0'], "description": "Allow all outbout traffic"},
-        ],
-        tags=tags,
-        vpc_id=vpc.id
-    )
-    pulumi.export("ssh_security_group", ssh_security_group.id)
-
-    # Fetch the most recent Ubuntu 20.04 AMI with HVM and x86_64 architecture in the specified region
-    ami = ec2.get_ami(most_recent=True,
-                        owners=["099720109477"],  # Canonical
-                        filters=[
-                            {"name": "name", "values": ["ubuntu/images/hvm-ssd/ubuntu-focal-20.04-amd64-server-*"]},
-                            {"name": "architecture", "values": ["x86_64"]},
-                            {"name": "virtualization-type", "values": ["hvm"]},
-                        ],
-                        opts=pulumi.InvokeOptions(provider=Provider("test",region=get_region().name)))
-
-    # Export the AMI ID
-    pulumi.export("ami_id", ami.id)
-
-    jump_host = make_server(
-        "jump_host",
-        "ad",
-        tags=tags | {"Name": f"jump-host-ad-{stack_name}"},
-        vpc_group_ids=[ssh_security_group.id],
-        instance_type=config.ServerInstanceType,
-        subnet_id=private_subnets.ids[0],
-        ami=ami.id,
-        key_name=key_pair.key_name
-    )
-
-    pulumi.export("vpc_public_subnet", public_subnets.ids[0])
-    pulumi.export("vpc_private_subnet", private_subnets.ids[0])
-    pulumi.export("jump_host_dns", jump_host.private_dns)
-    pulumi.export("jump_host_public_ip", jump_host.private_ip)
-    pulumi.export("jump_host_instance_id", jump_host.id)
-
-    connection = remote.ConnectionArgs(
-        host=jump_host.private_ip,  # host=jump_host.id,
-        user="ubuntu",
-        #private_key=Path(f"{key_pair.key_name}.pem").read_text()
-        private_key=ssh_key.private_key_openssh
-    )
-
-    command_set_environment_variables = remote.Command(
-        f"set-env",
-        create=pulumi.Output.concat(
-            'echo "export AD_PASSWD=', ad_password, '" >> .env;\n',
-            'echo "export AD_DOMAIN=', config.domain_name, '" >> .env;\n',
-        ),
-
-        connection=connection,
-        opts=pulumi.ResourceOptions(depends_on=jump_host)
-    )
-
-    command_install_justfile = remote.Command(
-        f"install-justfile",
-        create="\n".join([
-            """curl --proto '=https' --tlsv1.2 -sSf https://just.systems/install.sh | bash -s -- --to ~/bin;""",
-            """echo 'export PATH="$PATH:$HOME/bin"' >> ~/.bashrc;"""
-        ]),
-        opts=pulumi.ResourceOptions(depends_on=jump_host),
-        connection=connection
-    )
-
-    justfile_asset = pulumi.FileAsset("server-side-files/justfile")
-    command_copy_justfile = remote.CopyToRemote(
-        f"copy-justfile",
-        source=justfile_asset,
-        remote_path='justfile',
-        connection=connection,
-        opts=pulumi.ResourceOptions(depends_on=jump_host),
-        triggers=[hash_file("server-side-files/justfile")]
-    )
-
-    # Copy the server side files
-    @dataclass
-    class serverSideFile:
-        file_in: str
-        file_out: str
-        template_render_command: pulumi.Output
-
-    server_side_files = [
-        serverSideFile(
-            "server-side-files/config/krb5.conf",
-            "~/krb5.conf",
-            pulumi.Output.all().apply(
-                lambda x: create_template("server-side-files/config/krb5.conf").render(domain_name=config.domain_name))
-
-        ),
-        serverSideFile(
-            "server-side-files/config/resolv.conf",
-            "~/resolv.conf",
-            pulumi.Output.all(config.domain_name, ad.dns_ip_addresses, config.aws_region).apply(
-                lambda x: create_template("server-side-files/config/resolv.conf").render(domain_name=x[0], dns1=x[1][0],
-                                                                                         dns2=x[1][1], aws_region=x[2]))
-        ),
-        serverSideFile(
-            "server-side-files/config/create-users.exp",
-            "~/create-users.exp",
-            pulumi.Output.all(config.domain_name, ad_password).apply(
-                lambda x: create_template("server-side-files/config/create-users.exp").render(domain_name=x[0],
-                                                                                              ad_password=x[1]))
-        ),
-        serverSideFile(
-            "server-side-files/config/create-group.exp",
-            "~/create-group.exp",
-            pulumi.Output.all(config.domain_name, ad_password).apply(
-                lambda x: create_template("server-side-files/config/create-group.exp").render(domain_name=x[0],
-                                                                                              ad_password=x[1]))
-        ),
-        serverSideFile(
-            "server-side-files/config/add-group-member.exp",
-            "~/add-group-member.exp",
-            pulumi.Output.all(config.domain_name, ad_password).apply(
-                lambda x: create_template("server-side-files/config/add-group-member.exp").render(domain_name=x[0],
-                                                                                                  ad_password=x[1]))
-        ),
-        serverSideFile(
-            "server-side-files/config/useradd.sh",
-            "~/useradd.sh",
-            pulumi.Output.all(config.domain_name, ad_password, posit_user_pass).apply(
-                lambda x: create_template("server-side-files/config/useradd.sh").render(domain_name=x[0],
-                                                                                        ad_password=x[1],
-                                                                                        user_pass=x[2]))
-        ),
-    ]
-
-    command_copy_config_files = []
-    for f in server_side_files:
-        if True:
-            command_copy_config_files.append(
-                remote.Command(
-                    f"copy {f.file_out} server",
-                    create=pulumi.Output.concat('echo "', f.template_render_command, f'" > {f.file_out}'),
-                    connection=connection,
-                    triggers=[hash_file(f.file_in)],
-                    opts=pulumi.ResourceOptions(depends_on=jump_host)
-                )
-            )
-
-    command_build_jumphost = remote.Command(
-        f"build-jump-host",
-        # create="alias just='/home/ubuntu/bin/just'; just build-rsw",
-        create="""export PATH="$PATH:$HOME/bin"; just integrate-ad""",
-        connection=connection,
-        opts=pulumi.ResourceOptions(depends_on=[jump_host, command_set_environment_variables, command_install_justfile,
-                                                command_copy_justfile] + command_copy_config_files)
-    )
-
-    #########################################################################
-    # Section: Public Load Balancer
-    # Date: 2024-12-13
-    #########################################################################
-
-    # Security group for the public ALB
-    alb_sg = ec2.SecurityGroup(
-        f"pwb-alb-sg-{stack_name}",
-        description="Security group for public ALB",
-        vpc_id=vpc.id,
-        ingress=[
-            ec2.SecurityGroupIngressArgs(
-                protocol="tcp",
-                from_port=443,
-                to_port=443,
-                cidr_blocks=["0.0.0.0/0"],
-                description="Allow HTTPS from anywhere",
-            ),
-            ec2.SecurityGroupIngressArgs(
-                protocol="tcp",
-                from_port=8787,
-                to_port=8787,
-                cidr_blocks=["0.0.0.0/0"],
-                description="Allow TCP 8787 from anywhere",
-            ),
-        ],
-        egress=[
-            ec2.SecurityGroupEgressArgs(
-                protocol="-1",
-                from_port=0,
-                to_port=0,
-                cidr_blocks=["0.0.0.0/0"],
-                description="Allow all outbound traffic",
-            )
-        ],
-        tags=tags | {"Name": f"pwb-alb-sg-{stack_name}"},
-    )
-
-    lb_security_group = ec2.SecurityGroup(
-        f"public-nlb-secgrp-{stack_name}",
-        name=f"public-nlb-secgrp-{stack_name}",
-        vpc_id=vpc.id,
-        ingress=[
-            # Allow all 80/443 incoming
-            ec2.SecurityGroupIngressArgs(
-                from_port=443,
-                to_port=443,
-                protocol="tcp",
-                cidr_blocks=["0.0.0.0/0"],
-            )
-        ],
-        egress=[
-            # Allow outbound traffic to private subnet HTTP only
-            ec2.SecurityGroupEgressArgs(
-                from_port=443,
-                to_port=443,
-                protocol="tcp",
-                cidr_blocks=[vpc.cidr_block]
-            )
-        ],
-        tags=tags,
-        opts=pulumi.ResourceOptions(delete_before_replace=True),
-    )
-
-    # Create an internal and public(ext) Application Load Balancer
-    pwb_alb_ext = lb.LoadBalancer(
-        f"pwb-alb-ext-{stack_name}",
-        name=f"pwb-alb-ext-{stack_name}",
-        internal=False, # This makes it a public-facing ALB
-        load_balancer_type="application",
-        security_groups=[alb_sg.id],
-        subnets=public_subnets.ids, # Place it in public subnets
-        tags=tags | {"Name": f"pwb-alb-ext-{stack_name}"},
-        opts=pulumi.ResourceOptions(delete_before_replace=True),
-    )
-    pulumi.export("pwb_alb_ext_arn", pwb_alb_ext.arn)
-    pulumi.export("pwb_alb_ext_dns_name", pwb_alb_ext.dns_name)
-
-    pwb_alb_int = lb.LoadBalancer(
-        f"pwb-alb-int-{stack_name}",
-        name=f"pwb-alb-int-{stack_name}",
-        internal=True,
-        load_balancer_type="application",
-        security_groups=[alb_sg.id],
-        subnets=public_subnets.ids, # Place it in public subnets
-        tags=tags | {"Name": f"pwb-alb-int-{stack_name}"},
-        opts=pulumi.ResourceOptions(delete_before_replace=True),
-    )
-    pulumi.export("pwb_alb_int_arn", pwb_alb_int.arn)
-    pulumi.export("pwb_alb_int_dns_name", pwb_alb_int.dns_name)
-
-    # Get the ACM certificate
-    cert = acm.get_certificate(domain="*.pcluster.soleng.posit.it",
-                               most_recent=True,
-                               statuses=["ISSUED"])
-
-    # Create a target group for the ALB.
-    # The head node will register itself with this target group.
-    alb_target_group_ext = lb.TargetGroup(
-        f"pwb-alb-tg-ext-{stack_name}",
-        port=8787, # The internal service port
-        protocol="HTTP",
-        vpc_id=vpc.id,
-        target_type="ip",
-        stickiness=lb.TargetGroupStickinessArgs(
-            type="app_cookie",
-            cookie_name="rs-csrf-token",
-            enabled=True,
-        ),
-        health_check=lb.TargetGroupHealthCheckArgs(
-            enabled=True,
-            protocol="HTTP",
-            path="/",
-            port="traffic-port",
-            matcher="302", # RStudio Workbench redirects with a 302
-        ),
-        tags=tags | {"Name": f"pwb-alb-tg-ext-{stack_name}"},
-    )
-    pulumi.export("alb_target_group_ext_arn", alb_target_group_ext.arn)
-
-    alb_target_group_int = lb.TargetGroup(
-        f"pwb-alb-tg-int-{stack_name}",
-        port=8787, # The internal service port
-        protocol="HTTP",
-        vpc_id=vpc.id,
-        target_type="ip",
-        stickiness=lb.TargetGroupStickinessArgs(
-            type="app_cookie",
-            cookie_name="rs-csrf-token",
-            enabled=True,
-        ),
-        health_check=lb.TargetGroupHealthCheckArgs(
-            enabled=True,
-            protocol="HTTP",
-            path="/",
-            port="traffic-port",
-            matcher="302", # RStudio Workbench redirects with a 302
-        ),
-        tags=tags | {"Name": f"pwb-alb-tg-int-{stack_name}"},
-    )
-    pulumi.export("alb_target_group_int_arn", alb_target_group_int.arn)
-
-
-    # Create a listener for HTTPS traffic
-    alb_listener_ext = lb.Listener(
-        f"pwb-alb-listener-ext-{stack_name}",
-        load_balancer_arn=pwb_alb_ext.arn,
-        port=443,
-        protocol="HTTPS",
-        certificate_arn=cert.arn,
-        default_actions=[lb.ListenerDefaultActionArgs(
-            type="forward",
-            target_group_arn=alb_target_group_ext.arn,
-        )],
-        tags=tags,
-        opts=pulumi.ResourceOptions(delete_before_replace=True,depends_on=[pwb_alb_ext]),
-    )
-    pulumi.export("alb_listener_ext_arn", alb_listener_ext.arn)
-
-    alb_listener_int = lb.Listener(
-        f"pwb-alb-listener-int-{stack_name}",
-        load_balancer_arn=pwb_alb_int.arn,
-        port=443,
-        protocol="HTTPS",
-        certificate_arn=cert.arn,
-        default_actions=[lb.ListenerDefaultActionArgs(
-            type="forward",
-            target_group_arn=alb_target_group_int.arn,
-        )],
-        tags=tags,
-        opts=pulumi.ResourceOptions(delete_before_replace=True,depends_on=[pwb_alb_int]),
-    )
-    pulumi.export("alb_listener_int_arn", alb_listener_int.arn)
-
-
-    # --------------------------------------------------------------------------
-    # Route53 for demo.pcluster.soleng.posit.it
-    # --------------------------------------------------------------------------
-
-    # Get the hosted zone for soleng.posit.it
-    soleng_zone = route53.get_zone(name="soleng.posit.it")
-
-    # Create an A record for demo.pcluster.soleng.posit.it
-    # This assumes you have an ALB resource named 'alb'
-    dns_record_ext = route53.Record(
-        "pwb-dns-record-ext",
-        zone_id=soleng_zone.id,
-        name=stack_name + "-ext.pcluster.soleng.posit.it",
-        type="A",
-        aliases=[route53.RecordAliasArgs(
-            name=pwb_alb_ext.dns_name,
-            zone_id=pwb_alb_ext.zone_id,
-            evaluate_target_health=True,
-        )],
-        opts=pulumi.ResourceOptions(delete_before_replace=True,depends_on=[pwb_alb_ext])
-    )
-
-    pulumi.export("pwb_url_ext", dns_record_ext.fqdn)
-
-    dns_record_int = route53.Record(
-        "pwb-dns-record-int",
-        zone_id=soleng_zone.id,
-        name=stack_name + ".pcluster.soleng.posit.it",
-        type="A",
-        aliases=[route53.RecordAliasArgs(
-            name=pwb_alb_int.dns_name,
-            zone_id=pwb_alb_int.zone_id,
-            evaluate_target_health=True,
-        )],
-        opts=pulumi.ResourceOptions(delete_before_replace=True,depends_on=[pwb_alb_int])
-    )
+    directory = None
+    if "directory" in config.tiers:
+        directory = DirectoryTier("directory", config, tags, stack_name, vpc, private_subnets)
 
-    pulumi.export("pwb_url_int", dns_record_int.fqdn)
+    if "bootstrap" in config.tiers:
+        BootstrapTier("bootstrap", config, tags, stack_name, vpc, private_subnets, lookups,
+                      key_pair, ssh_key, posit_user_pass, directory)
 
+    if "edge" in config.tiers:
+        EdgeTier("edge", tags, stack_name, vpc, public_subnets, lookups)
 
 
-main()
+if __name__ == "__main__":
+    main()
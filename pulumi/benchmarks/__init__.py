@@ -0,0 +1 @@
+"""Benchmarks for the pulumi program, run from the `pulumi` folder e.g. via `python -m benchmarks.program`."""
@@ -0,0 +1,169 @@
+"""Database endpoints of the Workbench databases with and without connection pooling.
+
+By default the program is run against the pulumi mocks once per `db_pooling`
+mode and the endpoints `deploy.sh` puts into `database.conf` and
+`audit-database.conf` (`rsw_db_pool_*`, `rsw_audit_db_pool_*`) are checked:
+the databases themselves, their RDS proxies or the pgbouncer instance.
+
+    cd pulumi && python -m benchmarks.database
+
+With `--pgbouncer`, the pgbouncer.ini of the `pgbouncer` mode is rendered for
+a local PostgreSQL instead (a stand-in for RDS, `pgbouncer` and `psql` need to
+be installed). `--clients` concurrent sessions are opened once directly and
+once through pgbouncer, the peak number of server connections and the wall time
+are reported for both.
+
+    python -m benchmarks.database --pgbouncer --pg-user postgres --pg-password secret --clients 50
+"""
+
+import argparse
+import os
+import runpy
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.mocks import CONFIG, PROGRAM, run_program
+
+DATABASES = ["rsw_db", "rsw_audit_db"]
+
+STACK = "benchmark"
+
+
+# ------------------------------------------------------------------------------
+# Pulumi mocks
+# ------------------------------------------------------------------------------
+
+def expected_endpoint(mode: str, db: str, exports: Dict) -> tuple:
+    """Address and port the Workbench servers should connect to, by the names of the mocks."""
+    if mode == "rds-proxy":
+        return (f"{db.replace('_', '-')}-proxy-{STACK}.proxy-mock.eu-west-1.rds.amazonaws.com", 5432)
+    if mode == "pgbouncer":
+        return (exports.get("pgbouncer_private_ip"), 6432)
+    return (f"{db.replace('_', '-')}.mock.eu-west-1.rds.amazonaws.com", 5432)
+
+
+def check_mocks(modes: List[str]) -> bool:
+    ok = True
+    print(f"{'db_pooling':<10} {'resources':>9} {'ms':>7}  endpoints")
+    for mode in modes:
+        mocks, seconds = run_program(dict(CONFIG, tiers="data", db_pooling=mode), stack=STACK)
+        endpoints = []
+        for db in DATABASES:
+            actual = (mocks.exports.get(f"{db}_pool_address"), mocks.exports.get(f"{db}_pool_port"))
+            expected = expected_endpoint(mode, db, mocks.exports)
+            ok &= actual == expected
+            endpoints.append(f"{db}={actual[0]}:{actual[1]}" + ("" if actual == expected else
+                                                              f" (expected {expected[0]}:{expected[1]})"))
+        print(f"{mode:<10} {len(mocks.resources):>9} {seconds * 1000:>7.1f}  " + "  ".join(endpoints))
+    return ok
+
+
+# ------------------------------------------------------------------------------
+# Local PostgreSQL/pgbouncer stand-in
+# ------------------------------------------------------------------------------
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def psql(host: str, port: int, user: str, password: str, database: str, sql: str) -> str:
+    env = dict(os.environ, PGPASSWORD=password, PGCONNECT_TIMEOUT="30")
+    result = subprocess.run(["psql", "-h", host, "-p", str(port), "-U", user, "-d", database,
+                             "-At", "-c", sql], env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return result.stdout.strip()
+
+
+def sessions(args, host: str, port: int, password: str, database: str) -> tuple:
+    """Wall time of `--clients` concurrent sessions and the peak number of server connections."""
+    count = (f"select count(*) from pg_stat_activity where datname = '{args.pg_database}' "
+             f"and pid <> pg_backend_pid()")
+    peak, done = [0], threading.Event()
+
+    def sample():
+        while not done.is_set():
+            n = int(psql(args.pg_host, args.pg_port, args.pg_user, args.pg_password, args.pg_database, count))
+            peak[0] = max(peak[0], n)
+            time.sleep(0.05)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=psql, args=(host, port, args.pg_user, password, database,
+                                                   f"select pg_sleep({args.sleep})"))
+               for _ in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    return elapsed, peak[0]
+
+
+def check_pgbouncer(args) -> bool:
+    program = runpy.run_path(str(PROGRAM), run_name="benchmark")
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        port = free_port()
+        client_password = "stand-in-pool-password"
+        databases = [dict(name=name, host=args.pg_host, port=args.pg_port, dbname=args.pg_database,
+                          user=args.pg_user, password=args.pg_password) for name in ("pwb", "audit")]
+        (tmp / "userlist.txt").write_text(f'"{args.pg_user}" "{client_password}"\n')
+        (tmp / "pgbouncer.ini").write_text(program["render_pgbouncer_ini"](
+            databases, args.pg_user, pool_mode=args.pool_mode, pool_size=args.pool_size, port=port,
+            auth_file=str(tmp / "userlist.txt"), socket_dir=str(tmp), server_tls_sslmode="prefer"))
+
+        bouncer = subprocess.Popen(["pgbouncer", str(tmp / "pgbouncer.ini")],
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        try:
+            for _ in range(50):
+                try:
+                    psql("127.0.0.1", port, args.pg_user, client_password, "pwb", "select 1")
+                    break
+                except RuntimeError:
+                    time.sleep(0.1)
+            direct = sessions(args, args.pg_host, args.pg_port, args.pg_password, args.pg_database)
+            pooled = sessions(args, "127.0.0.1", port, client_password, "pwb")
+        finally:
+            bouncer.terminate()
+            bouncer.wait()
+
+    print(f"{args.clients} sessions of {args.sleep} s, pool_mode={args.pool_mode} pool_size={args.pool_size}")
+    print(f"{'':<10} {'seconds':>8} {'peak server connections':>24}")
+    print(f"{'direct':<10} {direct[0]:>8.2f} {direct[1]:>24}")
+    print(f"{'pgbouncer':<10} {pooled[0]:>8.2f} {pooled[1]:>24}")
+    return pooled[1] <= args.pool_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", default="none,rds-proxy,pgbouncer", help="db_pooling modes to check")
+    parser.add_argument("--pgbouncer", action="store_true", help="run pgbouncer against a local PostgreSQL")
+    parser.add_argument("--pg-host", default="127.0.0.1")
+    parser.add_argument("--pg-port", type=int, default=5432)
+    parser.add_argument("--pg-user", default="postgres")
+    parser.add_argument("--pg-password", default=os.environ.get("PGPASSWORD", ""))
+    parser.add_argument("--pg-database", default="postgres")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--sleep", type=float, default=1.0, help="seconds each session runs pg_sleep()")
+    parser.add_argument("--pool-mode", default="session")
+    parser.add_argument("--pool-size", type=int, default=10)
+    args = parser.parse_args()
+
+    ok = check_pgbouncer(args) if args.pgbouncer else check_mocks(args.modes.split(","))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
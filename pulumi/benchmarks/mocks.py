@@ -0,0 +1,108 @@
+"""Pulumi mocks that allow running `__main__.py` without any cloud access."""
+
+import runpy
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import pulumi
+
+PROGRAM = Path(__file__).resolve().parents[1] / "__main__.py"
+
+PROJECT = "rsw-ha"
+
+CONFIG = {
+    "email": "benchmark@posit.co",
+    "domain_name": "pwb.posit.co",
+    "region": "eu-west-1",
+    "rsw_db_username": "pwb_db_admin",
+    "slurm_db_username": "slurm_db_admin",
+    "ServerInstanceType": "t3.medium",
+    "billing_code": "benchmark",
+    "my_ip": "127.0.0.1",
+}
+
+# Results of the data source invokes used by the program
+CALLS = {
+    "aws:ec2/getVpc:getVpc": {"id": "vpc-0123456789", "cidrBlock": "10.0.0.0/16"},
+    "aws:ec2/getSubnets:getSubnets": {"ids": ["subnet-0a", "subnet-0b"]},
+    "aws:ec2/getAmi:getAmi": {"id": "ami-0123456789"},
+    "aws:index/getRegion:getRegion": {"name": "eu-west-1", "id": "eu-west-1"},
+    "aws:acm/getCertificate:getCertificate": {"arn": "arn:aws:acm:eu-west-1:123456789012:certificate/mock"},
+    "aws:route53/getZone:getZone": {"id": "Z0123456789", "zoneId": "Z0123456789", "name": "soleng.posit.it"},
+}
+
+# Provider computed outputs the program depends on
+OUTPUTS = {
+    "random:index/randomPassword:RandomPassword": {"result": "Mock-Password-123"},
+    "tls:index/privateKey:PrivateKey": {"privateKeyOpenssh": "mock-private-key",
+                                        "publicKeyOpenssh": "ssh-rsa mock-public-key"},
+    "aws:directoryservice/directory:Directory": {"dnsIpAddresses": ["10.0.0.10", "10.0.0.11"]},
+    "aws:ec2/instance:Instance": {"privateIp": "10.0.0.20", "privateDns": "ip-10-0-0-20.internal"},
+    "aws:rds/instance:Instance": {"port": 5432},
+}
+
+# Outputs that differ per resource, by the name of the resource
+NAMED_OUTPUTS = {
+    "aws:rds/instance:Instance": lambda name: {"address": f"{name}.mock.eu-west-1.rds.amazonaws.com"},
+    "aws:rds/proxy:Proxy": lambda name: {"endpoint": f"{name}.proxy-mock.eu-west-1.rds.amazonaws.com"},
+}
+
+
+class Mocks(pulumi.runtime.Mocks):
+    """Records every resource registration and invoke of the program.
+
+    Every invoke takes `latency` seconds, as a stand-in for the round trip to AWS.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.resources: List[Tuple[str, str]] = []
+        self.calls: List[str] = []
+        # URNs of all registered resources incl. components and the stack
+        # outputs, set by run_program()
+        self.urns: List[str] = []
+        self.exports: Dict[str, Any] = {}
+
+    def new_resource(self, args: pulumi.runtime.MockResourceArgs):
+        self.resources.append((args.typ, args.name))
+        named = NAMED_OUTPUTS.get(args.typ, lambda name: {})(args.name)
+        return [f"{args.name}_id", {**args.inputs, **OUTPUTS.get(args.typ, {}), **named}]
+
+    def call(self, args: pulumi.runtime.MockCallArgs):
+        self.calls.append(args.token)
+        if self.latency:
+            time.sleep(self.latency)
+        return CALLS.get(args.token, {})
+
+
+def run_program(config: Dict[str, str] = None, stack: str = "benchmark",
+                latency: float = 0.0) -> Tuple[Mocks, float]:
+    """Run the pulumi program once against fresh mocks and return them and the wall time."""
+    # pulumi puts the program folder on sys.path for local modules, do the same
+    if str(PROGRAM.parent) not in sys.path:
+        sys.path.insert(0, str(PROGRAM.parent))
+    mocks = Mocks(latency)
+    pulumi.runtime.set_mocks(mocks, project=PROJECT, stack=stack, preview=True)
+    pulumi.runtime.set_all_config({f"{PROJECT}:{k}": v for k, v in (config or CONFIG).items()})
+
+    exports: Dict[str, Any] = {}
+
+    @pulumi.runtime.test
+    def program():
+        runpy.run_path(str(PROGRAM), run_name="__main__")
+        # resolved along with the program, one by one as unknown values are never resolved
+        return pulumi.Output.all(*[pulumi.Output.from_input(value).apply(
+            lambda v, name=name: mocks.exports.__setitem__(name, v)) for name, value in exports.items()])
+
+    export = pulumi.export
+    pulumi.export = lambda name, value: exports.__setitem__(name, value)
+    try:
+        start = time.perf_counter()
+        program()
+        elapsed = time.perf_counter() - start
+    finally:
+        pulumi.export = export
+    mocks.urns = list(pulumi.runtime.settings.get_monitor().resources)
+    return mocks, elapsed
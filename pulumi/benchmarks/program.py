@@ -0,0 +1,85 @@
+"""Micro-benchmark of the pulumi program construction time.
+
+Compares the former per-call template compilation and file hashing with the
+shared jinja2 environment and content-hash index of `__main__.py`, and times
+a full construction of the program against pulumi mocks.
+
+    cd pulumi && python -m benchmarks.program --repeat 20
+"""
+
+import argparse
+import hashlib
+import runpy
+import statistics
+import time
+
+import jinja2
+
+from benchmarks.mocks import PROGRAM, run_program
+
+SERVER_SIDE_FILES = [
+    "server-side-files/config/krb5.conf",
+    "server-side-files/config/resolv.conf",
+]
+
+VALUES = dict(domain_name="pwb.posit.co", dns1="10.0.0.10", dns2="10.0.0.11", aws_region="eu-west-1",
+              ad_password="Mock-Password-123", user_pass="Mock-Password-123")
+
+
+def legacy_pass(base_dir):
+    """What a preview used to do: compile inside every apply and reread for hashing."""
+    for path in SERVER_SIDE_FILES:
+        with open(base_dir / path, 'r') as f:
+            jinja2.Template(f.read()).render(**VALUES)
+        with open(base_dir / path, mode="r") as f:
+            hashlib.sha224(bytes(f.read(), encoding='utf-8')).hexdigest()
+    with open(base_dir / "server-side-files/justfile", mode="r") as f:
+        hashlib.sha224(bytes(f.read(), encoding='utf-8')).hexdigest()
+
+
+def cached_pass(program):
+    """The same work through the shared environment and content-hash index."""
+    index = program["FileIndex"](program["BASE_DIR"])
+    env = jinja2.Environment(loader=program["IndexedLoader"](index),
+                             bytecode_cache=program["TEMPLATES"].bytecode_cache, auto_reload=False)
+    for path in SERVER_SIDE_FILES:
+        env.get_template(path).render(**VALUES)
+        index.digest(path)
+    index.digest("server-side-files/justfile")
+
+
+def timings(fn, repeat):
+    result = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        result.append(time.perf_counter() - start)
+    return result
+
+
+def report(name, t):
+    print(f"{name:>24}: mean {statistics.mean(t) * 1000:8.2f} ms  "
+          f"min {min(t) * 1000:8.2f} ms  max {max(t) * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    # Only load the helpers, the program itself is run against mocks below
+    program = runpy.run_path(str(PROGRAM), run_name="benchmark")
+    base_dir = program["BASE_DIR"]
+
+    legacy = timings(lambda: legacy_pass(base_dir), args.repeat)
+    cached = timings(lambda: cached_pass(program), args.repeat)
+    report("templates+hashes legacy", legacy)
+    report("templates+hashes cached", cached)
+    print(f"{'speedup':>24}: {statistics.mean(legacy) / statistics.mean(cached):.1f}x")
+
+    construction = [run_program()[1] for _ in range(args.repeat)]
+    report("program construction", construction)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Startup time of the pulumi program with concurrent and cached data source lookups.
+
+Every invoke of the mocks takes `--latency` seconds as a stand-in for the round
+trip to AWS. Blocking invokes would add up all of them before the first resource
+is registered, the output form invokes of `lookups.py` only wait for the longest
+chain (VPC, then its subnets). The cached runs use the on-disk lookup cache of
+`pulumi preview` (`PWB_LOOKUP_CACHE_TTL`) in a temporary folder, the first of
+them fills the cache.
+
+    cd pulumi && python -m benchmarks.startup --latency 0.2 --repeat 5
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+
+from benchmarks.mocks import run_program
+
+
+def timings(latency, repeat):
+    result, calls = [], 0
+    for _ in range(repeat):
+        mocks, seconds = run_program(latency=latency)
+        result.append(seconds)
+        calls = len(mocks.calls)
+    return result, calls
+
+
+def report(name, t, calls):
+    print(f"{name:>16}: mean {statistics.mean(t) * 1000:8.1f} ms  min {min(t) * 1000:8.1f} ms  "
+          f"max {max(t) * 1000:8.1f} ms  {calls:>3} invokes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per invoke")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # warm up imports and the jinja2 bytecode cache
+    run_program()
+
+    os.environ.pop("PWB_LOOKUP_CACHE_TTL", None)
+    concurrent, calls = timings(args.latency, args.repeat)
+    report("concurrent", concurrent, calls)
+    print(f"{'sequential':>16}: at least {calls * args.latency * 1000:8.1f} ms spent in {calls} blocking invokes")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ["PWB_LOOKUP_CACHE_DIR"] = cache_dir
+        os.environ["PWB_LOOKUP_CACHE_TTL"] = "3600"
+        try:
+            cold, cold_calls = timings(args.latency, 1)
+            warm, warm_calls = timings(args.latency, args.repeat)
+        finally:
+            del os.environ["PWB_LOOKUP_CACHE_TTL"]
+            del os.environ["PWB_LOOKUP_CACHE_DIR"]
+    report("cache cold", cold, cold_calls)
+    report("cache warm", warm, warm_calls)
+
+
+if __name__ == "__main__":
+    main()
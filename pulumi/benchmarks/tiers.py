@@ -0,0 +1,84 @@
+"""Resource counts and construction time of the tiers of the pulumi program.
+
+Runs the program against the pulumi mocks once per tier (together with the
+tiers it needs) and once with all tiers, counts the resources below each tier
+component and checks them against `EXPECTED`. Resources outside of any tier
+(keys, S3 bucket, IAM policies, Workbench security groups) are counted as
+`core`. Exits with 1 if a count differs, e.g. because a resource was moved
+to another tier or lost its parent.
+
+    cd pulumi && python -m benchmarks.tiers --repeat 5
+"""
+
+import argparse
+import re
+import runpy
+import statistics
+import sys
+from collections import Counter
+from typing import Dict, List
+
+from benchmarks.mocks import CONFIG, PROGRAM, run_program
+
+# Resources per tier, without the tier component itself
+EXPECTED = {
+    "core": 12,
+    "data": 12,
+    "directory": 4,
+    "bootstrap": 5,
+    "edge": 10,
+}
+
+TIER_TYPE = re.compile(r"^rsw-ha:index:(\w+)Tier$")
+
+
+def count(urns: List[str]) -> Dict[str, int]:
+    """Resources per tier, by the parent types in their URNs."""
+    chains = [urn.split("::")[2].split("$") for urn in urns]
+    # the mocks only put the direct parent into URNs, components (types that are
+    # parents) are mapped to their own parent to resolve nested components
+    components = {types[-1]: types[-2] for types in chains
+                  if len(types) > 1 and any(t[-2:-1] == [types[-1]] for t in chains)}
+    counts = Counter()
+    for types in chains:
+        if TIER_TYPE.match(types[-1]):
+            continue
+        parent = types[-2] if len(types) > 1 else ""
+        while parent in components and not TIER_TYPE.match(parent):
+            parent = components[parent]
+        match = TIER_TYPE.match(parent)
+        counts[match.group(1).lower() if match else "core"] += 1
+    return dict(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    program = runpy.run_path(str(PROGRAM), run_name="benchmark")
+    tiers, requires = program["TIERS"], program["TIER_REQUIRES"]
+
+    # warm up imports and the jinja2 bytecode cache
+    run_program()
+
+    failed = False
+    print(f"{'tiers':<26} {'resources':>9} {'mean ms':>9} {'min ms':>9}  per tier")
+    for enabled in [[t] for t in tiers] + [tiers]:
+        enabled = [t for t in tiers if t in enabled or any(t in requires.get(e, []) for e in enabled)]
+        times, counts = [], {}
+        for _ in range(args.repeat):
+            mocks, seconds = run_program(dict(CONFIG, tiers=",".join(enabled)))
+            times.append(seconds)
+            counts = count(mocks.urns)
+        expected = {t: EXPECTED[t] for t in ["core"] + enabled}
+        status = "ok" if counts == expected else f"expected {expected}"
+        failed |= counts != expected
+        print(f"{','.join(enabled):<26} {sum(counts.values()):>9} {statistics.mean(times) * 1000:>9.1f} "
+              f"{min(times) * 1000:>9.1f}  "
+              + " ".join(f"{t}={n}" for t, n in sorted(counts.items())) + f"  {status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
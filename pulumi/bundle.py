@@ -0,0 +1,123 @@
+"""Delivery of all jump host files as one archive over a single SSH session.
+
+Every file is rendered into a deterministic tar.gz together with a MANIFEST
+of sha256 sums. The archive is streamed to the remote host via stdin of one
+`remote.Command`, where only files whose hash differs from the previously
+delivered manifest are unpacked.
+
+The remote side is a plain bash script (`UNPACK_SCRIPT`) that reads the base64
+encoded archive from stdin and unpacks below `$HOME`. `deliver_locally()` runs
+the very same script against a local directory as a stand-in for the jump host.
+"""
+
+import base64
+import hashlib
+import io
+import os
+import subprocess
+import tarfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import pulumi
+from pulumi_command import remote
+
+MANIFEST = "MANIFEST"
+
+UNPACK_SCRIPT = """set -e
+staging=$(mktemp -d)
+trap 'rm -rf "$staging"' EXIT
+base64 -d | tar xzf - -C "$staging"
+touch "$HOME/.bundle-manifest"
+while read -r sum path; do
+    if ! grep -qxF "$sum  $path" "$HOME/.bundle-manifest"; then
+        mkdir -p "$(dirname "$HOME/$path")"
+        cp --preserve=mode "$staging/files/$path" "$HOME/$path"
+        echo "updated $path"
+    fi
+done < "$staging/MANIFEST"
+cp "$staging/MANIFEST" "$HOME/.bundle-manifest"
+"""
+
+
+@dataclass
+class BundleFile:
+    """A file to deliver, `path` is relative to the remote home directory."""
+    path: str
+    content: str
+    mode: int = 0o600
+
+    def __post_init__(self):
+        self.path = self.path[2:] if self.path.startswith("~/") else self.path
+
+
+def digest(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def manifest(files: Sequence[BundleFile]) -> Dict[str, str]:
+    return {f.path: digest(f.content) for f in sorted(files, key=lambda f: f.path)}
+
+
+def _add(tar: tarfile.TarFile, name: str, data: bytes, mode: int):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = mode
+    # mtime and ownership are fixed so that identical inputs give identical archives
+    info.mtime = 0
+    info.uid = info.gid = 0
+    tar.addfile(info, io.BytesIO(data))
+
+
+def build_archive(files: Sequence[BundleFile]) -> bytes:
+    """Build a deterministic tar.gz with all files below files/ and the MANIFEST."""
+    entries = manifest(files)
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz", compresslevel=9) as tar:
+        for f in sorted(files, key=lambda f: f.path):
+            _add(tar, f"files/{f.path}", f.content.encode("utf-8"), f.mode)
+        _add(tar, MANIFEST, "".join(f"{s}  {p}\n" for p, s in entries.items()).encode("utf-8"), 0o644)
+    # gzip stores a timestamp in its header as well, zero it for reproducibility
+    data = bytearray(buffer.getvalue())
+    data[4:8] = b"\x00\x00\x00\x00"
+    return bytes(data)
+
+
+def encode(files: Sequence[BundleFile]) -> str:
+    return base64.b64encode(build_archive(files)).decode("ascii")
+
+
+def deliver_locally(files: Sequence[BundleFile], home: Path, post_script: str = "") -> List[str]:
+    """Run the remote unpack script with `home` as $HOME, return the updated paths."""
+    env = dict(os.environ, HOME=str(home))
+    result = subprocess.run(["bash", "-c", UNPACK_SCRIPT + post_script], input=encode(files),
+                            env=env, capture_output=True, text=True, check=True)
+    return [line.split(" ", 1)[1] for line in result.stdout.splitlines() if line.startswith("updated ")]
+
+
+class FileBundle(pulumi.ComponentResource):
+    """Ships a set of (possibly secret) files to a remote host in one transfer."""
+
+    def __init__(self,
+                 name: str,
+                 files: List[pulumi.Input[BundleFile]],
+                 connection: remote.ConnectionArgs,
+                 post_script: str = "",
+                 opts: Optional[pulumi.ResourceOptions] = None):
+        super().__init__("rsw-ha:index:FileBundle", name, None, opts)
+
+        bundle = pulumi.Output.all(*files)
+        payload = pulumi.Output.secret(bundle.apply(encode))
+        self.manifest = bundle.apply(manifest)
+
+        self.command = remote.Command(
+            f"{name}-deliver",
+            create=UNPACK_SCRIPT + post_script,
+            stdin=payload,
+            connection=connection,
+            triggers=[self.manifest.apply(lambda m: digest(repr(sorted(m.items()))))],
+            opts=pulumi.ResourceOptions(parent=self),
+        )
+
+        self.register_outputs({"manifest": self.manifest})
@@ -0,0 +1,103 @@
+"""Concurrent data source lookups with an optional on-disk cache for previews.
+
+The program looks up the shared VPC, its subnets, the jump host AMI, the ACM
+certificate and the Route53 zone. Each lookup goes through the output form of
+the invoke (e.g. `ec2.get_vpc_output`), so they all run concurrently while the
+resources are registered instead of one blocking round trip after the other.
+
+With `PWB_LOOKUP_CACHE_TTL=<seconds>` in the environment, `pulumi preview`
+keeps the results in `<cache dir>/<stack>.json` and reuses them for that long,
+e.g. in an edit/preview loop:
+
+    PWB_LOOKUP_CACHE_TTL=900 pulumi preview
+
+The cache dir is `PWB_LOOKUP_CACHE_DIR` or `$XDG_CACHE_HOME/pwbtools/lookups`.
+`pulumi up` always looks up fresh values (and refreshes the cache).
+"""
+
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+import pulumi
+
+
+def default_cache_dir() -> Path:
+    if "PWB_LOOKUP_CACHE_DIR" in os.environ:
+        return Path(os.environ["PWB_LOOKUP_CACHE_DIR"])
+    base = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    return Path(base) / "pwbtools" / "lookups"
+
+
+class LookupCache:
+    """Results of data source invokes by name and arguments, valid for `ttl` seconds."""
+
+    def __init__(self, path: Path, ttl: float, read: bool = True, scope: str = ""):
+        self.path = path
+        self.ttl = ttl
+        # part of every key, e.g. the region of the default provider
+        self.scope = scope
+        # up writes fresh results but never reads them
+        self.read = read
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if ttl > 0 and path.exists():
+            try:
+                self._entries = json.loads(path.read_text())
+            except ValueError:
+                # half-written by an interrupted run, start over
+                self._entries = {}
+
+    @classmethod
+    def from_env(cls, stack: str) -> "LookupCache":
+        ttl = float(os.environ.get("PWB_LOOKUP_CACHE_TTL", "0") or 0)
+        return cls(default_cache_dir() / f"{stack}.json", ttl, read=pulumi.runtime.is_dry_run(),
+                   scope=pulumi.Config("aws").get("region") or "")
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if not self.read or entry is None or time.time() - entry["time"] >= self.ttl:
+            return None
+        return entry["value"]
+
+    def put(self, key: str, value: Dict[str, Any]):
+        self._entries[key] = {"time": time.time(), "value": value}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=self.path.parent, delete=False) as f:
+            json.dump(self._entries, f, indent=1, sort_keys=True)
+        os.replace(f.name, self.path)
+
+    def lookup(self, name: str, invoke: Callable[..., pulumi.Output], fields: List[str], /,
+               **args) -> pulumi.Output:
+        """Output of `invoke(**args)` (an output form invoke) reduced to `fields`.
+
+        `args` may contain outputs of other lookups, the cache key is built
+        from the resolved arguments.
+        """
+        if not self.enabled:
+            return invoke(**args)
+
+        def resolve(resolved: Dict[str, Any]):
+            key = json.dumps([self.scope, name, resolved], sort_keys=True)
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return SimpleNamespace(**value)
+            self.misses += 1
+
+            def store(result):
+                value = {f: getattr(result, f) for f in fields}
+                self.put(key, value)
+                return SimpleNamespace(**value)
+            return invoke(**resolved).apply(store)
+
+        return pulumi.Output.from_input(args).apply(resolve)
@@ -0,0 +1,21 @@
+#!/bin/bash
+# Installs pgbouncer in front of the Workbench databases (db_pooling=pgbouncer)
+
+set -e
+
+apt-get update
+apt-get install -y pgbouncer
+
+cat << 'INI' > /etc/pgbouncer/pgbouncer.ini
+{{pgbouncer_ini}}
+INI
+
+cat << 'USERS' > /etc/pgbouncer/userlist.txt
+"{{client_user}}" "{{client_password}}"
+USERS
+
+chown postgres:postgres /etc/pgbouncer/pgbouncer.ini /etc/pgbouncer/userlist.txt
+chmod 0600 /etc/pgbouncer/pgbouncer.ini /etc/pgbouncer/userlist.txt
+
+systemctl enable pgbouncer
+systemctl restart pgbouncer
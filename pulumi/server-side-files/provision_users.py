@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""Bulk provisioning of the positNNNN users in the directory.
+
+Replaces the useradd.sh/expect fan-out: users are added with one LDAP add per
+user (password and enabled account included) over a small pool of
+connections, users that already exist are found with a single paged search
+and skipped, group memberships are added with one modify per group and batch
+of users, and each new user is verified with an LDAP bind instead of a PAM
+round trip through sssd.
+
+    python3 provision_users.py --count 1000 [--group rstudio-admins]
+
+Domain, bind password and user password are taken from AD_DOMAIN, AD_PASSWD
+and POSIT_USER_PASS (cf. ~/.env). `--flavor openldap` targets a plain slapd
+(inetOrgPerson/posixAccount below ou=people) instead of Active Directory, and
+`--server mock://` runs against the in-memory directory of ldap3, e.g.
+
+    python3 provision_users.py --server mock:// --flavor openldap --count 500
+
+Active Directory only accepts passwords over an encrypted connection, so the
+AD flavor uses StartTLS (or LDAPS with `--server ldaps://...`). Requires
+`ldap3` (`pip install 'ldap3>=2.9'`).
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import ssl
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Set
+
+import ldap3
+from ldap3.core.exceptions import LDAPException, LDAPNoSuchObjectResult
+
+log = logging.getLogger("provision_users")
+
+# GUID of the users container in wellKnownObjects, AWS directories redirect it to an OU
+WELL_KNOWN_USERS = "A9D1CA15768811D1ADED00C04FD8D5CD"
+
+# AD: NORMAL_ACCOUNT, enabled
+USER_ACCOUNT_CONTROL = 512
+
+# Members added per modify operation
+MEMBERS_BATCH_SIZE = 500
+
+# First uidNumber for the openldap flavor (AD relies on sssd ID mapping)
+FIRST_UID = 10000
+
+
+def base_dn(domain: str) -> str:
+    return ",".join(f"DC={part}" for part in domain.split("."))
+
+
+@dataclass
+class Settings:
+    server: str
+    domain: str
+    bind_user: str
+    bind_password: str
+    user_password: str
+    flavor: str = "ad"
+    users_dn: Optional[str] = None
+    pool_size: int = 8
+    validate_tls: bool = False
+
+    @property
+    def base_dn(self) -> str:
+        return base_dn(self.domain)
+
+    @property
+    def bind_dn(self) -> str:
+        if self.flavor == "ad":
+            return f"{self.bind_user}@{self.domain}"
+        return f"cn={self.bind_user},{self.base_dn}"
+
+
+class ActiveDirectory:
+    """Entries as adcli create-user/passwd-user would create them."""
+    name_attribute = "sAMAccountName"
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+
+    def user_dn(self, users_dn: str, name: str) -> str:
+        return f"CN={name},{users_dn}"
+
+    def default_users_dn(self, conn: ldap3.Connection) -> str:
+        conn.search(self.settings.base_dn, "(objectClass=*)", ldap3.BASE, attributes=["wellKnownObjects"])
+        for value in conn.entries[0].entry_attributes_as_dict.get("wellKnownObjects", []) if conn.entries else []:
+            # B:32:<GUID>:<DN>
+            _, _, guid, dn = value.split(":", 3)
+            if guid.upper() == WELL_KNOWN_USERS:
+                return dn
+        return f"CN=Users,{self.settings.base_dn}"
+
+    def user_attributes(self, name: str, uid: int) -> Dict[str, object]:
+        return {
+            "objectClass": ["top", "person", "organizationalPerson", "user"],
+            "sAMAccountName": name,
+            "userPrincipalName": f"{name}@{self.settings.domain}",
+            "unixHomeDirectory": f"/home/{name}",
+            "loginShell": "/bin/bash",
+            "unicodePwd": f'"{self.settings.user_password}"'.encode("utf-16-le"),
+            "userAccountControl": USER_ACCOUNT_CONTROL,
+        }
+
+    def group_dn(self, users_dn: str, name: str) -> str:
+        return f"CN={name},{users_dn}"
+
+    def group_attributes(self, name: str, members: List[str]) -> Dict[str, object]:
+        return {"objectClass": ["top", "group"], "sAMAccountName": name}
+
+    def verify_user(self, name: str, dn: str) -> str:
+        return f"{name}@{self.settings.domain}"
+
+
+class OpenLdap:
+    """inetOrgPerson/posixAccount entries for a plain slapd."""
+    name_attribute = "uid"
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+
+    def user_dn(self, users_dn: str, name: str) -> str:
+        return f"uid={name},{users_dn}"
+
+    def default_users_dn(self, conn: ldap3.Connection) -> str:
+        return f"ou=people,{self.settings.base_dn}"
+
+    def user_attributes(self, name: str, uid: int) -> Dict[str, object]:
+        return {
+            "objectClass": ["top", "inetOrgPerson", "posixAccount"],
+            "cn": name,
+            "sn": name,
+            "uid": name,
+            "uidNumber": uid,
+            "gidNumber": uid,
+            "homeDirectory": f"/home/{name}",
+            "loginShell": "/bin/bash",
+            "userPassword": self.settings.user_password,
+        }
+
+    def group_dn(self, users_dn: str, name: str) -> str:
+        return f"cn={name},{users_dn.replace('ou=people', 'ou=groups', 1)}"
+
+    def group_attributes(self, name: str, members: List[str]) -> Dict[str, object]:
+        # groupOfNames needs at least one member at creation time
+        return {"objectClass": ["top", "groupOfNames"], "cn": name, "member": members[:1]}
+
+    def verify_user(self, name: str, dn: str) -> str:
+        return dn
+
+
+FLAVORS = {"ad": ActiveDirectory, "openldap": OpenLdap}
+
+
+@dataclass
+class Report:
+    requested: int = 0
+    created: int = 0
+    skipped: int = 0
+    verified: int = 0
+    failed: List[str] = field(default_factory=list)
+    memberships: int = 0
+    seconds: float = 0.0
+
+    @property
+    def users_per_second(self) -> float:
+        return self.created / self.seconds if self.seconds else 0.0
+
+
+class ConnectionPool:
+    """A fixed set of bound connections, each LDAP call runs in a worker thread."""
+
+    def __init__(self, settings: Settings, server: ldap3.Server, strategy):
+        self.settings = settings
+        self.server = server
+        self.strategy = strategy
+        self.executor = ThreadPoolExecutor(max_workers=settings.pool_size)
+        self.idle: "asyncio.Queue[ldap3.Connection]" = asyncio.Queue()
+        self.connections: List[ldap3.Connection] = []
+
+    def connect(self, user: str, password: str) -> ldap3.Connection:
+        conn = ldap3.Connection(self.server, user=user, password=password, client_strategy=self.strategy,
+                                raise_exceptions=True)
+        if self.settings.flavor == "ad" and not self.server.ssl and self.strategy != ldap3.MOCK_SYNC:
+            conn.open()
+            conn.start_tls()
+        conn.bind()
+        return conn
+
+    async def call(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, fn, *args)
+
+    async def open(self, size: int):
+        for _ in range(size):
+            conn = await self.call(self.connect, self.settings.bind_dn, self.settings.bind_password)
+            self.connections.append(conn)
+            self.idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.idle.get()
+        try:
+            yield conn
+        finally:
+            self.idle.put_nowait(conn)
+
+    async def close(self):
+        for conn in self.connections:
+            await self.call(conn.unbind)
+        self.executor.shutdown()
+
+
+class Provisioner:
+    def __init__(self, settings: Settings, pool: ConnectionPool):
+        self.settings = settings
+        self.flavor = FLAVORS[settings.flavor](settings)
+        self.pool = pool
+        self.users_dn = settings.users_dn
+
+    async def prepare(self):
+        if self.users_dn is None:
+            async with self.pool.connection() as conn:
+                self.users_dn = await self.pool.call(self.flavor.default_users_dn, conn)
+        log.info("users are created below %s", self.users_dn)
+
+    def _search_existing(self, conn: ldap3.Connection, prefix: str) -> Set[str]:
+        attribute = self.flavor.name_attribute
+        entries = conn.extend.standard.paged_search(self.users_dn, f"({attribute}={prefix}*)",
+                                                    attributes=[attribute], paged_size=1000, generator=True)
+        return {e["attributes"][attribute] if isinstance(e["attributes"][attribute], str)
+                else e["attributes"][attribute][0] for e in entries if e.get("type") == "searchResEntry"}
+
+    async def existing_users(self, prefix: str) -> Set[str]:
+        async with self.pool.connection() as conn:
+            return await self.pool.call(self._search_existing, conn, prefix)
+
+    async def create_user(self, name: str, uid: int) -> bool:
+        dn = self.flavor.user_dn(self.users_dn, name)
+        async with self.pool.connection() as conn:
+            try:
+                await self.pool.call(conn.add, dn, None, self.flavor.user_attributes(name, uid))
+                return True
+            except LDAPException as e:
+                log.error("creating %s failed: %s", name, e)
+                return False
+
+    def _verify(self, name: str) -> bool:
+        dn = self.flavor.user_dn(self.users_dn, name)
+        try:
+            conn = self.pool.connect(self.flavor.verify_user(name, dn), self.settings.user_password)
+            conn.unbind()
+            return True
+        except LDAPException as e:
+            log.error("bind as %s failed: %s", name, e)
+            return False
+
+    async def verify(self, name: str) -> bool:
+        return await self.pool.call(self._verify, name)
+
+    def _add_members(self, conn: ldap3.Connection, group: str, members: List[str]) -> int:
+        dn = self.flavor.group_dn(self.users_dn, group)
+        added = 0
+        try:
+            conn.search(dn, "(objectClass=*)", ldap3.BASE, attributes=["member"])
+            existing = {m.lower() for m in conn.entries[0].entry_attributes_as_dict.get("member", [])}
+        except LDAPNoSuchObjectResult:
+            attributes = self.flavor.group_attributes(group, members)
+            conn.add(dn, None, attributes)
+            existing = {m.lower() for m in attributes.get("member", [])}
+            added = len(existing)
+        missing = [m for m in members if m.lower() not in existing]
+        for i in range(0, len(missing), MEMBERS_BATCH_SIZE):
+            conn.modify(dn, {"member": [(ldap3.MODIFY_ADD, missing[i:i + MEMBERS_BATCH_SIZE])]})
+        return added + len(missing)
+
+    async def add_members(self, group: str, names: List[str]) -> int:
+        members = [self.flavor.user_dn(self.users_dn, n) for n in names]
+        async with self.pool.connection() as conn:
+            return await self.pool.call(self._add_members, conn, group, members)
+
+    async def provision(self, names: List[str], groups: List[str], verify: bool = True) -> Report:
+        report = Report(requested=len(names))
+        started = time.monotonic()
+        await self.prepare()
+        existing = await self.existing_users(os.path.commonprefix(names) if names else "")
+        todo = [n for n in names if n not in existing]
+        report.skipped = len(names) - len(todo)
+        log.info("%d users requested, %d exist already", len(names), report.skipped)
+
+        uids = {n: FIRST_UID + i for i, n in enumerate(names)}
+        results = await asyncio.gather(*(self.create_user(n, uids[n]) for n in todo))
+        created = [n for n, ok in zip(todo, results) if ok]
+        report.created = len(created)
+        report.failed = [n for n, ok in zip(todo, results) if not ok]
+
+        if verify:
+            checks = await asyncio.gather(*(self.verify(n) for n in created))
+            report.verified = sum(checks)
+            report.failed += [n for n, ok in zip(created, checks) if not ok]
+
+        members = [n for n in names if n not in report.failed]
+        for group in groups:
+            report.memberships += await self.add_members(group, members)
+
+        report.seconds = time.monotonic() - started
+        return report
+
+
+def make_server(settings: Settings) -> ldap3.Server:
+    if settings.server.startswith("mock://"):
+        return ldap3.Server("mock")
+    tls = ldap3.Tls(validate=ssl.CERT_REQUIRED if settings.validate_tls else ssl.CERT_NONE)
+    return ldap3.Server(settings.server, tls=tls, connect_timeout=10)
+
+
+def seed_mock(server: ldap3.Server, settings: Settings, users_dn: str) -> ldap3.Connection:
+    """Populate the in-memory directory with the bind user and the containers."""
+    conn = ldap3.Connection(server, user=settings.bind_dn, password=settings.bind_password,
+                            client_strategy=ldap3.MOCK_SYNC)
+    conn.strategy.add_entry(settings.bind_dn, {"userPassword": settings.bind_password, "objectClass": "person"})
+    for dn in (users_dn, users_dn.replace("ou=people", "ou=groups", 1)):
+        conn.strategy.add_entry(dn, {"objectClass": "organizationalUnit"})
+    return conn
+
+
+async def run(settings: Settings, names: List[str], groups: List[str], verify: bool) -> Report:
+    server = make_server(settings)
+    strategy = ldap3.SYNC
+    if settings.server.startswith("mock://"):
+        strategy = ldap3.MOCK_SYNC
+        settings.users_dn = settings.users_dn or FLAVORS[settings.flavor](settings).default_users_dn(None)
+        seed_mock(server, settings, settings.users_dn)
+    pool = ConnectionPool(settings, server, strategy)
+    await pool.open(settings.pool_size)
+    try:
+        return await Provisioner(settings, pool).provision(names, groups, verify)
+    finally:
+        await pool.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=10, help="number of users")
+    parser.add_argument("--prefix", default="posit", help="user names are <prefix>NNNN")
+    parser.add_argument("--group", action="append", default=[], help="add all users to this group")
+    parser.add_argument("--server", help="LDAP URL (default: ldap://<AD_DOMAIN>)")
+    parser.add_argument("--domain", default=os.environ.get("AD_DOMAIN"))
+    parser.add_argument("--bind-user", default="Administrator")
+    parser.add_argument("--flavor", choices=sorted(FLAVORS), default="ad")
+    parser.add_argument("--users-dn", help="container for new users (default: users container of the domain)")
+    parser.add_argument("--pool-size", type=int, default=8, help="number of pooled LDAP connections")
+    parser.add_argument("--validate-tls", action="store_true", help="verify the server certificate")
+    parser.add_argument("--no-verify", action="store_true", help="skip the bind check of new users")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s %(name)s %(message)s")
+    missing = [v for v, value in (("AD_DOMAIN", args.domain), ("AD_PASSWD", os.environ.get("AD_PASSWD")),
+                                  ("POSIT_USER_PASS", os.environ.get("POSIT_USER_PASS"))) if not value]
+    if missing:
+        parser.error(f"missing environment variables: {', '.join(missing)}")
+    if args.server and args.server.startswith("mock://") and args.flavor != "openldap":
+        parser.error("the in-memory directory only supports --flavor openldap")
+
+    settings = Settings(server=args.server or f"ldap://{args.domain}", domain=args.domain,
+                        bind_user=args.bind_user, bind_password=os.environ["AD_PASSWD"],
+                        user_password=os.environ["POSIT_USER_PASS"], flavor=args.flavor,
+                        users_dn=args.users_dn, pool_size=args.pool_size, validate_tls=args.validate_tls)
+    names = [f"{args.prefix}{i:04d}" for i in range(1, args.count + 1)]
+    report = asyncio.run(run(settings, names, args.group, not args.no_verify))
+
+    if args.json:
+        print(json.dumps(dict(asdict(report), users_per_second=round(report.users_per_second, 1))))
+    else:
+        print(f"{report.created} created, {report.skipped} skipped, {report.verified} verified, "
+              f"{len(report.failed)} failed, {report.memberships} group memberships added "
+              f"in {report.seconds:.1f} s ({report.users_per_second:.1f} users/s)")
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())